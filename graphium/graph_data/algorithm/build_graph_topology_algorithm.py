@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ QGIS plugin 'Graphium'
+/***************************************************************************
+ *
+ * Copyright 2020 Simon Gröchenig @ Salzburg Research
+ * eMail     graphium@salzburgresearch.at
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ *
+ ***************************************************************************/
+"""
+
+import os
+import time
+# PyQt5 imports
+from PyQt5.QtGui import (QIcon)
+# qgis imports
+from qgis.PyQt.QtCore import QCoreApplication
+from qgis.core import (QgsProcessingAlgorithm, QgsProcessingParameterFile, QgsProcessingOutputFile,
+                       QgsProcessingOutputNumber)
+# plugin
+from ..graph_topology import GraphTopology
+
+
+class BuildGraphTopologyAlgorithm(QgsProcessingAlgorithm):
+    """
+    This algorithm builds the topology file of a local graph file.
+    """
+
+    plugin_path = os.path.split(os.path.split(os.path.split(os.path.dirname(__file__))[0])[0])[0]
+
+    SOURCE_FILE = 'SOURCE_FILE'
+    OUTPUT_FILE = 'OUTPUT_FILE'
+    OUTPUT_NODE_COUNT = 'OUTPUT_NODE_COUNT'
+    OUTPUT_EDGE_COUNT = 'OUTPUT_EDGE_COUNT'
+
+    def __init__(self):
+        super().__init__()
+
+        self.alg_group = "Graph Data"
+        self.alg_group_id = "graphdata"
+        self.alg_name = "buildgraphtopology"
+        self.alg_display_name = "Build graph topology file"
+
+    def createInstance(self):
+        return BuildGraphTopologyAlgorithm()
+
+    def group(self):
+        return self.tr(self.alg_group)
+
+    def groupId(self):
+        return self.alg_group_id
+
+    def name(self):
+        return self.alg_name
+
+    def displayName(self):
+        return self.tr(self.alg_display_name)
+
+    def shortHelpString(self):
+        return self.tr('This algorithm builds the topology (node and edge arrays with forward and backward '
+                       'adjacency) of a local graph version JSON file and saves it next to the graph file (suffix '
+                       '.topology). The local routing, map matching and analysis algorithms memory-map this file '
+                       'instead of parsing the graph file again, also in their worker processes.\n\n'
+                       'The topology file is ignored as soon as the graph file is modified.')
+
+    def icon(self):
+        return QIcon(os.path.join(self.plugin_path, 'icons/icon.svg'))
+
+    def tr(self, string):
+        """
+        Returns a translatable string with the self.tr() function.
+        """
+        return QCoreApplication.translate('Processing', string)
+
+    def initAlgorithm(self, config=None):
+        """
+        Definition of inputs and outputs of the algorithm, along with some other properties.
+        """
+
+        self.addParameter(QgsProcessingParameterFile(self.SOURCE_FILE, self.tr('Input graph file'),
+                                                     QgsProcessingParameterFile.Behavior.File, optional=False))
+
+        self.addOutput(QgsProcessingOutputFile(self.OUTPUT_FILE, self.tr('Topology file')))
+        self.addOutput(QgsProcessingOutputNumber(self.OUTPUT_NODE_COUNT, self.tr('Number of nodes')))
+        self.addOutput(QgsProcessingOutputNumber(self.OUTPUT_EDGE_COUNT, self.tr('Number of directed edges')))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        source_file = self.parameterAsFile(parameters, self.SOURCE_FILE, context)
+
+        if not os.path.isfile(source_file):
+            feedback.reportError('Cannot find input graph file!', True)
+            return {self.OUTPUT_FILE: None}
+
+        start_time = time.time()
+        feedback.pushInfo('Read topology of graph file...')
+        try:
+            topology = GraphTopology.from_file(source_file, feedback)
+        except ValueError as e:
+            feedback.reportError('Cannot read graph file: ' + str(e), True)
+            return {self.OUTPUT_FILE: None}
+        if topology is None:
+            return {self.OUTPUT_FILE: None}
+        feedback.setProgress(80)
+
+        topology_file = GraphTopology.store_file(source_file)
+        try:
+            topology.save(topology_file, source_file)
+        except OSError as e:
+            feedback.reportError('Cannot write topology file: ' + str(e), True)
+            return {self.OUTPUT_FILE: None}
+
+        feedback.pushInfo('Saved topology with ' + str(topology.segment_count) + ' segments, ' +
+                          str(topology.node_count) + ' nodes and ' + str(topology.edge_count) + ' edges to ' +
+                          topology_file + ' after ' + str(round(time.time() - start_time)) + ' seconds')
+        feedback.setProgress(100)
+        return {self.OUTPUT_FILE: topology_file,
+                self.OUTPUT_NODE_COUNT: topology.node_count,
+                self.OUTPUT_EDGE_COUNT: topology.edge_count}
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ QGIS plugin 'Graphium'
+/***************************************************************************
+ *
+ * Copyright 2020 Simon Gröchenig @ Salzburg Research
+ * eMail     graphium@salzburgresearch.at
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ *
+ ***************************************************************************/
+"""
+
+import os
+# PyQt5 imports
+from PyQt5.QtCore import QVariant
+from PyQt5.QtGui import (QIcon)
+# qgis imports
+from qgis.PyQt.QtCore import QCoreApplication
+from qgis.core import (QgsProcessingAlgorithm, QgsProcessingParameterFile, QgsProcessingParameterEnum,
+                       QgsProcessingParameterBoolean, QgsProcessingParameterFeatureSink, QgsProcessingOutputNumber,
+                       QgsProcessing, QgsFeature, QgsFeatureSink, QgsFields, QgsField, QgsWkbTypes,
+                       QgsCoordinateReferenceSystem, QgsGeometry, QgsPointXY)
+# plugin
+from .. import connectivity
+from ..graph_topology import GraphTopologyCache
+from ...graph_management.model.access import Access
+
+
+class ConnectivityAnalysisAlgorithm(QgsProcessingAlgorithm):
+    """
+    This algorithm calculates the weakly and strongly connected components of a graph version.
+    """
+
+    plugin_path = os.path.split(os.path.split(os.path.split(os.path.dirname(__file__))[0])[0])[0]
+
+    SOURCE_FILE = 'SOURCE_FILE'
+    ACCESS_TYPE = 'ACCESS_TYPE'
+    ONLY_DISCONNECTED = 'ONLY_DISCONNECTED'
+    OUTPUT = 'OUTPUT'
+    OUTPUT_WCC_COUNT = 'OUTPUT_WCC_COUNT'
+    OUTPUT_SCC_COUNT = 'OUTPUT_SCC_COUNT'
+    OUTPUT_DISCONNECTED_COUNT = 'OUTPUT_DISCONNECTED_COUNT'
+
+    batch_size = 10000
+
+    def __init__(self):
+        super().__init__()
+
+        self.alg_group = "Graph Data"
+        self.alg_group_id = "graphdata"
+        self.alg_name = "connectivityanalysis"
+        self.alg_display_name = "Connectivity analysis"
+
+        self.access_options = ['ALL (ignore access)']
+        self.access_option_values = [None]
+        for access in Access:
+            if access.value > 0:
+                self.access_options.append(str(access.value) + ' - ' + access.name)
+                self.access_option_values.append(access.name)
+
+    def createInstance(self):
+        return ConnectivityAnalysisAlgorithm()
+
+    def group(self):
+        return self.tr(self.alg_group)
+
+    def groupId(self):
+        return self.alg_group_id
+
+    def name(self):
+        return self.alg_name
+
+    def displayName(self):
+        return self.tr(self.alg_display_name)
+
+    def shortHelpString(self):
+        return self.tr('This algorithm checks a local graph version JSON file for islands and unreachable segments '
+                       'before the graph version is activated.\n\n'
+                       'Weakly connected components ignore the direction of the segments, strongly connected '
+                       'components contain the segments which can be reached from each other respecting accessTow / '
+                       'accessBkw of the selected access type. Components are numbered by their number of segments '
+                       '(0 = largest); segments which are not part of a component (not accessible or one-way '
+                       'connections between components) get the ID -1.\n\n'
+                       'All segments outside the largest strongly connected component are counted as disconnected.')
+
+    def icon(self):
+        return QIcon(os.path.join(self.plugin_path, 'icons/icon.svg'))
+
+    def tr(self, string):
+        """
+        Returns a translatable string with the self.tr() function.
+        """
+        return QCoreApplication.translate('Processing', string)
+
+    def initAlgorithm(self, config=None):
+        """
+        Definition of inputs and outputs of the algorithm, along with some other properties.
+        """
+
+        self.addParameter(QgsProcessingParameterFile(self.SOURCE_FILE, self.tr('Input graph file'),
+                                                     QgsProcessingParameterFile.Behavior.File, optional=False))
+        self.addParameter(QgsProcessingParameterEnum(self.ACCESS_TYPE, self.tr('Access type'),
+                                                     self.access_options, False,
+                                                     self.access_option_values.index(Access.PRIVATE_CAR.name),
+                                                     False))
+        self.addParameter(QgsProcessingParameterBoolean(self.ONLY_DISCONNECTED,
+                                                        self.tr('Only output disconnected segments'), False, True))
+
+        self.addParameter(QgsProcessingParameterFeatureSink(self.OUTPUT, self.tr('Connected components'),
+                                                            QgsProcessing.TypeVectorLine))
+        self.addOutput(QgsProcessingOutputNumber(self.OUTPUT_WCC_COUNT,
+                                                 self.tr('Number of weakly connected components')))
+        self.addOutput(QgsProcessingOutputNumber(self.OUTPUT_SCC_COUNT,
+                                                 self.tr('Number of strongly connected components')))
+        self.addOutput(QgsProcessingOutputNumber(self.OUTPUT_DISCONNECTED_COUNT,
+                                                 self.tr('Number of disconnected segments')))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        source_file = self.parameterAsFile(parameters, self.SOURCE_FILE, context)
+        access_type = self.access_option_values[self.parameterAsInt(parameters, self.ACCESS_TYPE, context)]
+        only_disconnected = self.parameterAsBool(parameters, self.ONLY_DISCONNECTED, context)
+
+        if not os.path.isfile(source_file):
+            feedback.reportError('Cannot find input graph file!', True)
+            return {self.OUTPUT: None}
+
+        feedback.pushInfo('Read topology of graph file...')
+        try:
+            topology = GraphTopologyCache.get(source_file, feedback)
+        except ValueError as e:
+            feedback.reportError('Cannot read graph file: ' + str(e), True)
+            return {self.OUTPUT: None}
+        if topology is None:
+            return {self.OUTPUT: None}
+        feedback.setProgress(30)
+
+        feedback.pushInfo('Calculate connected components of ' + str(topology.segment_count) + ' segments')
+        result = connectivity.analyse(topology, [access_type] if access_type is not None else None)
+        wcc, wcc_sizes, scc, scc_sizes = result['wcc'], result['wcc_sizes'], result['scc'], result['scc_sizes']
+        disconnected_count = topology.segment_count - (scc_sizes[0] if scc_sizes else 0)
+        feedback.pushInfo(str(len(wcc_sizes)) + ' weakly and ' + str(len(scc_sizes)) +
+                          ' strongly connected components')
+        if disconnected_count > 0:
+            feedback.pushInfo(str(disconnected_count) + ' of ' + str(topology.segment_count) +
+                              ' segments are not part of the largest strongly connected component')
+        feedback.setProgress(60)
+
+        fields = QgsFields()
+        fields.append(QgsField('segment_id', QVariant.LongLong, 'Integer'))
+        fields.append(QgsField('wcc_id', QVariant.Int, 'Integer'))
+        fields.append(QgsField('wcc_size', QVariant.Int, 'Integer'))
+        fields.append(QgsField('scc_id', QVariant.Int, 'Integer'))
+        fields.append(QgsField('scc_size', QVariant.Int, 'Integer'))
+        (sink, dest_id) = self.parameterAsSink(parameters, self.OUTPUT, context, fields, QgsWkbTypes.LineString,
+                                               QgsCoordinateReferenceSystem(4326))
+
+        features = []
+        for segment in range(topology.segment_count):
+            if only_disconnected and scc[segment] == 0:
+                continue
+            feature = QgsFeature(fields)
+            feature.setGeometry(QgsGeometry.fromPolylineXY([QgsPointXY(x, y) for x, y in
+                                                            topology.segment_coordinates(segment)]))
+            feature.setAttributes([topology.segment_ids[segment],
+                                   wcc[segment], wcc_sizes[wcc[segment]] if wcc[segment] != -1 else 0,
+                                   scc[segment], scc_sizes[scc[segment]] if scc[segment] != -1 else 0])
+            features.append(feature)
+            if len(features) >= self.batch_size:
+                if feedback.isCanceled():
+                    return {self.OUTPUT: None}
+                sink.addFeatures(features, QgsFeatureSink.FastInsert)
+                features.clear()
+                feedback.setProgress(60 + 40 * segment / topology.segment_count)
+        sink.addFeatures(features, QgsFeatureSink.FastInsert)
+
+        feedback.setProgress(100)
+        return {self.OUTPUT: dest_id,
+                self.OUTPUT_WCC_COUNT: len(wcc_sizes),
+                self.OUTPUT_SCC_COUNT: len(scc_sizes),
+                self.OUTPUT_DISCONNECTED_COUNT: disconnected_count}
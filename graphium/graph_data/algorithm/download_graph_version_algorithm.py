@@ -25,6 +25,7 @@
 
 import os
 import json
+import gzip
 # PyQt5 imports
 from PyQt5.QtGui import (QIcon)
 from PyQt5.QtCore import (QVariant)
@@ -36,6 +37,7 @@ from qgis.core import (QgsVectorLayer, QgsProcessingAlgorithm, QgsProcessingPara
                        QgsProcessingParameterBoolean, QgsProcessingParameterFileDestination)
 # plugin
 from ....graphium.graphium_graph_data_api import GraphiumGraphDataApi
+from ....graphium.graph_data.graph_json_stream import GraphJsonStreamParser
 from ....graphium.graphium_graph_management_api import GraphiumGraphManagementApi
 from ....graphium.connection.graphium_connection_manager import GraphiumConnectionManager
 from ....graphium.settings import Settings
@@ -51,10 +53,15 @@ class DownloadGraphVersionAlgorithm(QgsProcessingAlgorithm):
     GRAPH_VERSION = 'GRAPH_VERSION'
 
     SAVE_JSON_FILE = 'SAVE_JSON_FILE'
+    COMPRESS_JSON_FILE = 'COMPRESS_JSON_FILE'
+    ATTRIBUTES = 'ATTRIBUTES'
     OUTPUT_SEGMENT_COUNT = 'OUTPUT_SEGMENT_COUNT'
     OUTPUT_SEGMENTS = 'OUTPUT_SEGMENTS'
     OUTPUT_JSON = 'OUTPUT_JSON'
 
+    # ETag / Last-Modified of a saved JSON graph file are stored next to it in a file with this suffix
+    validators_suffix = '.validators.json'
+
     plugin_path = os.path.split(os.path.split(os.path.split(os.path.dirname(__file__))[0])[0])[0]
 
     def __init__(self):
@@ -69,6 +76,12 @@ class DownloadGraphVersionAlgorithm(QgsProcessingAlgorithm):
         self.connection_options = list()
         self.settings = Settings()
 
+        self.attribute_options = ['name', 'startNodeIndex', 'startNodeId', 'endNodeIndex', 'endNodeId',
+                                  'maxSpeedTow', 'maxSpeedBkw', 'calcSpeedTow', 'calcSpeedBkw', 'lanesTow', 'lanesBkw',
+                                  'frc', 'formOfWay', 'accessTow', 'accessBkw', 'tunnel', 'bridge', 'urban', 'tags',
+                                  'connection', 'leftBorderGeometry', 'leftBorderStartNodeId', 'leftBorderEndNodeId',
+                                  'rightBorderGeometry', 'rightBorderStartNodeId', 'rightBorderEndNodeId']
+
     def createInstance(self):
         return DownloadGraphVersionAlgorithm()
 
@@ -89,7 +102,13 @@ class DownloadGraphVersionAlgorithm(QgsProcessingAlgorithm):
 
     def shortHelpString(self):
         return self.tr('This algorithms downloads all segments of a graph version dataset. A new layer containing all '
-                       'way segments is added to the map.')
+                       'way segments is added to the map.\n\n'
+                       'If "Save JSON file" is checked, the server response is written unparsed to the JSON graph file '
+                       '(optionally gzip compressed). Skip the segments output to only back up the graph version. '
+                       'ETag and Last-Modified of the response are saved next to the JSON graph file; if the graph '
+                       'version has not been modified since, the file is not downloaded again but reused.\n\n'
+                       'Only the selected segment attributes are added to the segments output. The segment ID and '
+                       'the geometry are always included.')
 
     def icon(self):
         return QIcon(os.path.join(self.plugin_path, 'icons/icon.svg'))
@@ -136,12 +155,21 @@ class DownloadGraphVersionAlgorithm(QgsProcessingAlgorithm):
         self.addParameter(QgsProcessingParameterBoolean(self.SAVE_JSON_FILE, self.tr('Save JSON file'),
                                                         'False', True))
 
+        self.addParameter(QgsProcessingParameterBoolean(self.COMPRESS_JSON_FILE,
+                                                        self.tr('Compress JSON file (gzip)'), False, True))
+
+        self.addParameter(QgsProcessingParameterEnum(self.ATTRIBUTES,
+                                                     self.tr('Segment attributes (all attributes if none selected)'),
+                                                     self.attribute_options, True, None, True))
+
         # We add a vector layer as output
         self.addParameter(QgsProcessingParameterFeatureSink(self.OUTPUT_SEGMENTS, self.tr('Segments'),
-                                                            QgsProcessing.TypeVectorLine))
+                                                            QgsProcessing.TypeVectorLine, optional=True,
+                                                            createByDefault=True))
 
         self.addParameter(QgsProcessingParameterFileDestination(self.OUTPUT_JSON, self.tr('JSON graph file'),
-                                                                'JSON files (*.json)', optional=True))
+                                                                'JSON files (*.json);;Compressed JSON files '
+                                                                '(*.json.gz)', optional=True))
 
         self.addOutput(QgsProcessingOutputNumber(self.OUTPUT_SEGMENT_COUNT, self.tr('Number of segments')))
 
@@ -152,7 +180,16 @@ class DownloadGraphVersionAlgorithm(QgsProcessingAlgorithm):
         graph_name = self.parameterAsString(parameters, self.GRAPH_NAME, context)
         graph_version = self.parameterAsString(parameters, self.GRAPH_VERSION, context)
         save_json_file = self.parameterAsBoolean(parameters, self.SAVE_JSON_FILE, context)
+        compress_json_file = self.parameterAsBoolean(parameters, self.COMPRESS_JSON_FILE, context)
         json_file = self.parameterAsFileOutput(parameters, self.OUTPUT_JSON, context)
+        attribute_indexes = self.parameterAsEnums(parameters, self.ATTRIBUTES, context)
+        attributes = [self.attribute_options[i] for i in attribute_indexes] if attribute_indexes else None
+
+        if save_json_file and json_file == '':
+            feedback.reportError('No JSON graph file selected', True)
+            return {self.OUTPUT_SEGMENTS: None}
+        if json_file.lower().endswith('.gz'):
+            compress_json_file = True
 
         # Connect to Graphium
         feedback.pushInfo("Connect to Graphium server '" + server_name + "' ...")
@@ -174,68 +211,177 @@ class DownloadGraphVersionAlgorithm(QgsProcessingAlgorithm):
 
         metadata = graphium_management.get_graph_version_metadata(graph_name, graph_version)
 
-        if not metadata['type']:
+        if 'error' in metadata:
+            if 'msg' in metadata['error']:
+                feedback.reportError(metadata['error']['msg'], True)
+            return {self.OUTPUT_SEGMENT_COUNT: 0}
+        if not metadata.get('type'):
             feedback.reportError('Cannot correctly retrieve graph metadata', True)
             return {self.OUTPUT_SEGMENTS: None}
+        if metadata.get('state') == 'DELETED':
+            feedback.reportError('Graph version has been deleted', False)
+            return {self.OUTPUT_SEGMENT_COUNT: 0}
 
-        feedback.pushInfo("Start downloading task on Graphium server '" + server_name + "' ...")
-        response = graphium_data.export_graph(graph_name, graph_version, metadata.get('type') == 'hdwaysegment')
+        segment_type = metadata['type']
 
+        # The layer is only built if requested. Without a layer output the response is not parsed at all.
+        vector_layer = self.prepare_vector_layer('segments_' + graph_name + '_' + graph_version, segment_type,
+                                                 attributes)
+        (sink, dest_id) = self.parameterAsSink(parameters, self.OUTPUT_SEGMENTS, context, vector_layer.fields(),
+                                               QgsWkbTypes.LineString, vector_layer.sourceCrs())
+
+        if sink is None and not save_json_file:
+            feedback.reportError('Neither a segment layer nor a JSON graph file has been selected as output', True)
+            return {self.OUTPUT_SEGMENT_COUNT: 0}
+
+        json_output = None
+        validators = None
+        validators_key = {'url': selected_connection.get_connection_url(), 'graph_name': graph_name,
+                          'graph_version': graph_version, 'type': segment_type, 'compressed': compress_json_file}
         if save_json_file:
-            feedback.pushInfo("Write graph to JSON file...")
-            with open(json_file, 'w') as output_file:
-                output_file.write(json.dumps(response))
+            validators = self.read_validators(json_file, validators_key)
+            feedback.pushInfo("Write graph to " + ("compressed " if compress_json_file else "") + "JSON file...")
+            # the file is replaced after the download has finished, so it can still be reused if nothing is received
+            json_output = gzip.open(json_file + '.part', 'wb') if compress_json_file \
+                else open(json_file + '.part', 'wb')
+
+        # unselected attributes are dropped by the parser as soon as a segment has been decoded
+        stream_parser = GraphJsonStreamParser(item_keys=vector_layer.fields().names() + ['geometry']
+                                              if attributes is not None else None) if sink is not None else None
+        segments_count = metadata.get('segmentsCount', 0)
+        total = 100.0 / segments_count if segments_count else 0
+        stream_state = {'segments': 0}
+
+        def process_chunk(chunk):
+            if json_output is not None:
+                json_output.write(chunk)
+            if stream_parser is not None:
+                self.add_segment_features(stream_parser.feed(chunk), segment_type, vector_layer.fields(), sink,
+                                          stream_state, feedback, total)
 
-        feedback.setCurrentStep(1)
-        if 'graphVersionMetadata' in response:
-            # if response['graphVersionMetadata']['segmentsCount'] == 0:
-            #     feedback.reportError('No segments available', False)
-            #     return {self.OUTPUT_SEGMENT_COUNT: 0}
-            # elif response['graphVersionMetadata']['state'] == 'DELETED':
-            if response['graphVersionMetadata']['state'] == 'DELETED':
-                feedback.reportError('Graph version has been deleted', False)
-                return {self.OUTPUT_SEGMENT_COUNT: 0}
-        elif 'error' in response:
+        feedback.pushInfo("Start downloading task on Graphium server '" + server_name + "' ...")
+        try:
+            response = graphium_data.export_graph_streamed(graph_name, graph_version, process_chunk,
+                                                           segment_type == 'hdwaysegment', validators)
+            if 'error' not in response and not response.get('not_modified') and stream_parser is not None:
+                self.add_segment_features(stream_parser.close(), segment_type, vector_layer.fields(), sink,
+                                          stream_state, feedback, total)
+        except json.JSONDecodeError as e:
+            response = {'error': {'msg': 'JSON Decode Error from position ' + str(e.pos) + ': ' + e.msg}}
+        finally:
+            if json_output is not None:
+                json_output.close()
+
+        if save_json_file and ('error' in response or response.get('not_modified')):
+            os.remove(json_file + '.part')
+        if 'error' in response:
             if 'msg' in response['error']:
                 feedback.reportError(response['error']['msg'], True)
             return {self.OUTPUT_SEGMENT_COUNT: 0}
-        else:
-            feedback.reportError('Unknown error', True)
-            return {self.OUTPUT_SEGMENT_COUNT: 0}
 
-        feedback.pushInfo("Prepare result vector layer ...")
-        vector_layer = self.prepare_vector_layer('segments_' + graph_name + '_' + graph_version,
-                                                 response['graphVersionMetadata']['type'])
+        if response.get('not_modified'):
+            feedback.pushInfo('Graph version has not been modified since the JSON graph file has been saved, '
+                              'the file is reused')
+            if stream_parser is not None:
+                try:
+                    with GraphJsonStreamParser.open_file(json_file) as f:
+                        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                            if feedback.isCanceled():
+                                break
+                            self.add_segment_features(stream_parser.feed(chunk), segment_type,
+                                                      vector_layer.fields(), sink, stream_state, feedback, total)
+                    if not feedback.isCanceled():
+                        self.add_segment_features(stream_parser.close(), segment_type, vector_layer.fields(), sink,
+                                                  stream_state, feedback, total)
+                except json.JSONDecodeError as e:
+                    feedback.reportError('JSON Decode Error from position ' + str(e.pos) + ': ' + e.msg, True)
+                    return {self.OUTPUT_SEGMENT_COUNT: 0}
+        elif save_json_file:
+            os.replace(json_file + '.part', json_file)
+            self.write_validators(json_file, validators_key, response)
 
-        (sink, dest_id) = self.parameterAsSink(parameters, self.OUTPUT_SEGMENTS, context, vector_layer.fields(),
-                                               QgsWkbTypes.LineString, vector_layer.sourceCrs())
+        feedback.setCurrentStep(1)
+        if sink is not None:
+            feedback.pushInfo("Finished preparing vector layer " + dest_id)
+        return {self.OUTPUT_SEGMENTS: dest_id if sink is not None else None,
+                self.OUTPUT_JSON: json_file if save_json_file else None,
+                self.OUTPUT_SEGMENT_COUNT: stream_state['segments'] if sink is not None else segments_count
+                }
+
+    @staticmethod
+    def read_validators(json_file, validators_key):
+        """
+        Reads ETag and Last-Modified of the response a JSON graph file has been saved from
+        :param validators_key: dict identifying the export (server, graph name and version, type, compression)
+        :return: dict with 'etag' and 'last_modified' or None if the file has been changed or saved from another
+                 export
+        """
+        try:
+            with open(json_file + DownloadGraphVersionAlgorithm.validators_suffix, 'r', encoding='utf-8') as f:
+                validators = json.load(f)
+            stat = os.stat(json_file)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(validators, dict) or validators.get('key') != validators_key or \
+                validators.get('size') != stat.st_size or validators.get('mtime') != stat.st_mtime:
+            return None
+        return validators
+
+    @staticmethod
+    def write_validators(json_file, validators_key, response):
+        """
+        Saves ETag and Last-Modified of the response next to the JSON graph file
+        """
+        validators_file = json_file + DownloadGraphVersionAlgorithm.validators_suffix
+        if not response.get('etag') and not response.get('last_modified'):
+            if os.path.isfile(validators_file):
+                os.remove(validators_file)
+            return
+        stat = os.stat(json_file)
+        with open(validators_file, 'w', encoding='utf-8') as f:
+            json.dump({'key': validators_key, 'etag': response.get('etag'),
+                       'last_modified': response.get('last_modified'), 'size': stat.st_size,
+                       'mtime': stat.st_mtime}, f, indent=1)
 
-        total = 100.0 / len(response[response['graphVersionMetadata']['type']])
-        for current, segment in enumerate(response[response['graphVersionMetadata']['type']]):
+    @staticmethod
+    def add_segment_features(events, segment_type, fields, sink, stream_state, feedback, total):
+        """
+        Adds all segments of parsed stream events to the sink
+        """
+        for key, value, is_array_item in events:
             if feedback.isCanceled():
                 break
-            feature = QgsFeature()
-            feature.setGeometry(QgsGeometry.fromWkt(segment['geometry']))
-            feature.setFields(vector_layer.fields(), True)
-            for attribute_key in segment:
-                try:
-                    if attribute_key == 'tags' or attribute_key == 'connection':
-                        feature.setAttribute(attribute_key, json.dumps(segment[attribute_key]))
-                    else:
-                        feature.setAttribute(attribute_key, segment[attribute_key])
-                except KeyError:
-                    pass
-            sink.addFeature(feature, QgsFeatureSink.FastInsert)
-            feedback.setProgress(int(current * total))
-
-        feedback.pushInfo("Finished preparing vector layer " + dest_id)
-        return {self.OUTPUT_SEGMENTS: dest_id,
-                self.OUTPUT_JSON: json_file if save_json_file else None,
-                self.OUTPUT_SEGMENT_COUNT: response['graphVersionMetadata']['segmentsCount']
-                }
+            if not is_array_item or key != segment_type:
+                continue
+            sink.addFeature(DownloadGraphVersionAlgorithm.create_feature(value, fields), QgsFeatureSink.FastInsert)
+            stream_state['segments'] += 1
+            feedback.setProgress(int(stream_state['segments'] * total))
+
+    @staticmethod
+    def create_feature(segment, fields):
+        feature = QgsFeature()
+        feature.setGeometry(QgsGeometry.fromWkt(segment['geometry']))
+        feature.setFields(fields, True)
+        for attribute_key in segment:
+            # attributes without field are dropped before they are serialized
+            field_index = fields.indexOf(attribute_key)
+            if field_index < 0:
+                continue
+            if attribute_key == 'tags' or attribute_key == 'connection':
+                feature.setAttribute(field_index, json.dumps(segment[attribute_key]))
+            else:
+                feature.setAttribute(field_index, segment[attribute_key])
+        return feature
 
     @staticmethod
-    def prepare_vector_layer(layer_name, layer_type):
+    def prepare_vector_layer(layer_name, layer_type, selected_attributes=None):
+        """
+        Prepares a memory layer with the segment fields
+        :param layer_name:
+        :param layer_type: waysegment or hdwaysegment
+        :param selected_attributes: list of attribute names; all attributes if None (field 'id' is always included)
+        :return: vector layer
+        """
         layer_definition = 'LineString?crs=epsg:4326'
         vector_layer = QgsVectorLayer(layer_definition, layer_name, "memory")
         data_provider = vector_layer.dataProvider()
@@ -274,6 +420,8 @@ class DownloadGraphVersionAlgorithm(QgsProcessingAlgorithm):
             attributes.append(QgsField('rightBorderGeometry', QVariant.String, 'String'))
             attributes.append(QgsField('rightBorderStartNodeId', QVariant.LongLong, 'Integer'))
             attributes.append(QgsField('rightBorderEndNodeId', QVariant.LongLong, 'Integer'))
+        if selected_attributes is not None:
+            attributes = [a for a in attributes if a.name() == 'id' or a.name() in selected_attributes]
         data_provider.addAttributes(attributes)
         vector_layer.updateFields()
 
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ QGIS plugin 'Graphium'
+/***************************************************************************
+ *
+ * Copyright 2020 Simon Gröchenig @ Salzburg Research
+ * eMail     graphium@salzburgresearch.at
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ *
+ ***************************************************************************/
+"""
+
+import os
+import json
+# PyQt5 imports
+from PyQt5.QtGui import (QIcon)
+# qgis imports
+from qgis.PyQt.QtCore import QCoreApplication
+from qgis.core import (QgsProcessingAlgorithm, QgsProcessingParameterFile, QgsProcessingParameterEnum,
+                       QgsProcessingParameterFeatureSink, QgsProcessingOutputNumber, QgsFeatureSink, QgsWkbTypes,
+                       QgsProcessing)
+from qgis import processing
+# plugin
+from ....graphium.graph_data.graph_json_stream import GraphJsonStreamParser
+from .download_graph_version_algorithm import DownloadGraphVersionAlgorithm
+
+
+class LoadGraphFileAlgorithm(QgsProcessingAlgorithm):
+    """
+    This algorithm loads the segments of a local graph version JSON file.
+    """
+
+    SOURCE_FILE = 'SOURCE_FILE'
+    ATTRIBUTES = 'ATTRIBUTES'
+    OUTPUT_SEGMENT_COUNT = 'OUTPUT_SEGMENT_COUNT'
+    OUTPUT_SEGMENTS = 'OUTPUT_SEGMENTS'
+
+    plugin_path = os.path.split(os.path.split(os.path.split(os.path.dirname(__file__))[0])[0])[0]
+
+    # number of features added to the sink at once
+    batch_size = 1000
+
+    def __init__(self):
+        super().__init__()
+
+        self.alg_group = "Graph Data"
+        self.alg_group_id = "graphdata"
+        self.alg_name = "LoadGraphFile"
+        self.alg_display_name = "Load Graph File"
+
+        self.attribute_options = DownloadGraphVersionAlgorithm().attribute_options
+        self.dest_id = None
+
+    def createInstance(self):
+        return LoadGraphFileAlgorithm()
+
+    def group(self):
+        return self.tr(self.alg_group)
+
+    def groupId(self):
+        return self.alg_group_id
+
+    def name(self):
+        return self.alg_name
+
+    def displayName(self):
+        return self.tr(self.alg_display_name)
+
+    def shortHelpString(self):
+        return self.tr('This algorithm loads all segments of a local graph version JSON file (optionally gzip '
+                       'compressed), e.g. the output of the OSM or GIP converter, without uploading it to a Graphium '
+                       'server. The file is read as stream.\n\n'
+                       'Only the selected segment attributes are added to the segments output. The segment ID and '
+                       'the geometry are always included. Temporary outputs are written to a file in the default '
+                       'vector format (GeoPackage unless configured otherwise in the processing settings); a spatial '
+                       'index is created for the output.')
+
+    def icon(self):
+        return QIcon(os.path.join(self.plugin_path, 'icons/icon.svg'))
+
+    def tr(self, string):
+        """
+        Returns a translatable string with the self.tr() function.
+        """
+        return QCoreApplication.translate('Processing', string)
+
+    def initAlgorithm(self, config=None):
+        """
+        Definition of inputs and outputs of the algorithm, along with some other properties.
+        """
+
+        self.addParameter(QgsProcessingParameterFile(self.SOURCE_FILE, self.tr('Input graph file'),
+                                                     QgsProcessingParameterFile.Behavior.File, optional=False))
+
+        self.addParameter(QgsProcessingParameterEnum(self.ATTRIBUTES,
+                                                     self.tr('Segment attributes (all attributes if none selected)'),
+                                                     self.attribute_options, True, None, True))
+
+        segments_parameter = QgsProcessingParameterFeatureSink(self.OUTPUT_SEGMENTS, self.tr('Segments'),
+                                                               QgsProcessing.TypeVectorLine)
+        # temporary outputs are written to a file (GeoPackage by default) instead of a memory layer
+        segments_parameter.setSupportsNonFileBasedOutput(False)
+        self.addParameter(segments_parameter)
+
+        self.addOutput(QgsProcessingOutputNumber(self.OUTPUT_SEGMENT_COUNT, self.tr('Number of segments')))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        source_file = self.parameterAsFile(parameters, self.SOURCE_FILE, context)
+        attribute_indexes = self.parameterAsEnums(parameters, self.ATTRIBUTES, context)
+        attributes = [self.attribute_options[i] for i in attribute_indexes] if attribute_indexes else None
+
+        if not os.path.isfile(source_file):
+            feedback.reportError('Cannot find input graph file!', True)
+            return {self.OUTPUT_SEGMENTS: None}
+
+        file_size = os.path.getsize(source_file)
+        parser = GraphJsonStreamParser()
+        # sink and fields are prepared as soon as the segment type is known
+        output = {'sink': None, 'dest_id': None, 'fields': None, 'segment_type': None, 'segments': 0}
+        features = []
+
+        def prepare_sink(segment_type):
+            """
+            :return: True if the sink has been created
+            """
+            feedback.pushInfo('Prepare ' + segment_type + ' layer')
+            vector_layer = DownloadGraphVersionAlgorithm.prepare_vector_layer(
+                'segments_' + os.path.basename(source_file), segment_type, attributes)
+            output['fields'] = vector_layer.fields()
+            output['segment_type'] = segment_type
+            (output['sink'], output['dest_id']) = self.parameterAsSink(parameters, self.OUTPUT_SEGMENTS, context,
+                                                                       output['fields'], QgsWkbTypes.LineString,
+                                                                       vector_layer.sourceCrs())
+            return output['sink'] is not None
+
+        def process_events(events):
+            """
+            :return: False if the sink cannot be created
+            """
+            for key, value, is_array_item in events:
+                if not is_array_item:
+                    if key == GraphJsonStreamParser.METADATA_KEY and output['segment_type'] is None and \
+                            isinstance(value, dict) and value.get('type') in GraphJsonStreamParser.SEGMENT_KEYS:
+                        if not prepare_sink(value['type']):
+                            return False
+                    continue
+                if key not in GraphJsonStreamParser.SEGMENT_KEYS:
+                    continue
+                if output['segment_type'] is None and not prepare_sink(key):
+                    return False
+                if key != output['segment_type']:
+                    continue
+                features.append(DownloadGraphVersionAlgorithm.create_feature(value, output['fields']))
+                output['segments'] += 1
+                if len(features) >= self.batch_size:
+                    output['sink'].addFeatures(features, QgsFeatureSink.FastInsert)
+                    features.clear()
+            return True
+
+        try:
+            with GraphJsonStreamParser.open_file(source_file) as f:
+                # progress is calculated from the position in the (compressed) file
+                raw_file = getattr(f, 'fileobj', f)
+                while not feedback.isCanceled():
+                    chunk = f.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    if not process_events(parser.feed(chunk)):
+                        feedback.reportError('Cannot create segments output', True)
+                        return {self.OUTPUT_SEGMENTS: None}
+                    if file_size > 0:
+                        feedback.setProgress(90 * raw_file.tell() / file_size)
+                if not feedback.isCanceled() and not process_events(parser.close()):
+                    feedback.reportError('Cannot create segments output', True)
+                    return {self.OUTPUT_SEGMENTS: None}
+        except json.JSONDecodeError as e:
+            feedback.reportError('JSON Decode Error from position ' + str(e.pos) + ': ' + e.msg, True)
+            return {self.OUTPUT_SEGMENTS: None}
+
+        if output['sink'] is None:
+            feedback.reportError('Graph file does not contain any segments', True)
+            return {self.OUTPUT_SEGMENTS: None}
+        if len(features) > 0:
+            output['sink'].addFeatures(features, QgsFeatureSink.FastInsert)
+
+        if feedback.isCanceled():
+            return {self.OUTPUT_SEGMENTS: None}
+
+        feedback.pushInfo(str(output['segments']) + ' segments loaded')
+        self.dest_id = output['dest_id']
+        return {self.OUTPUT_SEGMENTS: output['dest_id'],
+                self.OUTPUT_SEGMENT_COUNT: output['segments']}
+
+    def postProcessAlgorithm(self, context, feedback):
+        """
+        Creates the spatial index after the output has been written completely
+        """
+        # GeoPackage outputs already have a spatial index
+        if self.dest_id is not None and not self.dest_id.lower().split('|')[0].endswith('.gpkg'):
+            feedback.pushInfo('Create spatial index')
+            processing.run('native:createspatialindex', {'INPUT': self.dest_id}, context=context,
+                           feedback=feedback, is_child_algorithm=True)
+        return {}
@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ QGIS plugin 'Graphium'
+/***************************************************************************
+ *
+ * Copyright 2020 Simon Gröchenig @ Salzburg Research
+ * eMail     graphium@salzburgresearch.at
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ *
+ ***************************************************************************/
+"""
+
+import os
+import json
+import math
+from concurrent.futures import (wait, FIRST_COMPLETED)
+# PyQt5 imports
+from PyQt5.QtCore import QVariant
+from PyQt5.QtGui import (QIcon)
+# qgis imports
+from qgis.PyQt.QtCore import QCoreApplication
+from qgis.core import (QgsProcessingAlgorithm, QgsProcessingParameterFile, QgsProcessingParameterEnum,
+                       QgsProcessingParameterFeatureSource, QgsProcessingParameterField, QgsProcessingParameterNumber,
+                       QgsProcessingParameterFeatureSink, QgsProcessingOutputNumber, QgsProcessing, QgsFeature,
+                       QgsFeatureSink, QgsFields, QgsField, QgsWkbTypes, QgsCoordinateReferenceSystem, QgsGeometry,
+                       QgsPointXY, QgsCoordinateTransform, NULL)
+# plugin
+from .. import segment_snapping
+from ..graph_topology import GraphTopology
+from ...graph_management.model.access import Access
+from ...graph_management.model.function_road_class import FunctionalRoadClass
+from ...utilities.geom_tools import GeomTools
+from ...utilities.process_pool import ProcessPool
+
+
+class SnapToSegmentsAlgorithm(QgsProcessingAlgorithm):
+    """
+    This algorithm snaps points to their nearest segments of a graph version.
+    """
+
+    plugin_path = os.path.split(os.path.split(os.path.split(os.path.dirname(__file__))[0])[0])[0]
+
+    SOURCE_FILE = 'SOURCE_FILE'
+    SEGMENTS = 'SEGMENTS'
+    INPUT = 'INPUT'
+    ID_FIELD = 'ID_FIELD'
+    HEADING_FIELD = 'HEADING_FIELD'
+    MAX_HEADING_DEVIATION = 'MAX_HEADING_DEVIATION'
+    NEAREST_COUNT = 'NEAREST_COUNT'
+    MAX_DISTANCE = 'MAX_DISTANCE'
+    FRCS = 'FRCS'
+    ACCESS_TYPES = 'ACCESS_TYPES'
+    WORKERS = 'WORKERS'
+    OUTPUT = 'OUTPUT'
+    OUTPUT_UNSNAPPED_COUNT = 'OUTPUT_UNSNAPPED_COUNT'
+
+    batch_size = 10000
+
+    def __init__(self):
+        super().__init__()
+
+        self.alg_group = "Graph Data"
+        self.alg_group_id = "graphdata"
+        self.alg_name = "snaptosegments"
+        self.alg_display_name = "Snap points to segments"
+
+        self.frc_options = []
+        self.frc_option_values = []
+        for frc in FunctionalRoadClass:
+            self.frc_options.append(str(frc.value) + ' - ' + frc.name)
+            self.frc_option_values.append(frc.value)
+        self.access_options = []
+        self.access_option_values = []
+        for access in Access:
+            self.access_options.append(str(access.value) + ' - ' + access.name)
+            self.access_option_values.append(access.name)
+
+    def createInstance(self):
+        return SnapToSegmentsAlgorithm()
+
+    def group(self):
+        return self.tr(self.alg_group)
+
+    def groupId(self):
+        return self.alg_group_id
+
+    def name(self):
+        return self.alg_name
+
+    def displayName(self):
+        return self.tr(self.alg_display_name)
+
+    def shortHelpString(self):
+        return self.tr('This algorithm snaps points to their nearest segments of a local graph version JSON file or '
+                       'of a segments layer (e.g. loaded with Load Graph File or Download Graph Version). For each '
+                       'point the k nearest segments are returned with segment ID, offset along the segment '
+                       '(fraction and meters) and distance.\n\n'
+                       'Segments can be filtered by functional road class and access type. If a heading field is '
+                       'set, points are only snapped to segments which are accessible in a direction deviating at '
+                       'most the maximum heading deviation from the heading (degrees, 0 = north, clockwise); the '
+                       'direction is returned in linkDirectionForward.\n\n'
+                       'The segments are indexed in a grid; points of a graph file are snapped in batches in '
+                       'parallel worker processes.')
+
+    def icon(self):
+        return QIcon(os.path.join(self.plugin_path, 'icons/icon.svg'))
+
+    def tr(self, string):
+        """
+        Returns a translatable string with the self.tr() function.
+        """
+        return QCoreApplication.translate('Processing', string)
+
+    def initAlgorithm(self, config=None):
+        """
+        Definition of inputs and outputs of the algorithm, along with some other properties.
+        """
+
+        self.addParameter(QgsProcessingParameterFile(self.SOURCE_FILE, self.tr('Input graph file'),
+                                                     QgsProcessingParameterFile.Behavior.File, optional=True))
+        self.addParameter(QgsProcessingParameterFeatureSource(self.SEGMENTS,
+                                                              self.tr('Segments layer (if no graph file is set)'),
+                                                              [QgsProcessing.TypeVectorLine], None, True))
+        self.addParameter(QgsProcessingParameterFeatureSource(self.INPUT, self.tr('Input points'),
+                                                              [QgsProcessing.TypeVectorPoint], None, False))
+        self.addParameter(QgsProcessingParameterField(self.ID_FIELD, self.tr('ID field (feature ID if not set)'),
+                                                      parentLayerParameterName=self.INPUT, optional=True))
+        self.addParameter(QgsProcessingParameterField(self.HEADING_FIELD, self.tr('Heading field'),
+                                                      parentLayerParameterName=self.INPUT,
+                                                      type=QgsProcessingParameterField.Numeric, optional=True))
+        self.addParameter(QgsProcessingParameterNumber(self.MAX_HEADING_DEVIATION,
+                                                       self.tr('Maximum heading deviation [°]'),
+                                                       QgsProcessingParameterNumber.Double, 45, True, 0, 180))
+        self.addParameter(QgsProcessingParameterNumber(self.NEAREST_COUNT, self.tr('Number of nearest segments'),
+                                                       QgsProcessingParameterNumber.Integer, 1, True, 1, 100))
+        self.addParameter(QgsProcessingParameterNumber(self.MAX_DISTANCE,
+                                                       self.tr('Maximum distance [m] (0 = unlimited)'),
+                                                       QgsProcessingParameterNumber.Double, 100, True, 0))
+        self.addParameter(QgsProcessingParameterEnum(self.FRCS, self.tr('Function Road Classes (FRCs)'),
+                                                     self.frc_options, True, None, True))
+        self.addParameter(QgsProcessingParameterEnum(self.ACCESS_TYPES, self.tr('Access types'),
+                                                     self.access_options, True, None, True))
+        self.addParameter(QgsProcessingParameterNumber(self.WORKERS,
+                                                       self.tr('Number of worker processes (0 = automatic)'),
+                                                       QgsProcessingParameterNumber.Integer, 0, True, 0, 64))
+
+        self.addParameter(QgsProcessingParameterFeatureSink(self.OUTPUT, self.tr('Snapped points'),
+                                                            QgsProcessing.TypeVectorPoint))
+        self.addOutput(QgsProcessingOutputNumber(self.OUTPUT_UNSNAPPED_COUNT,
+                                                 self.tr('Number of points without segment')))
+
+    def checkParameterValues(self, parameters, context):
+        ok, message = super(SnapToSegmentsAlgorithm, self).checkParameterValues(parameters, context)
+        if ok and not self.parameterAsFile(parameters, self.SOURCE_FILE, context) and \
+                self.parameterAsSource(parameters, self.SEGMENTS, context) is None:
+            ok, message = False, 'Select a graph file or a segments layer'
+        return ok, message
+
+    def processAlgorithm(self, parameters, context, feedback):
+        source_file = self.parameterAsFile(parameters, self.SOURCE_FILE, context)
+        segments_source = self.parameterAsSource(parameters, self.SEGMENTS, context)
+        source = self.parameterAsSource(parameters, self.INPUT, context)
+        id_field = self.parameterAsString(parameters, self.ID_FIELD, context)
+        heading_field = self.parameterAsString(parameters, self.HEADING_FIELD, context)
+        max_heading_deviation = self.parameterAsDouble(parameters, self.MAX_HEADING_DEVIATION, context)
+        nearest_count = self.parameterAsInt(parameters, self.NEAREST_COUNT, context)
+        max_distance = self.parameterAsDouble(parameters, self.MAX_DISTANCE, context)
+        frc_indexes = self.parameterAsEnums(parameters, self.FRCS, context)
+        access_indexes = self.parameterAsEnums(parameters, self.ACCESS_TYPES, context)
+        workers = self.parameterAsInt(parameters, self.WORKERS, context)
+
+        frcs = [self.frc_option_values[i] for i in frc_indexes] if frc_indexes else None
+        access_types = [self.access_option_values[i] for i in access_indexes] if access_indexes else None
+        max_distance = max_distance if max_distance > 0 else math.inf
+
+        if source_file and not os.path.isfile(source_file):
+            feedback.reportError('Cannot find input graph file!', True)
+            return {self.OUTPUT: None}
+
+        points = GeomTools.read_points_wgs84(source, id_field or None, context.transformContext(),
+                                             [heading_field] if heading_field else None)
+        coordinates = [(p[1], p[2], self.heading(p[3]) if heading_field else None) for p in points]
+        batches = [coordinates[start:start + self.batch_size] for start in range(0, len(points), self.batch_size)]
+        results = []
+
+        if source_file:
+            with ProcessPool(workers) as pool:
+                feedback.pushInfo('Snap ' + str(len(points)) + ' points ' +
+                                  ('in ' + str(pool.max_workers) + ' worker processes' if pool.is_parallel()
+                                   else 'in the current process'))
+                futures = [pool.submit(segment_snapping.snap_batch, source_file, batch, nearest_count, frcs,
+                                       access_types, max_distance, max_heading_deviation) for batch in batches]
+                pending = set(futures)
+                while pending:
+                    if feedback.isCanceled():
+                        pool.shutdown(True)
+                        return {self.OUTPUT: None}
+                    done, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+                    feedback.setProgress(90 * (len(futures) - len(pending)) / max(1, len(futures)))
+                for future in futures:
+                    results.extend(future.result())
+        else:
+            feedback.pushInfo('Index segments layer...')
+            topology = self.topology_of_layer(segments_source, context, feedback)
+            if topology is None:
+                return {self.OUTPUT: None}
+            feedback.pushInfo('Snap ' + str(len(points)) + ' points')
+            for current, batch in enumerate(batches):
+                if feedback.isCanceled():
+                    return {self.OUTPUT: None}
+                results.extend([[(topology.segment_ids[values[0]],) + values[1:] for values in result]
+                                for result in segment_snapping.snap(topology, batch, nearest_count, frcs,
+                                                                    access_types, max_distance,
+                                                                    max_heading_deviation)])
+                feedback.setProgress(90 * (current + 1) / len(batches))
+
+        fields = QgsFields()
+        fields.append(QgsField('point_id', QVariant.String, 'String'))
+        fields.append(QgsField('rank', QVariant.Int, 'Integer'))
+        fields.append(QgsField('segment_id', QVariant.LongLong, 'Integer'))
+        fields.append(QgsField('fraction', QVariant.Double, 'Real'))
+        fields.append(QgsField('offset', QVariant.Double, 'Real'))
+        fields.append(QgsField('distance', QVariant.Double, 'Real'))
+        fields.append(QgsField('linkDirectionForward', QVariant.Bool, 'Boolean'))
+        (sink, dest_id) = self.parameterAsSink(parameters, self.OUTPUT, context, fields, QgsWkbTypes.Point,
+                                               QgsCoordinateReferenceSystem(4326))
+
+        unsnapped_count = 0
+        features = []
+        for point, result in zip(points, results):
+            if not result:
+                unsnapped_count += 1
+            for rank, (segment_id, fraction, offset, distance, forward, x, y) in enumerate(result):
+                feature = QgsFeature(fields)
+                feature.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(x, y)))
+                feature.setAttributes([str(point[0]), rank + 1, segment_id, round(fraction, 6), round(offset, 2),
+                                       round(distance, 2), forward])
+                features.append(feature)
+            if len(features) >= self.batch_size:
+                sink.addFeatures(features, QgsFeatureSink.FastInsert)
+                features.clear()
+        sink.addFeatures(features, QgsFeatureSink.FastInsert)
+
+        if unsnapped_count > 0:
+            feedback.pushInfo(str(unsnapped_count) + ' of ' + str(len(points)) + ' points have no segment')
+        feedback.setProgress(100)
+        return {self.OUTPUT: dest_id,
+                self.OUTPUT_UNSNAPPED_COUNT: unsnapped_count}
+
+    @staticmethod
+    def heading(value):
+        if value is None or value == NULL:
+            return None
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def topology_of_layer(segments_source, context, feedback):
+        """
+        Creates the topology of a segments layer with the attributes of Graphium segments
+        """
+        field_names = segments_source.fields().names()
+        if 'id' not in field_names:
+            feedback.reportError('Segments layer does not have an id field', True)
+            return None
+        transform = QgsCoordinateTransform(segments_source.sourceCrs(), QgsCoordinateReferenceSystem(4326),
+                                           context.transformContext())
+
+        def value(feature, name):
+            if name not in field_names or feature[name] is None or feature[name] == NULL:
+                return None
+            attribute = feature[name]
+            # JSON fields of file based layers are strings
+            if name in ('accessTow', 'accessBkw') and isinstance(attribute, str):
+                try:
+                    attribute = json.loads(attribute)
+                except ValueError:
+                    return None
+            return attribute
+
+        def segments():
+            for index, feature in enumerate(segments_source.getFeatures()):
+                geometry = feature.geometry()
+                if geometry is None or geometry.isEmpty():
+                    continue
+                geometry.transform(transform)
+                start_node_id = value(feature, 'startNodeId')
+                end_node_id = value(feature, 'endNodeId')
+                # the topology of the nodes is not required for snapping
+                yield {'id': feature['id'],
+                       'geometry': geometry.asWkt(),
+                       'startNodeId': start_node_id if start_node_id is not None else -2 * index - 1,
+                       'endNodeId': end_node_id if end_node_id is not None else -2 * index - 2,
+                       'frc': value(feature, 'frc'),
+                       'accessTow': value(feature, 'accessTow'),
+                       'accessBkw': value(feature, 'accessBkw')}
+
+        return GraphTopology.from_segments(segments())
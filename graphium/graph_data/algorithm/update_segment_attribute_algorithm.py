@@ -27,14 +27,16 @@ import os
 import json
 # PyQt5 imports
 from PyQt5.QtGui import (QIcon)
+from PyQt5.QtCore import (QVariant)
 # qgis imports
 from qgis.PyQt.QtCore import QCoreApplication
 from qgis.core import (QgsProcessing, QgsProcessingParameterString, QgsProcessingParameterEnum,
                        QgsProcessingAlgorithm, QgsProcessingParameterField, QgsProcessingParameterFeatureSource,
                        QgsProcessingParameterFeatureSink, QgsFeatureSink, QgsCoordinateReferenceSystem,
-                       QgsProcessingMultiStepFeedback)
+                       QgsProcessingMultiStepFeedback, QgsFields, QgsField, QgsFeature)
 # plugin
 from ...graphium_graph_data_api import (GraphiumGraphDataApi)
+from .download_graph_version_algorithm import (DownloadGraphVersionAlgorithm)
 from ....graphium.connection.graphium_connection_manager import GraphiumConnectionManager
 from ....graphium.settings import Settings
 
@@ -101,7 +103,10 @@ class UpdateSegmentAttributeAlgorithm(QgsProcessingAlgorithm):
         return self.tr(self.alg_display_name)
 
     def shortHelpString(self):
-        return self.tr('This algorithm writes an attribute of a graph segment in a field of the vector data set.')
+        return self.tr('This algorithm writes attributes of graph segments in fields of the vector data set.\n\n'
+                       'Several segment attributes can be selected. They are written to the selected target fields in '
+                       'the same order. Segment attributes without target field are written to new fields named '
+                       'after the attribute. All attributes are requested at once for each segment.')
 
     def icon(self):
         return QIcon(os.path.join(self.plugin_path, 'icons/icon.svg'))
@@ -113,7 +118,7 @@ class UpdateSegmentAttributeAlgorithm(QgsProcessingAlgorithm):
         return QCoreApplication.translate('Processing', string)
 
     def outputName(self):
-        return self.tr('Segments with updated attribute')
+        return self.tr('Segments with updated attributes')
 
     def initAlgorithm(self, config=None):
         """
@@ -125,10 +130,12 @@ class UpdateSegmentAttributeAlgorithm(QgsProcessingAlgorithm):
 
         self.addParameter(QgsProcessingParameterField(self.FIELD_SEGMENT_ID, self.tr('Segment ID field'),
                                                       'segment_id', 'INPUT'))
-        self.addParameter(QgsProcessingParameterEnum(self.SEGMENT_ATTRIBUTE, self.tr('Segment attribute'),
-                                                     self.segment_attribute_options, False, 0, False))
-        self.addParameter(QgsProcessingParameterField(self.TARGET_FIELD, self.tr('Target field (will be updated)'),
-                                                      'target', 'INPUT'))
+        self.addParameter(QgsProcessingParameterEnum(self.SEGMENT_ATTRIBUTE, self.tr('Segment attributes'),
+                                                     self.segment_attribute_options, True, [0], False))
+        self.addParameter(QgsProcessingParameterField(self.TARGET_FIELD,
+                                                      self.tr('Target fields (will be updated in order of the segment '
+                                                              'attributes; missing fields will be created)'),
+                                                      None, 'INPUT', QgsProcessingParameterField.Any, True, True))
 
         # read server connections and prepare enum items
         self.connection_options.clear()
@@ -165,9 +172,9 @@ class UpdateSegmentAttributeAlgorithm(QgsProcessingAlgorithm):
 
         source = self.parameterAsSource(parameters, self.INPUT, context)
         field_segment_id = self.parameterAsString(parameters, self.FIELD_SEGMENT_ID, context)
-        segment_attribute_index = self.parameterAsInt(parameters, self.SEGMENT_ATTRIBUTE, context)
-        segment_attribute = self.segment_attribute_options[segment_attribute_index]
-        target_field = self.parameterAsString(parameters, self.TARGET_FIELD, context)
+        segment_attribute_indexes = self.parameterAsEnums(parameters, self.SEGMENT_ATTRIBUTE, context)
+        segment_attributes = [self.segment_attribute_options[i] for i in segment_attribute_indexes]
+        target_fields = self.parameterAsFields(parameters, self.TARGET_FIELD, context)
 
         server_name = self.connection_options[self.parameterAsInt(parameters, self.SERVER_NAME, context)]
         graph_name = self.parameterAsString(parameters, self.GRAPH_NAME, context)
@@ -186,12 +193,23 @@ class UpdateSegmentAttributeAlgorithm(QgsProcessingAlgorithm):
             feedback.reportError('Cannot connect to [' + server_name + ']', True)
             return {self.OUTPUT: None}
 
+        # map segment attributes to target fields; attributes without target field are written to new fields
+        output_fields = QgsFields(source.fields())
+        new_fields = self.prepare_new_fields(segment_attributes[len(target_fields):], source.fields())
+        for field in new_fields:
+            output_fields.append(field)
+        attribute_mapping = list(zip(segment_attributes, target_fields))
+        attribute_mapping.extend([(segment_attribute, segment_attribute)
+                                  for segment_attribute in segment_attributes[len(target_fields):]])
+        new_field_names = [field.name() for field in new_fields]
+
         feedback.pushInfo("Start downloading task on Graphium server '" + server_name + "' ...")
 
         total = 100.0 / source.featureCount() if source.featureCount() else 0
 
-        # Read segment IDs
+        # Read segment IDs; each segment is requested only once with all selected attributes
         segment_ids = []
+        requested_segment_ids = set()
         attributes_per_segment = dict()
         for current, feature in enumerate(source.getFeatures()):
             # Stop the algorithm if cancel button has been clicked
@@ -201,21 +219,22 @@ class UpdateSegmentAttributeAlgorithm(QgsProcessingAlgorithm):
             if not feature[field_segment_id]:
                 continue
 
-            if not feature[field_segment_id] in segment_ids:
+            if not feature[field_segment_id] in requested_segment_ids:
+                requested_segment_ids.add(feature[field_segment_id])
                 segment_ids.append(feature[field_segment_id])
             if len(segment_ids) > 50:
-                self.get_segment_attributes(feedback, graphium, graph_name, graph_version, segment_attribute,
+                self.get_segment_attributes(feedback, graphium, graph_name, graph_version, segment_attributes,
                                             segment_ids, attributes_per_segment)
             # Update the progress bar
             feedback.setProgress(int(current * total))
         if len(segment_ids) > 0:
-            self.get_segment_attributes(feedback, graphium, graph_name, graph_version, segment_attribute,
+            self.get_segment_attributes(feedback, graphium, graph_name, graph_version, segment_attributes,
                                         segment_ids, attributes_per_segment)
 
         feedback.setCurrentStep(1)
         feedback.pushInfo("Add attributes to features")
 
-        (sink, dest_id) = self.parameterAsSink(parameters, self.OUTPUT, context, source.fields(),
+        (sink, dest_id) = self.parameterAsSink(parameters, self.OUTPUT, context, output_fields,
                                                source.wkbType(), source.sourceCrs())
 
         for current, feature in enumerate(source.getFeatures()):
@@ -223,13 +242,25 @@ class UpdateSegmentAttributeAlgorithm(QgsProcessingAlgorithm):
             if feedback.isCanceled():
                 break
 
+            if new_fields:
+                output_feature = QgsFeature(output_fields, feature.id())
+                output_feature.setGeometry(feature.geometry())
+                output_feature.setAttributes(feature.attributes() + [None] * len(new_fields))
+            else:
+                output_feature = feature
+
             if feature[field_segment_id]:
                 if int(feature[field_segment_id]) in attributes_per_segment:
-                    feature[target_field] = attributes_per_segment[int(feature[field_segment_id])]
+                    segment = attributes_per_segment[int(feature[field_segment_id])]
+                    for segment_attribute, target_field in attribute_mapping:
+                        value = segment.get(segment_attribute)
+                        if target_field in new_field_names and isinstance(value, (list, dict)):
+                            value = json.dumps(value)
+                        output_feature[target_field] = value
                 else:
                     feedback.pushInfo("No attribute for segment " + str(feature[field_segment_id]))
 
-            sink.addFeature(feature, QgsFeatureSink.FastInsert)
+            sink.addFeature(output_feature, QgsFeatureSink.FastInsert)
 
             # Update the progress bar
             feedback.setProgress(int(current * total))
@@ -247,13 +278,37 @@ class UpdateSegmentAttributeAlgorithm(QgsProcessingAlgorithm):
         #         else:
         #             feature[self.target_field] = response['waysegment'][0][self.segment_attribute]
 
-    def get_segment_attributes(self, feedback, graphium, graph_name, graph_version, attribute, segment_ids, attributes):
+    @staticmethod
+    def prepare_new_fields(segment_attributes, source_fields):
+        """
+        Prepares fields for segment attributes which are not available in the source fields
+        :param segment_attributes: list of segment attribute names
+        :param source_fields:
+        :return: list of new fields
+        """
+        segment_fields = DownloadGraphVersionAlgorithm.prepare_vector_layer('segments', 'hdwaysegment').fields()
+        new_fields = list()
+        for segment_attribute in segment_attributes:
+            if source_fields.indexOf(segment_attribute) >= 0:
+                continue
+            field_index = segment_fields.indexOf(segment_attribute)
+            if field_index >= 0 and segment_fields.at(field_index).type() not in [QVariant.List, QVariant.Map]:
+                new_fields.append(QgsField(segment_fields.at(field_index)))
+            else:
+                # geometry, lists and objects are written as WKT / JSON strings
+                new_fields.append(QgsField(segment_attribute, QVariant.String, 'String'))
+        return new_fields
+
+    def get_segment_attributes(self, feedback, graphium, graph_name, graph_version, segment_attributes, segment_ids,
+                               attributes):
 
         response = graphium.get_segment(graph_name, graph_version, ",".join([str(s) for s in segment_ids]))
         if 'waysegment' in response:
             if len(response['waysegment']) >= 1:
                 for segment in response['waysegment']:
-                    attributes[segment['id']] = segment[attribute]
+                    # only the copied attributes are kept
+                    attributes[segment['id']] = {key: value for key, value in segment.items()
+                                                 if key == 'id' or key in segment_attributes}
             else:
                 feedback.reportError('No segment available', True)
 
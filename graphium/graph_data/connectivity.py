@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ QGIS plugin 'Graphium'
+/***************************************************************************
+ *
+ * Copyright 2020 Simon Gröchenig @ Salzburg Research
+ * eMail     graphium@salzburgresearch.at
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ *
+ ***************************************************************************/
+"""
+
+from array import array
+# plugin
+from .graph_topology import access_mask
+
+# Connectivity analysis on the topology of a graph version. This module must not import qgis.
+
+
+def allowed_edges(topology, access_types=None):
+    """
+    :param access_types: list of access types; an edge is allowed if the segment is accessible for one of them in
+                         direction of the edge. All edges are allowed if None.
+    :return: bytearray with 1 for each allowed directed edge
+    """
+    if access_types is None:
+        return bytearray(b'\x01') * topology.edge_count
+    mask = access_mask(access_types)
+    return bytearray(1 if access & mask != 0 else 0 for access in topology.edge_access)
+
+
+def weak_components(topology, allowed):
+    """
+    Weakly connected components with union-find over the allowed edges
+    :return: array of the component (root node) per node
+    """
+    parent = array('l', range(topology.node_count))
+
+    def find(node):
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    edge_targets = topology.edge_targets
+    for e in range(topology.edge_count):
+        if allowed[e]:
+            a, b = find(topology.edge_source(e)), find(edge_targets[e])
+            if a != b:
+                parent[max(a, b)] = min(a, b)
+    for node in range(topology.node_count):
+        parent[node] = find(node)
+    return parent
+
+
+def strong_components(topology, allowed):
+    """
+    Strongly connected components with an iterative version of Tarjan's algorithm over the allowed edges
+    :return: array of the component per node
+    """
+    node_count = topology.node_count
+    edge_offsets, edge_targets = topology.edge_offsets, topology.edge_targets
+    index = array('l', [-1]) * node_count
+    low = array('l', [0]) * node_count
+    components = array('l', [-1]) * node_count
+    on_stack = bytearray(node_count)
+    stack = []
+    counter = 0
+    component_count = 0
+
+    for root in range(node_count):
+        if index[root] != -1:
+            continue
+        index[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = 1
+        # call stack of node and position of the next outgoing edge
+        work = [(root, edge_offsets[root])]
+        while work:
+            node, e = work[-1]
+            end = edge_offsets[node + 1]
+            descended = False
+            while e < end:
+                target = edge_targets[e]
+                e += 1
+                if not allowed[e - 1]:
+                    continue
+                if index[target] == -1:
+                    work[-1] = (node, e)
+                    index[target] = low[target] = counter
+                    counter += 1
+                    stack.append(target)
+                    on_stack[target] = 1
+                    work.append((target, edge_offsets[target]))
+                    descended = True
+                    break
+                if on_stack[target] and index[target] < low[node]:
+                    low[node] = index[target]
+            if descended:
+                continue
+
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                if low[node] < low[parent]:
+                    low[parent] = low[node]
+            if low[node] == index[node]:
+                while True:
+                    member = stack.pop()
+                    on_stack[member] = 0
+                    components[member] = component_count
+                    if member == node:
+                        break
+                component_count += 1
+    return components
+
+
+def segment_components(topology, node_components, allowed, both_nodes):
+    """
+    Assigns the components of the nodes to the segments and numbers them by size (0 = largest)
+    :param both_nodes: True if a segment only belongs to a component if both nodes are part of it (strongly
+                       connected components); otherwise the component of the start node is used
+    :return: tuple of array of component per segment (-1 for segments without component) and list of the number of
+             segments per component
+    """
+    segment_count = topology.segment_count
+    labels = array('l', [-1]) * segment_count
+    sizes = {}
+    for e in range(topology.edge_count):
+        if not allowed[e]:
+            continue
+        segment = topology.edge_segments[e]
+        if labels[segment] != -1:
+            continue
+        start, end = node_components[topology.start_nodes[segment]], node_components[topology.end_nodes[segment]]
+        if both_nodes and start != end:
+            continue
+        labels[segment] = start
+        sizes[start] = sizes.get(start, 0) + 1
+
+    order = sorted(sizes.keys(), key=lambda c: (-sizes[c], c))
+    numbers = {component: number for number, component in enumerate(order)}
+    for segment in range(segment_count):
+        if labels[segment] != -1:
+            labels[segment] = numbers[labels[segment]]
+    return labels, [sizes[component] for component in order]
+
+
+def analyse(topology, access_types=None):
+    """
+    Calculates weakly and strongly connected components of the segments. Segments are part of a strongly connected
+    component if all segments of the component can be reached from each other in the allowed directions; segments
+    which can only be passed in one direction between two components are not part of any strongly connected
+    component.
+    :return: dictionary with arrays of the component per segment (wcc, scc) and lists of the number of segments per
+             component (wcc_sizes, scc_sizes); components are numbered by size, -1 if a segment is not part of any
+             component
+    """
+    allowed = allowed_edges(topology, access_types)
+    wcc, wcc_sizes = segment_components(topology, weak_components(topology, allowed), allowed, False)
+    scc, scc_sizes = segment_components(topology, strong_components(topology, allowed), allowed, True)
+    return {'wcc': wcc, 'wcc_sizes': wcc_sizes, 'scc': scc, 'scc_sizes': scc_sizes}
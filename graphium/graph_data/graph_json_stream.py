@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ QGIS plugin 'Graphium'
+/***************************************************************************
+ *
+ * Copyright 2020 Simon Gröchenig @ Salzburg Research
+ * eMail     graphium@salzburgresearch.at
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ *
+ ***************************************************************************/
+"""
+
+import re
+import json
+import gzip
+import codecs
+
+
+class GraphJsonStreamParser:
+    """
+    Incremental parser for Graphium graph JSON documents (e.g. {"graphVersionMetadata": {...}, "waysegment": [...]}).
+
+    Data is fed in chunks of bytes. Top level values are returned as soon as they are complete, elements of top level
+    arrays (e.g. the way segments) are returned one by one. Therefore, the whole document never has to be kept in
+    memory.
+    """
+
+    STATE_START = 0
+    STATE_KEY = 1
+    STATE_COLON = 2
+    STATE_VALUE = 3
+    STATE_ARRAY = 4
+    STATE_END = 5
+
+    WHITESPACE = re.compile(r'[ \t\n\r]*')
+    # characters which may continue a number (e.g. '123' followed by '.456' or 'e2' in the next chunk)
+    NUMBER_TAIL = re.compile(r'[0-9.eE+\-]*')
+    WKT_COORDINATE = re.compile(r'(-?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?)\s+(-?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?)')
+    METADATA_KEY = 'graphVersionMetadata'
+    SEGMENT_KEYS = ('waysegment', 'hdwaysegment')
+
+    def __init__(self, max_value_size=256 * 1024 * 1024, item_keys=None):
+        """
+        :param max_value_size: maximum number of characters a single value (or array element) may have
+        :param item_keys: optional collection of keys; objects in top level arrays (e.g. segments) only keep these keys
+                          and are not passed on with all of their attributes
+        """
+        self.max_value_size = max_value_size
+        self.item_keys = frozenset(item_keys) if item_keys is not None else None
+        self.json_decoder = json.JSONDecoder()
+        self.text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.state = self.STATE_START
+        self.key = None
+        # items of the current object or array: whether there are any and whether a ',' has to follow
+        self.has_items = False
+        self.expect_separator = False
+
+    def feed(self, data):
+        """
+        Feeds the next chunk of the document
+        :param data: bytes (or str)
+        :return: list of events (key, value, is_array_item)
+        """
+        if isinstance(data, str):
+            self.buffer += data
+        else:
+            self.buffer += self.text_decoder.decode(data)
+        return self.parse(False)
+
+    def close(self):
+        """
+        Finishes parsing and checks whether the document is complete
+        :return: list of remaining events (key, value, is_array_item)
+        """
+        self.buffer += self.text_decoder.decode(b'', True)
+        events = self.parse(True)
+        if self.state != self.STATE_END:
+            raise json.JSONDecodeError('Unexpected end of document', self.buffer, len(self.buffer))
+        return events
+
+    def parse(self, final):
+        events = []
+        buffer = self.buffer
+        length = len(buffer)
+        position = 0
+
+        while True:
+            position = self.WHITESPACE.match(buffer, position).end()
+            if position >= length:
+                break
+            char = buffer[position]
+
+            if self.state == self.STATE_START:
+                if char != '{':
+                    raise json.JSONDecodeError('Expecting \'{\'', buffer, position)
+                position += 1
+                self.state = self.STATE_KEY
+                self.start_container()
+            elif self.state == self.STATE_KEY:
+                if char == '}':
+                    self.check_container_end(buffer, position, 'object')
+                    position += 1
+                    self.state = self.STATE_END
+                elif self.expect_separator:
+                    position = self.skip_separator(buffer, position, char)
+                elif char == '"':
+                    key, end = self.decode_value(buffer, position, final)
+                    if end is None:
+                        break
+                    self.key = key
+                    position = end
+                    self.state = self.STATE_COLON
+                else:
+                    raise json.JSONDecodeError('Expecting property name enclosed in double quotes', buffer, position)
+            elif self.state == self.STATE_COLON:
+                if char != ':':
+                    raise json.JSONDecodeError('Expecting \':\' delimiter', buffer, position)
+                position += 1
+                self.state = self.STATE_VALUE
+            elif self.state == self.STATE_VALUE:
+                if char == '[':
+                    position += 1
+                    self.state = self.STATE_ARRAY
+                    self.start_container()
+                else:
+                    value, end = self.decode_value(buffer, position, final)
+                    if end is None:
+                        break
+                    events.append((self.key, value, False))
+                    position = end
+                    self.state = self.STATE_KEY
+                    self.end_item()
+            elif self.state == self.STATE_ARRAY:
+                if char == ']':
+                    self.check_container_end(buffer, position, 'array')
+                    position += 1
+                    # the array is the value of the current key of the top level object
+                    self.state = self.STATE_KEY
+                    self.end_item()
+                elif self.expect_separator:
+                    position = self.skip_separator(buffer, position, char)
+                elif char == ',':
+                    raise json.JSONDecodeError('Expecting value', buffer, position)
+                else:
+                    value, end = self.decode_value(buffer, position, final)
+                    if end is None:
+                        break
+                    if self.item_keys is not None and isinstance(value, dict):
+                        value = {key: item for key, item in value.items() if key in self.item_keys}
+                    events.append((self.key, value, True))
+                    position = end
+                    self.end_item()
+            else:
+                raise json.JSONDecodeError('Extra data', buffer, position)
+
+        self.buffer = buffer[position:]
+        if len(self.buffer) > self.max_value_size:
+            raise json.JSONDecodeError('Value exceeds maximum size of ' + str(self.max_value_size) + ' characters',
+                                       buffer, position)
+        return events
+
+    def start_container(self):
+        self.has_items = False
+        self.expect_separator = False
+
+    def end_item(self):
+        self.has_items = True
+        self.expect_separator = True
+
+    def skip_separator(self, buffer, position, char):
+        """
+        Checks the ',' between two items of an object or array
+        :return: position after the separator
+        """
+        if char != ',':
+            raise json.JSONDecodeError('Expecting \',\' delimiter', buffer, position)
+        self.expect_separator = False
+        return position + 1
+
+    def check_container_end(self, buffer, position, container):
+        """
+        Checks that an object or array is not closed directly after a ','
+        """
+        if self.has_items and not self.expect_separator:
+            raise json.JSONDecodeError('Illegal trailing comma before end of ' + container, buffer, position)
+
+    def decode_value(self, buffer, position, final):
+        """
+        Decodes a single JSON value starting at position
+        :return: value and end position; end position is None if more data is required
+        """
+        try:
+            value, end = self.json_decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if final:
+                raise
+            return None, None
+        # numbers and literals at the end of the buffer could be continued by the next chunk; a number may also be
+        # followed by an incomplete fraction or exponent (e.g. '123.' or '3e'), which the decoder does not consume
+        if not final and not isinstance(value, (dict, list, str)) and \
+                self.NUMBER_TAIL.match(buffer, end).end() >= len(buffer):
+            return None, None
+        return value, end
+
+    @staticmethod
+    def open_file(file_path):
+        """
+        Opens a (optionally gzip compressed) graph JSON file in binary mode
+        """
+        with open(file_path, 'rb') as f:
+            is_gzip = f.read(2) == b'\x1f\x8b'
+        return gzip.open(file_path, 'rb') if is_gzip else open(file_path, 'rb')
+
+    @classmethod
+    def read_file(cls, file_path, chunk_size=1024 * 1024, feedback=None):
+        """
+        Generator for all events of a (optionally gzip compressed) graph JSON file
+        :param file_path:
+        :param chunk_size: number of bytes read at once
+        :param feedback: optional feedback; reading stops before the next chunk if it has been canceled
+        :return: events (key, value, is_array_item)
+        """
+        parser = cls()
+        with cls.open_file(file_path) as f:
+            while True:
+                if feedback is not None and feedback.isCanceled():
+                    return
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                for event in parser.feed(chunk):
+                    yield event
+        for event in parser.close():
+            yield event
+
+    @classmethod
+    def read_metadata(cls, file_path, chunk_size=64 * 1024):
+        """
+        Reads the graph version metadata of a (optionally gzip compressed) graph JSON file. Reading stops as soon as
+        the metadata has been found; only the current value is kept in memory.
+        :return: graph version metadata or None
+        """
+        for key, value, is_array_item in cls.read_file(file_path, chunk_size):
+            if key == cls.METADATA_KEY and not is_array_item:
+                return value
+        return None
+
+    @classmethod
+    def read_statistics(cls, file_path, feedback=None, chunk_size=1024 * 1024):
+        """
+        Reads metadata, number of segments and bounding box of all segment geometries (WKT) in one pass
+        :return: dict with 'metadata', 'segment_type', 'segments_count' and 'bbox' (x_min, y_min, x_max, y_max; None
+                 if the file does not contain geometries), or None if canceled
+        """
+        statistics = {'metadata': None, 'segment_type': None, 'segments_count': 0, 'bbox': None}
+        x_min = y_min = float('inf')
+        x_max = y_max = float('-inf')
+
+        for key, value, is_array_item in cls.read_file(file_path, chunk_size, feedback):
+            if key in cls.SEGMENT_KEYS and is_array_item:
+                statistics['segment_type'] = key
+                statistics['segments_count'] += 1
+                geometry = value.get('geometry') if isinstance(value, dict) else None
+                if isinstance(geometry, str):
+                    for x, y in cls.WKT_COORDINATE.findall(geometry):
+                        x, y = float(x), float(y)
+                        x_min, x_max = min(x_min, x), max(x_max, x)
+                        y_min, y_max = min(y_min, y), max(y_max, y)
+                if feedback is not None and statistics['segments_count'] % 10000 == 0:
+                    feedback.pushInfo('Scanned ' + str(statistics['segments_count']) + ' segments')
+            elif key == cls.METADATA_KEY and not is_array_item:
+                statistics['metadata'] = value
+
+        if feedback is not None and feedback.isCanceled():
+            return None
+        if x_min <= x_max:
+            statistics['bbox'] = (x_min, y_min, x_max, y_max)
+        return statistics
@@ -0,0 +1,461 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ QGIS plugin 'Graphium'
+/***************************************************************************
+ *
+ * Copyright 2020 Simon Gröchenig @ Salzburg Research
+ * eMail     graphium@salzburgresearch.at
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ *
+ ***************************************************************************/
+"""
+
+import os
+import sys
+import json
+import math
+import mmap
+import struct
+from array import array
+# plugin
+from .graph_json_stream import GraphJsonStreamParser
+from .segment_index import SegmentIndex
+from ..graph_management.model.access import Access
+
+# Array based topology of a Graphium graph version. This module must not import qgis, because the topology is used in
+# worker processes.
+
+EARTH_RADIUS = 6371008.8
+ALL_ACCESS = 0xFFFFFFFF
+
+
+def haversine(x1, y1, x2, y2):
+    """
+    :return: distance in meters between two WGS84 coordinates
+    """
+    phi1 = math.radians(y1)
+    phi2 = math.radians(y2)
+    a = math.sin((phi2 - phi1) / 2) ** 2 + \
+        math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(x2 - x1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def access_mask(access_list):
+    """
+    Converts a list of access types (names or IDs of Access) into a bit mask
+    :param access_list: list of access types; all access types if None
+    """
+    if access_list is None:
+        return ALL_ACCESS
+    mask = 0
+    for access in access_list:
+        try:
+            value = Access[access].value if isinstance(access, str) else Access(int(access)).value
+        except (KeyError, ValueError):
+            continue
+        if value > 0:
+            mask |= 1 << value
+    return mask
+
+
+class GraphTopology:
+    """
+    Compact topology of a graph version. Segments, nodes and directed edges are stored in arrays; the outgoing edges
+    of each node are stored in compressed sparse row (CSR) format:
+     - edges of node n: edge_offsets[n] <= e < edge_offsets[n + 1]
+     - edge e leads to node edge_targets[e] via segment edge_segments[e] in direction of the segment if
+       edge_forward[e] == 1
+     - the incoming edges of node n are reverse_edges[i] for reverse_offsets[n] <= i < reverse_offsets[n + 1]
+     - length, speeds and access of the segments in direction of the edge are stored per edge (edge_lengths,
+       edge_max_speeds, edge_calc_speeds, edge_access)
+    Only the attributes required for routing are kept (IDs, nodes, length, speeds, access and geometry).
+
+    The topology can be saved as binary file next to the graph file, which is memory-mapped instead of parsing the
+    graph file again:
+     - magic bytes, header size (uint32) and JSON header (graph version, size and modification time of the graph
+       file, position and type of the arrays)
+     - all arrays, each aligned to 8 bytes
+    """
+
+    MAGIC = b'GRTP'
+    FORMAT_VERSION = 1
+    file_suffix = '.topology'
+    ARRAYS = ['segment_ids', 'start_nodes', 'end_nodes', 'lengths', 'max_speeds_tow', 'max_speeds_bkw',
+              'calc_speeds_tow', 'calc_speeds_bkw', 'frcs', 'access_tow', 'access_bkw', 'coord_offsets', 'coord_x',
+              'coord_y', 'node_ids', 'node_x', 'node_y', 'edge_offsets', 'edge_targets', 'edge_segments',
+              'edge_forward', 'edge_lengths', 'edge_max_speeds', 'edge_calc_speeds', 'edge_access',
+              'reverse_offsets', 'reverse_edges']
+
+    def __init__(self):
+        self.graph_name = None
+        self.graph_version = None
+
+        # segments
+        self.segment_ids = array('q')
+        self.start_nodes = array('l')
+        self.end_nodes = array('l')
+        self.lengths = array('d')
+        self.max_speeds_tow = array('f')
+        self.max_speeds_bkw = array('f')
+        self.calc_speeds_tow = array('f')
+        self.calc_speeds_bkw = array('f')
+        self.frcs = array('b')
+        self.access_tow = array('L')
+        self.access_bkw = array('L')
+        # geometry: coordinates of segment s are coord_x/y[coord_offsets[s]:coord_offsets[s + 1]]
+        self.coord_offsets = array('l', [0])
+        self.coord_x = array('d')
+        self.coord_y = array('d')
+
+        # nodes
+        self.node_ids = array('q')
+        self.node_x = array('d')
+        self.node_y = array('d')
+        self.node_index = {}
+
+        # directed edges
+        self.edge_offsets = array('l')
+        self.edge_targets = array('l')
+        self.edge_segments = array('l')
+        self.edge_forward = array('b')
+        self.edge_lengths = array('d')
+        self.edge_max_speeds = array('f')
+        self.edge_calc_speeds = array('f')
+        self.edge_access = array('L')
+        self.reverse_offsets = array('l')
+        self.reverse_edges = array('l')
+
+        self.segment_index = None
+        # memory map of a loaded topology file
+        self.mmap = None
+
+    @property
+    def segment_count(self):
+        return len(self.segment_ids)
+
+    @property
+    def node_count(self):
+        return len(self.node_ids)
+
+    @property
+    def edge_count(self):
+        return len(self.edge_targets)
+
+    @classmethod
+    def from_file(cls, file_path, feedback=None):
+        """
+        Builds the topology of a (optionally gzip compressed) graph JSON file; the file is read as stream
+        :param feedback: optional feedback for cancellation and progress information
+        :return: topology or None if canceled
+        """
+        topology = cls()
+        if not topology.add_events(GraphJsonStreamParser.read_file(file_path), feedback):
+            return None
+        topology.build_edges()
+        return topology
+
+    def add_events(self, events, feedback=None):
+        """
+        Adds the segments and metadata of events of the GraphJsonStreamParser, e.g. of a streamed graph export
+        :return: False if canceled
+        """
+        for key, value, is_array_item in events:
+            if is_array_item and key in GraphJsonStreamParser.SEGMENT_KEYS:
+                self.add_segment(value)
+                if feedback is not None and self.segment_count % 100000 == 0:
+                    if feedback.isCanceled():
+                        return False
+                    feedback.pushInfo('Read ' + str(self.segment_count) + ' segments')
+            elif key == GraphJsonStreamParser.METADATA_KEY and not is_array_item and isinstance(value, dict):
+                self.graph_name = value.get('graphName')
+                self.graph_version = value.get('version')
+        return True
+
+    @classmethod
+    def from_segments(cls, segments, graph_name=None, graph_version=None):
+        topology = cls()
+        topology.graph_name = graph_name
+        topology.graph_version = graph_version
+        for segment in segments:
+            topology.add_segment(segment)
+        topology.build_edges()
+        return topology
+
+    def add_node(self, node_id, x, y):
+        index = self.node_index.get(node_id)
+        if index is None:
+            index = len(self.node_ids)
+            self.node_index[node_id] = index
+            self.node_ids.append(node_id)
+            self.node_x.append(x)
+            self.node_y.append(y)
+        return index
+
+    def add_segment(self, segment):
+        """
+        Adds a segment (dictionary in Graphium JSON format); segments without valid geometry are skipped
+        """
+        coordinates = [(float(x), float(y)) for x, y in
+                       GraphJsonStreamParser.WKT_COORDINATE.findall(segment.get('geometry') or '')]
+        if len(coordinates) < 2:
+            return
+
+        length = segment.get('length')
+        if not isinstance(length, (int, float)) or length <= 0:
+            length = sum([haversine(coordinates[i][0], coordinates[i][1], coordinates[i + 1][0],
+                                    coordinates[i + 1][1]) for i in range(len(coordinates) - 1)])
+
+        self.segment_ids.append(segment['id'])
+        self.start_nodes.append(self.add_node(segment['startNodeId'], coordinates[0][0], coordinates[0][1]))
+        self.end_nodes.append(self.add_node(segment['endNodeId'], coordinates[-1][0], coordinates[-1][1]))
+        self.lengths.append(length)
+        self.max_speeds_tow.append(segment.get('maxSpeedTow') or 0)
+        self.max_speeds_bkw.append(segment.get('maxSpeedBkw') or 0)
+        self.calc_speeds_tow.append(segment.get('calcSpeedTow') or 0)
+        self.calc_speeds_bkw.append(segment.get('calcSpeedBkw') or 0)
+        self.frcs.append(segment.get('frc') if isinstance(segment.get('frc'), int) else -1)
+        self.access_tow.append(access_mask(segment.get('accessTow')))
+        self.access_bkw.append(access_mask(segment.get('accessBkw')))
+        for x, y in coordinates:
+            self.coord_x.append(x)
+            self.coord_y.append(y)
+        self.coord_offsets.append(len(self.coord_x))
+
+    def build_edges(self):
+        """
+        Builds the CSR arrays of outgoing and incoming directed edges and the edge attributes. Each segment results in
+        one edge per direction; access restrictions are applied by the routing profiles.
+        """
+        node_count = self.node_count
+        degrees = array('l', bytes(array('l').itemsize * (node_count + 1)))
+        for s in range(self.segment_count):
+            degrees[self.start_nodes[s] + 1] += 1
+            degrees[self.end_nodes[s] + 1] += 1
+        for n in range(node_count):
+            degrees[n + 1] += degrees[n]
+        self.edge_offsets = degrees
+
+        edge_count = 2 * self.segment_count
+        self.edge_targets = array('l', bytes(array('l').itemsize * edge_count))
+        self.edge_segments = array('l', bytes(array('l').itemsize * edge_count))
+        self.edge_forward = array('b', bytes(edge_count))
+        position = array('l', self.edge_offsets[:-1])
+        for s in range(self.segment_count):
+            start, end = self.start_nodes[s], self.end_nodes[s]
+            e = position[start]
+            position[start] += 1
+            self.edge_targets[e] = end
+            self.edge_segments[e] = s
+            self.edge_forward[e] = 1
+            e = position[end]
+            position[end] += 1
+            self.edge_targets[e] = start
+            self.edge_segments[e] = s
+
+        self.edge_lengths = array('d', (self.lengths[s] for s in self.edge_segments))
+        self.edge_max_speeds = array('f', (self.max_speeds_tow[s] if f == 1 else self.max_speeds_bkw[s]
+                                           for s, f in zip(self.edge_segments, self.edge_forward)))
+        self.edge_calc_speeds = array('f', (self.calc_speeds_tow[s] if f == 1 else self.calc_speeds_bkw[s]
+                                            for s, f in zip(self.edge_segments, self.edge_forward)))
+        self.edge_access = array('L', (self.access_tow[s] if f == 1 else self.access_bkw[s]
+                                       for s, f in zip(self.edge_segments, self.edge_forward)))
+
+        # incoming edges: the degree of a node is the same in both directions
+        self.reverse_offsets = array('l', self.edge_offsets)
+        self.reverse_edges = array('l', bytes(array('l').itemsize * edge_count))
+        position = array('l', self.reverse_offsets[:-1])
+        for e in range(edge_count):
+            target = self.edge_targets[e]
+            self.reverse_edges[position[target]] = e
+            position[target] += 1
+
+    def edges(self, node):
+        """
+        :return: range of the outgoing edges of a node
+        """
+        return range(self.edge_offsets[node], self.edge_offsets[node + 1])
+
+    def edge_source(self, edge):
+        segment = self.edge_segments[edge]
+        return self.start_nodes[segment] if self.edge_forward[edge] == 1 else self.end_nodes[segment]
+
+    def neighbors(self, node):
+        """
+        Iterates over the outgoing edges of a node
+        :return: generator of tuples (edge, target node)
+        """
+        edge_targets = self.edge_targets
+        for e in range(self.edge_offsets[node], self.edge_offsets[node + 1]):
+            yield e, edge_targets[e]
+
+    def predecessors(self, node):
+        """
+        Iterates over the incoming edges of a node
+        :return: generator of tuples (edge, source node)
+        """
+        for i in range(self.reverse_offsets[node], self.reverse_offsets[node + 1]):
+            e = self.reverse_edges[i]
+            yield e, self.edge_source(e)
+
+    def out_degree(self, node):
+        return self.edge_offsets[node + 1] - self.edge_offsets[node]
+
+    def in_degree(self, node):
+        return self.reverse_offsets[node + 1] - self.reverse_offsets[node]
+
+    def node_of(self, node_id):
+        """
+        :return: index of the node with the given ID or None
+        """
+        if self.node_index is None:
+            # the index of a loaded topology is built with the first lookup
+            self.node_index = {node_id: index for index, node_id in enumerate(self.node_ids)}
+        return self.node_index.get(node_id)
+
+    def segment_coordinates(self, segment, forward=True):
+        coordinates = list(zip(self.coord_x[self.coord_offsets[segment]:self.coord_offsets[segment + 1]],
+                               self.coord_y[self.coord_offsets[segment]:self.coord_offsets[segment + 1]]))
+        return coordinates if forward else coordinates[::-1]
+
+    def nearest_segment(self, x, y, segment_filter=None):
+        """
+        Finds the nearest segment of a WGS84 coordinate; the spatial index is built with the first query
+        :param segment_filter: optional function called with the segment index; segments are skipped if it returns
+                               False
+        :return: tuple of segment index, fraction of length along the segment and distance in meters or None
+        """
+        nearest = self.spatial_index().nearest(x, y, 1, segment_filter)
+        return nearest[0] if nearest else None
+
+    def spatial_index(self):
+        if self.segment_index is None:
+            self.segment_index = SegmentIndex(self)
+        return self.segment_index
+
+    @classmethod
+    def store_file(cls, graph_file):
+        """
+        :return: path of the topology file of a graph file
+        """
+        return graph_file + cls.file_suffix
+
+    def save(self, file_path, graph_file=None):
+        """
+        Writes the topology into a file
+        :param graph_file: optional graph file the topology has been built from; a loaded topology is only used as
+                           long as size and modification time of the graph file do not change
+        """
+        header = {'version': self.FORMAT_VERSION, 'byteorder': sys.byteorder, 'graph_name': self.graph_name,
+                  'graph_version': self.graph_version, 'arrays': {}}
+        if graph_file is not None:
+            stat = os.stat(graph_file)
+            header['source'] = {'size': stat.st_size, 'mtime': stat.st_mtime}
+        header_size = 4096
+        while True:
+            offset = len(self.MAGIC) + 4 + header_size
+            for name in self.ARRAYS:
+                values = memoryview(getattr(self, name))
+                header['arrays'][name] = [offset, len(values), values.format, values.itemsize]
+                offset += (len(values) * values.itemsize + 7) // 8 * 8
+            header_bytes = json.dumps(header).encode('utf-8')
+            if len(header_bytes) <= header_size:
+                break
+            header_size *= 2
+
+        temp_file = file_path + '.tmp'
+        with open(temp_file, 'wb') as file:
+            file.write(self.MAGIC)
+            file.write(struct.pack('<I', header_size))
+            file.write(header_bytes.ljust(header_size, b' '))
+            for name in self.ARRAYS:
+                values = memoryview(getattr(self, name)).cast('B')
+                file.write(values)
+                file.write(bytes(-len(values) % 8))
+        os.replace(temp_file, file_path)
+
+    @classmethod
+    def load(cls, file_path, graph_file=None):
+        """
+        Memory-maps a topology file; the arrays are not copied into memory
+        :param graph_file: optional graph file; raises ValueError if the topology has been built from another version
+                           of the graph file
+        """
+        with open(file_path, 'rb') as file:
+            memory_map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if memory_map[:len(cls.MAGIC)] != cls.MAGIC:
+                raise ValueError('Not a graph topology file')
+            header_size = struct.unpack('<I', memory_map[len(cls.MAGIC):len(cls.MAGIC) + 4])[0]
+            start = len(cls.MAGIC) + 4
+            header = json.loads(memory_map[start:start + header_size].decode('utf-8'))
+            if header.get('version') != cls.FORMAT_VERSION or header.get('byteorder') != sys.byteorder:
+                raise ValueError('Unsupported graph topology file (version or byte order)')
+            if graph_file is not None:
+                stat = os.stat(graph_file)
+                if header.get('source') != {'size': stat.st_size, 'mtime': stat.st_mtime}:
+                    raise ValueError('Graph topology file does not match the graph file')
+            if set(header['arrays'].keys()) != set(cls.ARRAYS) or \
+                    any(array(typecode).itemsize != itemsize for _, _, typecode, itemsize in header['arrays'].values()):
+                raise ValueError('Unsupported graph topology file (arrays)')
+        except (ValueError, KeyError, TypeError):
+            memory_map.close()
+            raise
+
+        topology = cls()
+        topology.graph_name = header.get('graph_name')
+        topology.graph_version = header.get('graph_version')
+        topology.node_index = None
+        topology.mmap = memory_map
+        view = memoryview(memory_map)
+        for name, (offset, count, typecode, itemsize) in header['arrays'].items():
+            setattr(topology, name, view[offset:offset + count * itemsize].cast(typecode))
+        return topology
+
+
+class GraphTopologyCache:
+    """
+    Keeps the topologies of the most recently used graph files, therefore repeated algorithm runs on the same graph
+    file do not read the file again. A saved topology file of the graph file is memory-mapped instead of parsing the
+    graph file.
+    """
+
+    max_entries = 2
+    entries = []
+
+    @classmethod
+    def get(cls, file_path, feedback=None):
+        stat = os.stat(file_path)
+        key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime)
+        for entry in cls.entries:
+            if entry[0] == key:
+                cls.entries.remove(entry)
+                cls.entries.append(entry)
+                return entry[1]
+
+        topology = None
+        store_file = GraphTopology.store_file(file_path)
+        if os.path.isfile(store_file):
+            try:
+                topology = GraphTopology.load(store_file, file_path)
+            except (OSError, ValueError) as e:
+                if feedback is not None:
+                    feedback.pushInfo('Cannot use graph topology file: ' + str(e))
+        if topology is None:
+            topology = GraphTopology.from_file(file_path, feedback)
+        if topology is not None:
+            cls.entries.append((key, topology))
+            del cls.entries[:-cls.max_entries]
+        return topology
@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ QGIS plugin 'Graphium'
+/***************************************************************************
+ *
+ * Copyright 2020 Simon Gröchenig @ Salzburg Research
+ * eMail     graphium@salzburgresearch.at
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ *
+ ***************************************************************************/
+"""
+
+import os
+import re
+import math
+import heapq
+import tempfile
+from array import array
+
+# Checks of Graphium graph JSON files. This module must not import qgis, because the segment checks run in worker
+# processes.
+
+WKT_NUMBER = r'-?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?'
+WKT_LINESTRING = re.compile(r'^\s*LINESTRING\s*\(\s*(' + WKT_NUMBER + r'\s+' + WKT_NUMBER +
+                            r'(?:\s+' + WKT_NUMBER + r')?(?:\s*,\s*' + WKT_NUMBER + r'\s+' + WKT_NUMBER +
+                            r'(?:\s+' + WKT_NUMBER + r')?)+)\s*\)\s*$', re.IGNORECASE)
+WKT_COORDINATE = re.compile(r'(' + WKT_NUMBER + r')\s+(' + WKT_NUMBER + r')')
+
+# required segment attributes and their types
+REQUIRED_ATTRIBUTES = {'id': int, 'geometry': str, 'startNodeId': int, 'endNodeId': int}
+# optional segment attributes and their types
+OPTIONAL_ATTRIBUTES = {
+    'name': str, 'startNodeIndex': int, 'endNodeIndex': int, 'maxSpeedTow': int, 'maxSpeedBkw': int,
+    'calcSpeedTow': (int, float), 'calcSpeedBkw': (int, float), 'lanesTow': int, 'lanesBkw': int, 'frc': int,
+    'formOfWay': str, 'accessTow': list, 'accessBkw': list, 'tunnel': bool, 'bridge': bool, 'urban': bool,
+    'length': (int, float), 'tags': dict, 'connection': list,
+    'leftBorderGeometry': str, 'leftBorderStartNodeId': int, 'leftBorderEndNodeId': int,
+    'rightBorderGeometry': str, 'rightBorderStartNodeId': int, 'rightBorderEndNodeId': int
+}
+HD_GEOMETRY_ATTRIBUTES = ('leftBorderGeometry', 'rightBorderGeometry')
+REQUIRED_METADATA = ('graphName', 'version')
+
+
+def is_type(value, expected_type):
+    # bool is a subclass of int, but not a valid ID or number
+    if isinstance(value, bool) and expected_type is not bool:
+        return False
+    return isinstance(value, expected_type)
+
+
+def check_wkt_linestring(wkt):
+    """
+    Light-weight check of a WKT linestring (syntax and finite coordinates)
+    :return: error message or None
+    """
+    if WKT_LINESTRING.match(wkt) is None:
+        return 'invalid WKT linestring'
+    for x, y in WKT_COORDINATE.findall(wkt):
+        if not math.isfinite(float(x)) or not math.isfinite(float(y)):
+            return 'WKT linestring contains infinite coordinates'
+    return None
+
+
+def check_segments(segments, max_errors=100):
+    """
+    Checks a batch of segments independent of all other segments
+    :param segments: list of segment dicts
+    :param max_errors: maximum number of returned error messages
+    :return: dict with 'errors' (messages), 'error_count', 'ids' (sorted array of segment IDs), 'targets' (sorted
+             array of segment IDs referenced by connections), 'nodes' (sorted array of start and end node IDs) and
+             'connection_nodes' (sorted array of node IDs with connections, once per segment)
+    """
+    result = {'errors': [], 'error_count': 0, 'ids': array('q'), 'targets': array('q'), 'nodes': array('q'),
+              'connection_nodes': array('q')}
+
+    def add_error(segment_id, message):
+        result['error_count'] += 1
+        if len(result['errors']) < max_errors:
+            result['errors'].append('Segment ' + str(segment_id) + ': ' + message)
+
+    for segment in segments:
+        if not isinstance(segment, dict):
+            add_error(None, 'segment is not a JSON object')
+            continue
+
+        segment_id = segment.get('id')
+        valid = True
+        for attribute, attribute_type in REQUIRED_ATTRIBUTES.items():
+            if attribute not in segment:
+                add_error(segment_id, 'missing attribute ' + attribute)
+                valid = False
+            elif not is_type(segment[attribute], attribute_type):
+                add_error(segment_id, 'invalid type of attribute ' + attribute)
+                valid = False
+        for attribute, attribute_type in OPTIONAL_ATTRIBUTES.items():
+            if segment.get(attribute) is not None and not is_type(segment[attribute], attribute_type):
+                add_error(segment_id, 'invalid type of attribute ' + attribute)
+
+        if is_type(segment_id, int):
+            result['ids'].append(segment_id)
+        if not valid:
+            continue
+
+        error = check_wkt_linestring(segment['geometry'])
+        if error is not None:
+            add_error(segment_id, error)
+        for attribute in HD_GEOMETRY_ATTRIBUTES:
+            if isinstance(segment.get(attribute), str):
+                error = check_wkt_linestring(segment[attribute])
+                if error is not None:
+                    add_error(segment_id, attribute + ': ' + error)
+
+        nodes = (segment['startNodeId'], segment['endNodeId'])
+        result['nodes'].extend(nodes)
+        connection_nodes = set()
+        for connection in segment.get('connection') or []:
+            if not isinstance(connection, dict):
+                add_error(segment_id, 'connection is not a JSON object')
+                continue
+            if connection.get('nodeId') not in nodes:
+                add_error(segment_id, 'connection node ' + str(connection.get('nodeId')) +
+                          ' is neither start node nor end node')
+            else:
+                connection_nodes.add(connection['nodeId'])
+            target_id = connection.get('toSegmentId')
+            if is_type(target_id, int):
+                result['targets'].append(target_id)
+            else:
+                add_error(segment_id, 'connection without valid toSegmentId')
+        result['connection_nodes'].extend(connection_nodes)
+
+    # sorted runs are merged by the caller (see SortedRunFile)
+    for key in ('ids', 'targets', 'nodes', 'connection_nodes'):
+        result[key] = array('q', sorted(result[key]))
+    return result
+
+
+class SortedRunFile:
+    """
+    Collects sorted runs of 64 bit integers in a temporary file. Runs are merged in memory until they contain
+    max_values values and written to the file as one sorted run. The merge reads block_size values of each run at a
+    time, therefore the memory usage is bounded by max_values plus one block per written run instead of growing with
+    all values of the graph.
+    """
+
+    def __init__(self, directory=None, max_values=1000000, block_size=8192):
+        self.file = tempfile.TemporaryFile(dir=directory)
+        self.max_values = max_values
+        self.block_size = block_size
+        self.pending = []
+        self.pending_count = 0
+        # tuples (byte offset, number of values) of the written runs
+        self.runs = []
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def add(self, run):
+        """
+        :param run: sorted array('q')
+        """
+        if len(run) == 0:
+            return
+        self.pending.append(run)
+        self.pending_count += len(run)
+        self.count += len(run)
+        if self.pending_count >= self.max_values:
+            self.flush()
+
+    def flush(self):
+        if len(self.pending) == 0:
+            return
+        run = array('q', heapq.merge(*self.pending))
+        self.pending = []
+        self.pending_count = 0
+        self.file.seek(0, os.SEEK_END)
+        self.runs.append((self.file.tell(), len(run)))
+        run.tofile(self.file)
+
+    def merged(self):
+        """
+        :return: iterator over all values in ascending order; may be called several times
+        """
+        self.flush()
+        return heapq.merge(*[self.read_run(offset, count) for offset, count in self.runs])
+
+    def read_run(self, offset, count):
+        # the file is shared by all runs, therefore every block is read at its own offset
+        while count > 0:
+            block = array('q')
+            self.file.seek(offset)
+            block.fromfile(self.file, min(count, self.block_size))
+            offset += len(block) * block.itemsize
+            count -= len(block)
+            yield from block
+
+    def close(self):
+        self.file.close()
+
+
+def find_duplicates(sorted_ids, max_count=100):
+    """
+    :param sorted_ids: iterable of IDs in ascending order
+    :return: list of duplicate IDs (at most max_count) and number of duplicate IDs
+    """
+    duplicates = []
+    count = 0
+    previous = None
+    last_duplicate = None
+    for segment_id in sorted_ids:
+        if segment_id == previous and segment_id != last_duplicate:
+            last_duplicate = segment_id
+            count += 1
+            if len(duplicates) < max_count:
+                duplicates.append(segment_id)
+        previous = segment_id
+    return duplicates, count
+
+
+def find_missing(sorted_ids, sorted_references, max_count=100):
+    """
+    Merges two iterables in ascending order and returns references which are not contained in the IDs
+    :return: list of missing IDs (at most max_count) and number of missing IDs
+    """
+    missing = []
+    count = 0
+    ids = iter(sorted_ids)
+    current_id = next(ids, None)
+    previous_reference = None
+    for reference in sorted_references:
+        if reference == previous_reference:
+            continue
+        previous_reference = reference
+        while current_id is not None and current_id < reference:
+            current_id = next(ids, None)
+        if current_id != reference:
+            count += 1
+            if len(missing) < max_count:
+                missing.append(reference)
+    return missing, count
+
+
+def find_dangling_nodes(sorted_nodes, sorted_connection_nodes, max_count=100):
+    """
+    Counts the references of all start and end nodes. A node referenced by a single segment is dangling (dead end or
+    unconnected segment end). A node shared by several segments is unconnected if no segment has a connection at it.
+    :param sorted_nodes: iterable of start and end node IDs of all segments in ascending order
+    :param sorted_connection_nodes: iterable of node IDs with connections in ascending order
+    :return: tuple (dangling node IDs (at most max_count), number of dangling nodes, unconnected node IDs (at most
+             max_count), number of unconnected nodes)
+    """
+    dangling = []
+    dangling_count = 0
+    unconnected = []
+    unconnected_count = 0
+    connection_nodes = iter(sorted_connection_nodes)
+    current_connection_node = next(connection_nodes, None)
+    nodes = iter(sorted_nodes)
+    node_id = next(nodes, None)
+    while node_id is not None:
+        references = 1
+        next_node_id = next(nodes, None)
+        while next_node_id == node_id:
+            references += 1
+            next_node_id = next(nodes, None)
+
+        while current_connection_node is not None and current_connection_node < node_id:
+            current_connection_node = next(connection_nodes, None)
+        if references == 1:
+            dangling_count += 1
+            if len(dangling) < max_count:
+                dangling.append(node_id)
+        elif current_connection_node != node_id:
+            unconnected_count += 1
+            if len(unconnected) < max_count:
+                unconnected.append(node_id)
+        node_id = next_node_id
+    return dangling, dangling_count, unconnected, unconnected_count
+
+
+def check_metadata(metadata, segment_type, segments_count):
+    """
+    Checks metadata consistency with the segments
+    :return: list of error messages
+    """
+    errors = []
+    if metadata is None:
+        return ['Graph file does not contain graphVersionMetadata']
+    if not isinstance(metadata, dict):
+        return ['graphVersionMetadata is not a JSON object']
+    for attribute in REQUIRED_METADATA:
+        if not metadata.get(attribute):
+            errors.append('Metadata: missing attribute ' + attribute)
+    if segment_type is not None and metadata.get('type') is not None and metadata.get('type') != segment_type:
+        errors.append('Metadata: type ' + str(metadata.get('type')) + ' does not match segments (' + segment_type +
+                      ')')
+    if metadata.get('segmentsCount') is not None and metadata.get('segmentsCount') != segments_count:
+        errors.append('Metadata: segmentsCount ' + str(metadata.get('segmentsCount')) +
+                      ' does not match number of segments (' + str(segments_count) + ')')
+    return errors
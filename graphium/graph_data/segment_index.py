@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ QGIS plugin 'Graphium'
+/***************************************************************************
+ *
+ * Copyright 2020 Simon Gröchenig @ Salzburg Research
+ * eMail     graphium@salzburgresearch.at
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ *
+ ***************************************************************************/
+"""
+
+import math
+from array import array
+
+# Grid based spatial index of the segments of a GraphTopology. This module must not import qgis, because the index is
+# used in worker processes.
+
+EARTH_RADIUS = 6371008.8
+METERS_PER_DEGREE = math.pi / 180 * EARTH_RADIUS
+
+
+class SegmentIndex:
+    """
+    Uniform grid over the bounding boxes of the segments. Each cell keeps the indexes of the segments whose bounding box
+    overlaps the cell. Nearest neighbour queries visit the cells ring by ring around the query point until no closer
+    segment can be found. Distances are calculated in a local equirectangular projection around the query point, which
+    is accurate enough for snapping.
+    """
+
+    def __init__(self, topology, segments_per_cell=4):
+        self.topology = topology
+        self.cells = {}
+        coord_x, coord_y, offsets = topology.coord_x, topology.coord_y, topology.coord_offsets
+
+        if topology.segment_count == 0:
+            self.cell_size = 1.0
+            return
+        x_min, x_max = min(coord_x), max(coord_x)
+        y_min, y_max = min(coord_y), max(coord_y)
+        area = max((x_max - x_min) * (y_max - y_min), 1e-12)
+        self.cell_size = max(math.sqrt(area * segments_per_cell / topology.segment_count), 1e-5)
+        self.x_min, self.y_min = x_min, y_min
+        self.columns = int((x_max - x_min) / self.cell_size) + 1
+        self.rows = int((y_max - y_min) / self.cell_size) + 1
+
+        cells = {}
+        for s in range(topology.segment_count):
+            xs = coord_x[offsets[s]:offsets[s + 1]]
+            ys = coord_y[offsets[s]:offsets[s + 1]]
+            column_min, row_min = self.cell(min(xs), min(ys))
+            column_max, row_max = self.cell(max(xs), max(ys))
+            for column in range(column_min, column_max + 1):
+                for row in range(row_min, row_max + 1):
+                    key = row * self.columns + column
+                    if key not in cells:
+                        cells[key] = array('l')
+                    cells[key].append(s)
+        self.cells = cells
+
+    def cell(self, x, y):
+        return int((x - self.x_min) / self.cell_size), int((y - self.y_min) / self.cell_size)
+
+    def segment_distance(self, segment, x, y):
+        """
+        :return: tuple of fraction of length along the segment of the nearest position and distance in meters
+        """
+        coord_x, coord_y = self.topology.coord_x, self.topology.coord_y
+        scale_x = math.cos(math.radians(y))
+        travelled = 0.0
+        best_offset, best_distance = 0.0, math.inf
+        for i in range(self.topology.coord_offsets[segment], self.topology.coord_offsets[segment + 1] - 1):
+            ax, ay = (coord_x[i] - x) * scale_x, coord_y[i] - y
+            bx, by = (coord_x[i + 1] - x) * scale_x, coord_y[i + 1] - y
+            dx, dy = bx - ax, by - ay
+            part = dx * dx + dy * dy
+            t = 0.0 if part == 0 else max(0.0, min(1.0, -(ax * dx + ay * dy) / part))
+            distance = math.hypot(ax + t * dx, ay + t * dy)
+            part_length = math.sqrt(part)
+            if distance < best_distance:
+                best_offset, best_distance = travelled + t * part_length, distance
+            travelled += part_length
+        return (best_offset / travelled if travelled > 0 else 0.0), best_distance * METERS_PER_DEGREE
+
+    def nearest(self, x, y, k=1, segment_filter=None, max_distance=math.inf):
+        """
+        Finds the k nearest segments of a WGS84 coordinate
+        :param segment_filter: optional function called with the segment index; segments are skipped if it returns
+                               False
+        :param max_distance: maximum distance in meters
+        :return: list of tuples (segment index, fraction of length along the segment, distance in meters) ordered by
+                 distance
+        """
+        if not self.cells:
+            return []
+        # minimum extent of a cell in meters at the latitude of the query point
+        cell_meters = self.cell_size * METERS_PER_DEGREE * max(math.cos(math.radians(min(abs(y), 89.0))), 1e-6)
+        column, row = self.cell(x, y)
+        max_ring = max(self.columns, self.rows) + abs(column) + abs(row)
+
+        candidates = []
+        visited = set()
+        ring = 0
+        while ring <= max_ring:
+            for c, r in self.ring_cells(column, row, ring):
+                if c < 0 or r < 0 or c >= self.columns or r >= self.rows:
+                    continue
+                for s in self.cells.get(r * self.columns + c, ()):
+                    if s in visited:
+                        continue
+                    visited.add(s)
+                    if segment_filter is not None and not segment_filter(s):
+                        continue
+                    fraction, distance = self.segment_distance(s, x, y)
+                    if distance <= max_distance:
+                        candidates.append((distance, s, fraction))
+            # all segments closer than ring * cell_meters have been visited
+            if len(candidates) >= k:
+                candidates.sort()
+                del candidates[k:]
+                if candidates[-1][0] <= ring * cell_meters:
+                    break
+            if ring * cell_meters > max_distance:
+                break
+            ring += 1
+        candidates.sort()
+        return [(s, fraction, distance) for distance, s, fraction in candidates[:k]]
+
+    @staticmethod
+    def ring_cells(column, row, ring):
+        if ring == 0:
+            yield column, row
+            return
+        for c in range(column - ring, column + ring + 1):
+            yield c, row - ring
+            yield c, row + ring
+        for r in range(row - ring + 1, row + ring):
+            yield column - ring, r
+            yield column + ring, r
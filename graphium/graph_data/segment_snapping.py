@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ QGIS plugin 'Graphium'
+/***************************************************************************
+ *
+ * Copyright 2020 Simon Gröchenig @ Salzburg Research
+ * eMail     graphium@salzburgresearch.at
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ *
+ ***************************************************************************/
+"""
+
+import math
+# plugin
+from .graph_topology import GraphTopologyCache, access_mask
+
+# Nearest segment snapping of points on the topology of a graph version. This module must not import qgis, because
+# batches of points are snapped in worker processes.
+
+
+def segment_filter(topology, frcs=None, access_types=None):
+    """
+    :param frcs: optional collection of functional road classes
+    :param access_types: optional list of access types; segments must be accessible for one of them in at least one
+                         direction
+    :return: function called with a segment index or None if all segments are accepted
+    """
+    if frcs is None and access_types is None:
+        return None
+    frc_set = set(frcs) if frcs is not None else None
+    mask = access_mask(access_types)
+    segment_frcs, access_tow, access_bkw = topology.frcs, topology.access_tow, topology.access_bkw
+
+    def accept(s):
+        return (frc_set is None or segment_frcs[s] in frc_set) and \
+            (access_tow[s] & mask != 0 or access_bkw[s] & mask != 0)
+    return accept
+
+
+def position_at(topology, segment, fraction):
+    """
+    :return: tuple of WGS84 coordinate (x, y) at the fraction of length of the segment and bearing in degrees (0 =
+             north, clockwise) of the segment at this position
+    """
+    coord_x, coord_y = topology.coord_x, topology.coord_y
+    start, end = topology.coord_offsets[segment], topology.coord_offsets[segment + 1]
+    # same local equirectangular projection as in the segment index
+    scale_x = math.cos(math.radians(coord_y[start]))
+    parts = [math.hypot((coord_x[i + 1] - coord_x[i]) * scale_x, coord_y[i + 1] - coord_y[i])
+             for i in range(start, end - 1)]
+    remaining = fraction * sum(parts)
+    for i, part in zip(range(start, end - 1), parts):
+        if remaining <= part or i == end - 2:
+            t = min(1.0, remaining / part) if part > 0 else 0.0
+            bearing = math.degrees(math.atan2((coord_x[i + 1] - coord_x[i]) * scale_x, coord_y[i + 1] - coord_y[i]))
+            return (coord_x[i] + t * (coord_x[i + 1] - coord_x[i]), coord_y[i] + t * (coord_y[i + 1] - coord_y[i]),
+                    bearing % 360)
+        remaining -= part
+    return coord_x[start], coord_y[start], 0.0
+
+
+def heading_deviation(heading, bearing):
+    return abs((heading - bearing + 180) % 360 - 180)
+
+
+def snap(topology, points, k=1, frcs=None, access_types=None, max_distance=math.inf, max_heading_deviation=45.0):
+    """
+    Snaps points to their k nearest segments
+    :param points: list of tuples (x, y, heading) of WGS84 coordinates and optional heading in degrees; points with
+                   heading are only snapped to segments accessible in a direction which deviates at most
+                   max_heading_deviation from the heading
+    :return: list of lists of tuples (segment index, fraction of length, offset along the segment in meters, distance
+             in meters, direction of travel or None if the point has no heading, x and y of the snapped position)
+    """
+    index = topology.spatial_index()
+    accept = segment_filter(topology, frcs, access_types)
+    mask = access_mask(access_types)
+    access_tow, access_bkw, lengths = topology.access_tow, topology.access_bkw, topology.lengths
+
+    results = []
+    for x, y, heading in points:
+        if x is None or y is None:
+            results.append([])
+            continue
+        if heading is None:
+            results.append([(segment, fraction, fraction * lengths[segment], distance, None) +
+                            position_at(topology, segment, fraction)[:2]
+                            for segment, fraction, distance in index.nearest(x, y, k, accept, max_distance)])
+            continue
+
+        # segments in the wrong direction are skipped, therefore more candidates are requested
+        result = []
+        candidates = 4 * k
+        while True:
+            nearest = index.nearest(x, y, candidates, accept, max_distance)
+            for segment, fraction, distance in nearest:
+                position_x, position_y, bearing = position_at(topology, segment, fraction)
+                forward = None
+                if access_tow[segment] & mask != 0 and heading_deviation(heading, bearing) <= max_heading_deviation:
+                    forward = True
+                elif access_bkw[segment] & mask != 0 and \
+                        heading_deviation(heading, bearing + 180) <= max_heading_deviation:
+                    forward = False
+                if forward is not None:
+                    result.append((segment, fraction, fraction * lengths[segment], distance, forward, position_x,
+                                   position_y))
+                    if len(result) == k:
+                        break
+            if len(result) == k or len(nearest) < candidates:
+                break
+            result = []
+            candidates *= 4
+        results.append(result)
+    return results
+
+
+def snap_batch(graph_file, points, k=1, frcs=None, access_types=None, max_distance=math.inf,
+               max_heading_deviation=45.0):
+    """
+    Snaps a batch of points to the segments of a graph file (see snap); segment indexes are replaced by segment IDs
+    """
+    topology = GraphTopologyCache.get(graph_file)
+    return [[(topology.segment_ids[values[0]],) + values[1:] for values in result]
+            for result in snap(topology, points, k, frcs, access_types, max_distance, max_heading_deviation)]
@@ -25,15 +25,19 @@
 
 import os
 import json
+import gzip
+import hashlib
 # PyQt5 imports
 from PyQt5.QtGui import (QIcon)
 # qgis imports
 from qgis.core import (QgsProcessingAlgorithm, QgsProcessingParameterBoolean, QgsProcessingParameterFile,
-                       QgsProcessingParameterString, QgsProcessingParameterEnum, QgsProcessingOutputString)
+                       QgsProcessingParameterString, QgsProcessingParameterEnum, QgsProcessingParameterNumber,
+                       QgsProcessingOutputString, QgsProcessingUtils)
 from qgis.PyQt.QtCore import QCoreApplication
 # plugin
 from ...graphium_graph_management_api import GraphiumGraphManagementApi
 from ...connection.graphium_connection_manager import GraphiumConnectionManager
+from ...graph_data.graph_json_stream import GraphJsonStreamParser
 from ....graphium.settings import Settings
 
 
@@ -49,6 +53,10 @@ class AddGraphVersionAlgorithm(QgsProcessingAlgorithm):
     GRAPH_NAME = 'GRAPH_NAME'
     GRAPH_VERSION = 'GRAPH_VERSION'
     OVERRIDE_IF_EXISTS = 'OVERRIDE_IF_EXISTS'
+    CHECK_GRAPH_FILE = 'CHECK_GRAPH_FILE'
+    RESUMABLE_UPLOAD = 'RESUMABLE_UPLOAD'
+    CHUNK_SIZE_MB = 'CHUNK_SIZE_MB'
+    MAX_RETRIES = 'MAX_RETRIES'
     OUTPUT_STATE = 'OUTPUT_STATE'
 
     def __init__(self):
@@ -83,7 +91,14 @@ class AddGraphVersionAlgorithm(QgsProcessingAlgorithm):
         return self.tr(self.alg_display_name)
 
     def shortHelpString(self):
-        return self.tr('This algorithm imports a new graph version to the Graphium server.')
+        return self.tr('This algorithm imports a new graph version to the Graphium server.\n\n'
+                       'Gzip compressed graph files (*.json.gz) are decompressed to a temporary file before the '
+                       'upload.\n\n'
+                       'A resumable upload sends the file in chunks and retries failed chunks. If the upload is '
+                       'interrupted, running the algorithm again with the same file and target continues with the '
+                       'first missing chunk; the upload state (and the decompressed file of a gzip compressed '
+                       'graph file) is kept in the QGIS profile until the upload has finished. Servers without '
+                       'support for resumable uploads receive the whole file.')
 
     def icon(self):
         return QIcon(os.path.join(self.plugin_path, 'icons/icon.svg'))
@@ -133,6 +148,18 @@ class AddGraphVersionAlgorithm(QgsProcessingAlgorithm):
                                                         self.tr('Override graph version if it exists'),
                                                         False, True))
 
+        self.addParameter(QgsProcessingParameterBoolean(self.CHECK_GRAPH_FILE,
+                                                        self.tr('Check number of segments before upload'),
+                                                        False, True))
+
+        self.addParameter(QgsProcessingParameterBoolean(self.RESUMABLE_UPLOAD,
+                                                        self.tr('Resumable upload in chunks (continues an interrupted '
+                                                                'upload of the same file)'), False, True))
+        self.addParameter(QgsProcessingParameterNumber(self.CHUNK_SIZE_MB, self.tr('Chunk size [MB]'),
+                                                       QgsProcessingParameterNumber.Integer, 8, True, 1, 1024))
+        self.addParameter(QgsProcessingParameterNumber(self.MAX_RETRIES, self.tr('Maximum retries per chunk'),
+                                                       QgsProcessingParameterNumber.Integer, 5, True, 0, 100))
+
         self.addOutput(QgsProcessingOutputString(self.OUTPUT_STATE, self.tr('State')))
 
     def processAlgorithm(self, parameters, context, feedback):
@@ -141,6 +168,10 @@ class AddGraphVersionAlgorithm(QgsProcessingAlgorithm):
         graph_name = self.parameterAsString(parameters, self.GRAPH_NAME, context)
         graph_version = self.parameterAsString(parameters, self.GRAPH_VERSION, context)
         override_if_exists = self.parameterAsBool(parameters, self.OVERRIDE_IF_EXISTS, context)
+        check_graph_file = self.parameterAsBool(parameters, self.CHECK_GRAPH_FILE, context)
+        resumable_upload = self.parameterAsBool(parameters, self.RESUMABLE_UPLOAD, context)
+        chunk_size_mb = self.parameterAsInt(parameters, self.CHUNK_SIZE_MB, context)
+        max_retries = self.parameterAsInt(parameters, self.MAX_RETRIES, context)
 
         if source_file != '':
             if not os.path.isfile(source_file):
@@ -160,16 +191,44 @@ class AddGraphVersionAlgorithm(QgsProcessingAlgorithm):
             feedback.reportError('Cannot connect to Graphium', True)
             return False
 
-        feedback.setProgress(10)
-
         graph_metadata = self.read_metadata(source_file, feedback)
+        if graph_metadata is None:
+            return {self.OUTPUT_STATE: None}
 
-        is_hd_segments = True if graph_metadata["graphVersionMetadata"]["type"] == "hdwaysegment" else False
+        if check_graph_file:
+            if not self.check_graph_file(source_file, graph_metadata["graphVersionMetadata"], feedback):
+                return {self.OUTPUT_STATE: None}
+
+        is_hd_segments = True if graph_metadata["graphVersionMetadata"].get("type") == "hdwaysegment" else False
         if is_hd_segments:
             feedback.pushInfo('Graph version is HD dataset')
 
-        response = graphium.add_graph_version(source_file, graph_name, graph_version, is_hd_segments,
-                                              override_if_exists)
+        if resumable_upload:
+            # a resumed upload needs the same decompressed file as the interrupted one
+            target_file = os.path.join(GraphiumGraphManagementApi.resumable_upload_directory(),
+                                       hashlib.sha256(os.path.abspath(source_file).encode('utf-8')).hexdigest() +
+                                       '.graph.json')
+            upload_file = self.decompress_graph_file(source_file, feedback, target_file=target_file)
+        else:
+            upload_file = self.decompress_graph_file(source_file, feedback)
+        if upload_file is None:
+            return {self.OUTPUT_STATE: None}
+
+        # upload progress is reported by the API
+        response = None
+        try:
+            if resumable_upload:
+                response = graphium.add_graph_version_resumable(upload_file, graph_name, graph_version,
+                                                                is_hd_segments, override_if_exists, chunk_size_mb,
+                                                                max_retries)
+            else:
+                response = graphium.add_graph_version(upload_file, graph_name, graph_version, is_hd_segments,
+                                                      override_if_exists)
+        finally:
+            # keep the decompressed file of an unfinished resumable upload
+            if upload_file != source_file and (not resumable_upload or (response is not None and
+                                                                        'error' not in response)):
+                os.remove(upload_file)
 
         feedback.setProgress(100)
 
@@ -180,7 +239,7 @@ class AddGraphVersionAlgorithm(QgsProcessingAlgorithm):
             }
         elif 'error' in response:
             if 'msg' in response['error']:
-                if response['error']['msg'] == 'ContentNotFoundError':
+                if response['error']['msg'].endswith('ContentNotFoundError'):
                     feedback.reportError('Graphium server "' + server_name + '" does not support adding a new' +
                                          (' HD' if is_hd_segments else '') + ' graph version to the server!', True)
                 else:
@@ -196,29 +255,112 @@ class AddGraphVersionAlgorithm(QgsProcessingAlgorithm):
     @staticmethod
     def read_metadata(source_file, feedback):
         """
-        Reads and returns metadata section of graph version JSON file
+        Reads and returns metadata section of graph version JSON file (optionally gzip compressed)
         :param source_file:
         :param feedback:
         :return: JSON object that includes the graphVersionMetadata
         """
 
-        string = ""
-        number_parenthesis = 0
-        with open(source_file, 'r+') as f:
-            while len(string) < 30 or number_parenthesis > 1:
-                buf = f.read(1)
-                if buf:
-                    string += buf
-                    if buf == '{':
-                        number_parenthesis += 1
-                    elif buf == '}':
-                        number_parenthesis -= 1
-                else:
+        try:
+            graph_version_metadata = GraphJsonStreamParser.read_metadata(source_file)
+        except json.JSONDecodeError as e:
+            feedback.reportError("JSON Decode Error from position " + str(e.pos), True)
+            return None
+        except OSError as e:
+            feedback.reportError("Cannot read graph file: " + str(e), True)
+            return None
+
+        if graph_version_metadata is None:
+            feedback.reportError("Graph file does not contain graphVersionMetadata", True)
+            return None
+        return {"graphVersionMetadata": graph_version_metadata}
+
+    @staticmethod
+    def decompress_graph_file(source_file, feedback, chunk_size=1024 * 1024, target_file=None):
+        """
+        The server expects an uncompressed graph JSON file, therefore a gzip compressed file is decompressed to a
+        temporary file
+        :param target_file: path of the decompressed file; reused if it is newer than the source file
+        :return: path of the file to upload (source_file if it is not compressed) or None if canceled
+        """
+        with open(source_file, 'rb') as f:
+            if f.read(2) != b'\x1f\x8b':
+                return source_file
+
+        if target_file is None:
+            file_name = os.path.basename(source_file)
+            target_file = QgsProcessingUtils.generateTempFilename(file_name[:-3] if file_name.lower().endswith('.gz')
+                                                                  else file_name + '.json')
+        elif os.path.isfile(target_file) and os.path.getmtime(target_file) >= os.path.getmtime(source_file):
+            feedback.pushInfo('Reuse decompressed graph file ' + target_file)
+            return target_file
+        else:
+            os.makedirs(os.path.dirname(target_file), exist_ok=True)
+
+        feedback.pushInfo('Decompress graph file to ' + target_file)
+        # the file is renamed when complete, so an existing target file is never truncated
+        part_file = target_file + '.part'
+        with gzip.open(source_file, 'rb') as source, open(part_file, 'wb') as target:
+            for chunk in iter(lambda: source.read(chunk_size), b''):
+                if feedback.isCanceled():
                     break
+                target.write(chunk)
+        if feedback.isCanceled():
+            os.remove(part_file)
+            return None
+        os.replace(part_file, target_file)
+        return target_file
 
-        string += '}'
+    @staticmethod
+    def import_graph_version(connection, graph_file, graph_name, graph_version, override_if_exists, feedback):
+        """
+        Imports a graph file to the Graphium server without running the algorithm, e.g. a cached output of the OSM
+        or GIP converter
+        :return: True if the graph version has been imported
+        """
+        feedback.pushInfo("Import graph version to Graphium server '" + connection.name + "' ...")
+        graphium = GraphiumGraphManagementApi(feedback)
+        if graphium.connect(connection) is False:
+            feedback.reportError('Cannot connect to Graphium', True)
+            return False
+
+        response = graphium.add_graph_version(graph_file, graph_name, graph_version, False, override_if_exists)
+        if 'state' in response:
+            feedback.pushInfo('Imported graph version with state ' + str(response['state']))
+            return True
+        elif 'error' in response and 'msg' in response['error']:
+            feedback.reportError(response['error']['msg'], True)
+        elif 'exception' in response:
+            feedback.reportError(str(response['exception']), True)
+        else:
+            feedback.reportError('Unknown error', True)
+        return False
 
+    @staticmethod
+    def check_graph_file(source_file, graph_version_metadata, feedback):
+        """
+        Scans the graph file and compares number of segments with the metadata
+        :return: True if the graph file is consistent
+        """
         try:
-            return json.loads(string)
+            statistics = GraphJsonStreamParser.read_statistics(source_file, feedback)
         except json.JSONDecodeError as e:
             feedback.reportError("JSON Decode Error from position " + str(e.pos), True)
+            return False
+        if statistics is None:
+            # canceled
+            return False
+
+        feedback.pushInfo('Graph file contains ' + str(statistics['segments_count']) + ' segments')
+        if statistics['bbox'] is not None:
+            feedback.pushInfo('Extent: ' + ', '.join([str(c) for c in statistics['bbox']]))
+
+        if statistics['segments_count'] == 0:
+            feedback.reportError('Graph file does not contain any segments', True)
+            return False
+        segments_count = graph_version_metadata.get('segmentsCount')
+        if segments_count is not None and segments_count != statistics['segments_count']:
+            feedback.reportError('Number of segments (' + str(statistics['segments_count']) +
+                                 ') does not match segmentsCount (' + str(segments_count) + ') of metadata', True)
+            return False
+        return True
@@ -0,0 +1,490 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ QGIS plugin 'Graphium'
+/***************************************************************************
+ *
+ * Copyright 2020 Simon Gröchenig @ Salzburg Research
+ * eMail     graphium@salzburgresearch.at
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ *
+ ***************************************************************************/
+"""
+
+import os
+import csv
+import json
+import time
+from datetime import datetime
+from concurrent.futures import (ThreadPoolExecutor, wait, FIRST_COMPLETED)
+# PyQt imports
+from qgis.PyQt.QtCore import (QCoreApplication, QSettings)
+from qgis.PyQt.QtGui import (QIcon)
+# qgis imports
+from qgis.core import (QgsProcessingAlgorithm, QgsProcessingFeedback, QgsProcessingParameterFile,
+                       QgsProcessingParameterBoolean, QgsProcessingParameterEnum, QgsProcessingParameterNumber,
+                       QgsProcessingParameterFileDestination, QgsProcessingOutputNumber)
+# plugin imports
+from .osm2graphium_algorithm import Osm2GraphiumAlgorithm
+from .gip2graphium_algorithm import Gip2GraphiumAlgorithm
+from ..converter_runner import ConverterRunner
+from ..conversion_cache import ConversionCache
+from ..model.osm_highway_types import OsmHighwayTypes, DEFAULT_OSM_HIGHWAY_TYPES
+from ...graphium_graph_management_api import GraphiumGraphManagementApi
+from ...graph_data.graph_json_stream import GraphJsonStreamParser
+from ...connection.graphium_connection_manager import GraphiumConnectionManager
+from ...settings import Settings
+
+
+class BatchConvertJobFeedback(QgsProcessingFeedback):
+    """
+    Feedback of a single conversion job. Errors are kept for the job report.
+    """
+
+    def __init__(self):
+        super(BatchConvertJobFeedback, self).__init__()
+        self.errors = []
+
+    def reportError(self, error, fatalError=False):
+        self.errors.append(error)
+        super(BatchConvertJobFeedback, self).reportError(error, fatalError)
+
+
+class BatchConvertAlgorithm(QgsProcessingAlgorithm):
+    """
+    This algorithm converts several OpenStreetMap and GIP files into Graphium JSON format in parallel and uploads each
+    converted graph version as soon as its conversion has finished.
+    """
+
+    plugin_path = os.path.split(os.path.split(os.path.split(os.path.dirname(__file__))[0])[0])[0]
+
+    INPUT_JAVA = 'INPUT_JAVA'
+    INPUT_OSM2GRAPHIUM = 'INPUT_OSM2GRAPHIUM'
+    INPUT_IDF2GRAPHIUM = 'INPUT_IDF2GRAPHIUM'
+    MANIFEST = 'MANIFEST'
+    SERVER_NAME = 'SERVER_NAME'
+    OVERRIDE_IF_EXISTS = 'OVERRIDE_IF_EXISTS'
+    HIGHWAY_TYPES = 'HIGHWAY_TYPES'
+    TAGS = 'TAGS'
+    OUTPUT_DIRECTORY = 'OUTPUT_DIRECTORY'
+    MAX_JOBS = 'MAX_JOBS'
+    JAVA_HEAP_MB = 'JAVA_HEAP_MB'
+    USE_CACHE = 'USE_CACHE'
+    OUTPUT_REPORT = 'OUTPUT_REPORT'
+    OUTPUT_FAILED_COUNT = 'OUTPUT_FAILED_COUNT'
+
+    REPORT_FIELDS = ['input', 'type', 'graph_name', 'graph_version', 'state', 'output_file', 'duration_sec',
+                     'message']
+
+    # share of the physical memory used for the heaps of all converters
+    MEMORY_SHARE = 0.8
+
+    def __init__(self):
+        super().__init__()
+
+        self.alg_group = "Graph Management"
+        self.alg_group_id = "graphmanagement"
+        self.alg_name = "BatchConvert"
+        self.alg_display_name = "Batch convert and import graph versions"
+
+        self.valid_timestamp_format = '%Y-%m-%d %H:%M'
+        self.highway_options = [highway_type.name for highway_type in OsmHighwayTypes]
+        self.tags_options = ['none', 'all']
+        self.connection_manager = GraphiumConnectionManager()
+        self.server_name_options = list()
+
+    def createInstance(self):
+        return BatchConvertAlgorithm()
+
+    def group(self):
+        return self.tr(self.alg_group)
+
+    def groupId(self):
+        return self.alg_group_id
+
+    def name(self):
+        return self.alg_name
+
+    def displayName(self):
+        return self.tr(self.alg_display_name)
+
+    def shortHelpString(self):
+        return self.tr('This algorithm converts several OpenStreetMap (*.pbf, *.osm) and GIP (*.zip) files into '
+                       'Graphium JSON format and imports each converted graph version as soon as its conversion has '
+                       'finished.\n\nThe manifest is a CSV file (with header) or a JSON list of objects with the '
+                       'fields "input", "graph_name", "version" and optionally "valid_from", "valid_to" (format '
+                       + self.valid_timestamp_format + ') and "type" (osm or gip). Relative input paths are resolved '
+                       'against the directory of the manifest. Highway types and tags apply to all OSM files.\n\n'
+                       'The number of parallel conversions is limited by the number of processors and the available '
+                       'memory. The result of each job is written to the report.')
+
+    def icon(self):
+        return QIcon(os.path.join(self.plugin_path, 'icons/icon.svg'))
+
+    def tr(self, string):
+        """
+        Returns a translatable string with the self.tr() function.
+        """
+        return QCoreApplication.translate('Processing', string)
+
+    def initAlgorithm(self, config=None):
+        """
+        Definition of inputs and outputs of the algorithm, along with some other properties.
+        """
+
+        source_java = QSettings().value('plugin-graphium/java_exe', '')
+        self.addParameter(QgsProcessingParameterFile(self.INPUT_JAVA, self.tr('Java Runtime Environment (JRE) file'),
+                                                     QgsProcessingParameterFile.Behavior.File, 'exe', source_java,
+                                                     False))
+        source_osm2graphium = QSettings().value('plugin-graphium/osm2graphium_jar', '')
+        self.addParameter(QgsProcessingParameterFile(self.INPUT_OSM2GRAPHIUM, self.tr('OSM2Graphium JAR file'),
+                                                     QgsProcessingParameterFile.Behavior.File, 'jar',
+                                                     source_osm2graphium, True))
+        source_idf2graphium = QSettings().value('plugin-graphium/idf2graphium_jar', '')
+        self.addParameter(QgsProcessingParameterFile(self.INPUT_IDF2GRAPHIUM, self.tr('IDF2Graphium JAR file'),
+                                                     QgsProcessingParameterFile.Behavior.File, 'jar',
+                                                     source_idf2graphium, True))
+        self.addParameter(QgsProcessingParameterFile(self.MANIFEST, self.tr('Manifest (CSV or JSON)'),
+                                                     QgsProcessingParameterFile.Behavior.File, None, None, False))
+
+        # read server connections and prepare enum items
+        self.server_name_options.clear()
+        self.server_name_options.append("[Do not import the converted files to the server]")
+        selected_graph_server = Settings.get_selected_graph_server()
+        selected_index = 0
+        for index, connection in enumerate(self.connection_manager.read_connections()):
+            self.server_name_options.append(connection.name)
+            if selected_index == 0 and isinstance(selected_graph_server, str)\
+                    and connection.name == selected_graph_server:
+                selected_index = index + 1
+        self.addParameter(QgsProcessingParameterEnum(self.SERVER_NAME, self.tr('Server name'),
+                                                     self.server_name_options, False, selected_index, False))
+
+        self.addParameter(QgsProcessingParameterBoolean(self.OVERRIDE_IF_EXISTS,
+                                                        self.tr('Override graph versions if they exist on server'),
+                                                        True, True))
+
+        self.addParameter(QgsProcessingParameterEnum(self.HIGHWAY_TYPES,
+                                                     self.tr('Highway types of OSM files (all if none selected)'),
+                                                     self.highway_options, True,
+                                                     [self.highway_options.index(highway_type.name)
+                                                      for highway_type in DEFAULT_OSM_HIGHWAY_TYPES], True))
+        self.addParameter(QgsProcessingParameterEnum(self.TAGS, self.tr('Tags of OSM files'), self.tags_options,
+                                                     False, 0, True))
+
+        output_dir = QSettings().value('plugin-graphium/batch_convert_output_dir', '')
+        self.addParameter(QgsProcessingParameterFile(self.OUTPUT_DIRECTORY, self.tr('Output directory'),
+                                                     QgsProcessingParameterFile.Folder, defaultValue=output_dir,
+                                                     optional=False))
+
+        self.addParameter(QgsProcessingParameterNumber(self.MAX_JOBS,
+                                                       self.tr('Maximum number of parallel conversions '
+                                                               '(0 = determined by processors and memory)'),
+                                                       QgsProcessingParameterNumber.Integer, 0, True, 0))
+        self.addParameter(QgsProcessingParameterNumber(self.JAVA_HEAP_MB,
+                                                       self.tr('Maximum Java heap size per conversion [MB] '
+                                                               '(0 = JVM default)'),
+                                                       QgsProcessingParameterNumber.Integer,
+                                                       int(QSettings().value('plugin-graphium/java_heap_mb', 0)),
+                                                       True, 0))
+        self.addParameter(QgsProcessingParameterBoolean(self.USE_CACHE,
+                                                        self.tr('Reuse converted files of earlier runs with the same '
+                                                                'input files and options'), True, True))
+
+        self.addParameter(QgsProcessingParameterFileDestination(self.OUTPUT_REPORT, self.tr('Job report'),
+                                                                'CSV files (*.csv)', None, True))
+        self.addOutput(QgsProcessingOutputNumber(self.OUTPUT_FAILED_COUNT, self.tr('Number of failed jobs')))
+
+    def checkParameterValues(self, parameters, context):
+        ok, message = super(BatchConvertAlgorithm, self).checkParameterValues(parameters, context)
+        if ok:
+            source_java = self.parameterAsFile(parameters, self.INPUT_JAVA, context)
+            if source_java != '':
+                if not os.path.isfile(source_java):
+                    ok, message = False, 'Cannot find JRE file!'
+            output_directory = self.parameterAsFileOutput(parameters, self.OUTPUT_DIRECTORY, context)
+            if output_directory != '':
+                if not os.path.isdir(output_directory):
+                    ok, message = False, 'Cannot find output directory!'
+        return ok, message
+
+    def processAlgorithm(self, parameters, context, feedback):
+        source_java = self.parameterAsFile(parameters, self.INPUT_JAVA, context)
+        source_osm2graphium = self.parameterAsFile(parameters, self.INPUT_OSM2GRAPHIUM, context)
+        source_idf2graphium = self.parameterAsFile(parameters, self.INPUT_IDF2GRAPHIUM, context)
+        manifest_file = self.parameterAsFile(parameters, self.MANIFEST, context)
+        server_name_index = self.parameterAsEnum(parameters, self.SERVER_NAME, context)
+        override_if_exists = self.parameterAsBoolean(parameters, self.OVERRIDE_IF_EXISTS, context)
+        highway_type_indexes = self.parameterAsEnums(parameters, self.HIGHWAY_TYPES, context)
+        tags = self.tags_options[self.parameterAsInt(parameters, self.TAGS, context)]
+        output_directory = self.parameterAsFileOutput(parameters, self.OUTPUT_DIRECTORY, context)
+        max_jobs = self.parameterAsInt(parameters, self.MAX_JOBS, context)
+        java_heap_mb = self.parameterAsInt(parameters, self.JAVA_HEAP_MB, context)
+        use_cache = self.parameterAsBoolean(parameters, self.USE_CACHE, context)
+        report_file = self.parameterAsFileOutput(parameters, self.OUTPUT_REPORT, context)
+
+        QSettings().setValue("plugin-graphium/java_exe", source_java)
+        QSettings().setValue("plugin-graphium/java_heap_mb", java_heap_mb)
+        QSettings().setValue("plugin-graphium/batch_convert_output_dir", output_directory)
+
+        try:
+            jobs = self.read_manifest(manifest_file)
+        except (OSError, ValueError, KeyError) as e:
+            feedback.reportError('Cannot read manifest: ' + str(e), True)
+            return {self.OUTPUT_FAILED_COUNT: None}
+        if len(jobs) == 0:
+            feedback.reportError('Manifest does not contain any jobs', True)
+            return {self.OUTPUT_FAILED_COUNT: None}
+
+        converters = {'osm': source_osm2graphium, 'gip': source_idf2graphium}
+        for job in jobs:
+            message = self.check_job(job, converters)
+            if message is not None:
+                feedback.reportError(job['input'] + ': ' + message, True)
+                return {self.OUTPUT_FAILED_COUNT: None}
+
+        selected_connection = None
+        if server_name_index > 0:
+            server_name = self.server_name_options[server_name_index]
+            selected_connection = self.connection_manager.select_graphium_server(server_name)
+            if selected_connection is None:
+                feedback.reportError('Cannot select connection to Graphium', True)
+                return {self.OUTPUT_FAILED_COUNT: None}
+            feedback.pushInfo("Converted graph versions will be imported to Graphium server '" + server_name + "'")
+
+        pool_size, java_threads = self.pool_size(len(jobs), max_jobs, java_heap_mb)
+        feedback.pushInfo('Converting ' + str(len(jobs)) + ' files with ' + str(pool_size) +
+                          ' parallel jobs (' + str(java_threads) + ' processors per job)...')
+
+        # the largest files are started first, therefore the total time is close to the longest job
+        jobs.sort(key=lambda j: os.path.getsize(j['input']), reverse=True)
+
+        # highway types are joined like in Osm2GraphiumAlgorithm, so both share the conversion cache
+        highway_types = ', '.join([OsmHighwayTypes[self.highway_options[index]].value
+                                   for index in highway_type_indexes]) if highway_type_indexes else None
+        osm_options = (highway_types, tags)
+
+        results = []
+        job_feedbacks = [BatchConvertJobFeedback() for _ in jobs]
+        executor = ThreadPoolExecutor(max_workers=pool_size)
+        futures = {executor.submit(self.run_job, job, job_feedbacks[index], converters[job['type']], source_java,
+                                   java_heap_mb, java_threads, output_directory, selected_connection,
+                                   override_if_exists, use_cache, osm_options, feedback): index
+                   for index, job in enumerate(jobs)}
+        pending = set(futures.keys())
+        while pending:
+            if feedback.isCanceled():
+                for job_feedback in job_feedbacks:
+                    job_feedback.cancel()
+                for future in pending:
+                    future.cancel()
+            done, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = futures[future]
+                if future.cancelled():
+                    result = self.job_result(jobs[index], 'canceled')
+                else:
+                    result = future.result()
+                results.append(result)
+                log = feedback.pushInfo if result['state'] in ['converted', 'imported'] else feedback.reportError
+                log('[' + jobs[index]['name'] + '] ' + result['state'] +
+                    (': ' + result['message'] if result['message'] else ''))
+            feedback.setProgress(sum([100 if f.done() else job_feedbacks[i].progress() for f, i in futures.items()])
+                                 / len(futures))
+        executor.shutdown()
+
+        failed_count = len([r for r in results if r['state'] not in ['converted', 'imported']])
+        feedback.pushInfo(str(len(results) - failed_count) + ' of ' + str(len(results)) + ' jobs succeeded')
+
+        outputs = {self.OUTPUT_FAILED_COUNT: failed_count}
+        if report_file:
+            with open(report_file, 'w', newline='', encoding='utf-8') as file:
+                writer = csv.DictWriter(file, self.REPORT_FIELDS)
+                writer.writeheader()
+                writer.writerows(sorted(results, key=lambda r: r['input']))
+            outputs[self.OUTPUT_REPORT] = report_file
+        return outputs
+
+    def read_manifest(self, manifest_file):
+        """
+        Reads the jobs of a CSV or JSON manifest
+        :return: list of jobs
+        """
+        if manifest_file.lower().endswith('.json'):
+            with open(manifest_file, 'r', encoding='utf-8') as file:
+                entries = json.load(file)
+            if not isinstance(entries, list):
+                raise ValueError('JSON manifest has to be a list of objects')
+        else:
+            with open(manifest_file, 'r', newline='', encoding='utf-8-sig') as file:
+                entries = list(csv.DictReader(file))
+
+        manifest_dir = os.path.dirname(os.path.abspath(manifest_file))
+        jobs = []
+        for entry in entries:
+            entry = {key.strip().lower(): str(value).strip() if value is not None else ''
+                     for key, value in entry.items() if key is not None}
+            source = entry['input']
+            if not os.path.isabs(source):
+                source = os.path.join(manifest_dir, source)
+            converter_type = entry.get('type', '').lower()
+            if converter_type == '':
+                converter_type = 'gip' if source.lower().endswith('.zip') else 'osm'
+            jobs.append({
+                'input': source,
+                'type': converter_type,
+                'graph_name': entry['graph_name'],
+                'graph_version': entry['version'],
+                'valid_from': entry.get('valid_from', ''),
+                'valid_to': entry.get('valid_to', ''),
+                'name': entry['graph_name'] + '_' + entry['version']
+            })
+        return jobs
+
+    def check_job(self, job, converters):
+        """
+        :return: error message or None if the job is valid
+        """
+        if job['type'] not in converters:
+            return 'Unknown type "' + job['type'] + '" (osm or gip)'
+        if not converters[job['type']] or not os.path.isfile(converters[job['type']]):
+            return 'Cannot find ' + ('OSM2Graphium' if job['type'] == 'osm' else 'IDF2Graphium') + ' converter file!'
+        if not os.path.isfile(job['input']):
+            return 'Cannot find input file!'
+        if job['graph_name'] == '' or job['graph_version'] == '':
+            return 'Graph name and version are required'
+        for key in ['valid_from', 'valid_to']:
+            if job[key] != '':
+                try:
+                    datetime.strptime(job[key], self.valid_timestamp_format)
+                except ValueError:
+                    return 'Cannot parse ' + key + ' (format ' + self.valid_timestamp_format + ')'
+        return None
+
+    def pool_size(self, job_count, max_jobs, java_heap_mb):
+        """
+        Determines the number of parallel conversions by the number of processors and the physical memory
+        :return: tuple of number of parallel jobs and number of processors per job
+        """
+        cpu_count = os.cpu_count() or 1
+        pool_size = min(cpu_count, job_count)
+
+        total_memory_mb = ConverterRunner.total_memory_mb()
+        if total_memory_mb is not None:
+            # the JVM uses a quarter of the physical memory as maximum heap by default
+            heap_mb = java_heap_mb if java_heap_mb > 0 else total_memory_mb // 4
+            pool_size = min(pool_size, int(total_memory_mb * self.MEMORY_SHARE // max(1, heap_mb)))
+        if max_jobs > 0:
+            pool_size = min(pool_size, max_jobs)
+        pool_size = max(1, pool_size)
+        return pool_size, max(1, cpu_count // pool_size)
+
+    @staticmethod
+    def job_result(job, state, output_file='', duration_sec=0, message=''):
+        return {
+            'input': job['input'],
+            'type': job['type'],
+            'graph_name': job['graph_name'],
+            'graph_version': job['graph_version'],
+            'state': state,
+            'output_file': output_file,
+            'duration_sec': round(duration_sec, 1),
+            'message': message
+        }
+
+    def run_job(self, job, job_feedback, converter, source_java, java_heap_mb, java_threads, output_directory,
+                connection, override_if_exists, use_cache, osm_options, feedback):
+        """
+        Converts one file and imports the converted graph version. Runs in a worker thread.
+        :param osm_options: tuple of comma separated highway types (all highway types if None) and tags for OSM files
+        :return: job result
+        """
+        start_time = time.time()
+        if job_feedback.isCanceled():
+            return self.job_result(job, 'canceled')
+
+        # each job writes into its own directory, because the converters create temporary files
+        job_directory = os.path.join(output_directory, job['name'])
+        os.makedirs(job_directory, exist_ok=True)
+
+        prefix = '[' + job['name'] + '] '
+        output_file = os.path.join(job_directory, job['graph_name'] + '_' + job['graph_version'] + '.json')
+
+        args = ConverterRunner.java_args(source_java, converter, java_heap_mb, java_threads)
+        if job['type'] == 'osm':
+            highway_types, tags = osm_options
+            args.extend(Osm2GraphiumAlgorithm.converter_args(job['input'], job_directory, job['graph_name'],
+                                                             job['graph_version'], job['valid_from'],
+                                                             job['valid_to'], highway_types, tags))
+            cache_options = Osm2GraphiumAlgorithm.cache_options(converter, job['graph_name'], job['graph_version'],
+                                                                job['valid_from'], job['valid_to'], highway_types,
+                                                                tags)
+        else:
+            args.extend(Gip2GraphiumAlgorithm.converter_args(job['input'], job_directory, job['graph_name'],
+                                                             job['graph_version'], job['valid_from'],
+                                                             job['valid_to']))
+            cache_options = Gip2GraphiumAlgorithm.cache_options(converter, job['graph_name'], job['graph_version'],
+                                                                job['valid_from'], job['valid_to'])
+
+        cache = ConversionCache(job_directory) if use_cache else None
+        cache_key = None
+        cached_file = None
+        if cache is not None:
+            cache_key = cache.key(job['input'], 'osm2graphium' if job['type'] == 'osm' else 'idf2graphium',
+                                  cache_options)
+            cached_file = cache.get(cache_key)
+
+        if cached_file is not None:
+            feedback.pushInfo(prefix + 'Input file and options have not changed, therefore the converter is skipped')
+            output_file = cached_file
+        else:
+            runner = ConverterRunner(job_feedback)
+            return_code = runner.run(args, lambda line: feedback.pushInfo(prefix + line))
+            if return_code is None:
+                return self.job_result(job, 'canceled', duration_sec=time.time() - start_time)
+            if return_code != 0 or not os.path.isfile(output_file):
+                message = 'Return code ' + str(return_code) + (': ' + runner.tail[-1] if runner.tail else '')
+                return self.job_result(job, 'conversion failed', duration_sec=time.time() - start_time,
+                                       message=message)
+            if cache is not None:
+                cache.put(cache_key, output_file)
+
+        if connection is None:
+            return self.job_result(job, 'converted', output_file, time.time() - start_time)
+
+        try:
+            metadata = GraphJsonStreamParser.read_metadata(output_file)
+        except (OSError, ValueError) as e:
+            return self.job_result(job, 'import failed', output_file, time.time() - start_time,
+                                   'Cannot read metadata: ' + str(e))
+        is_hd_segments = metadata is not None and metadata.get('type') == 'hdwaysegment'
+
+        # HttpRestApi is not thread-safe, therefore each job uses its own API instance
+        graphium = GraphiumGraphManagementApi(job_feedback)
+        graphium.connect(connection, False)
+        response = graphium.add_graph_version(output_file, job['graph_name'], job['graph_version'], is_hd_segments,
+                                              override_if_exists)
+        if 'state' in response:
+            return self.job_result(job, 'imported', output_file, time.time() - start_time,
+                                   'State ' + str(response['state']))
+        elif job_feedback.isCanceled():
+            return self.job_result(job, 'canceled', output_file, time.time() - start_time)
+        elif 'error' in response and 'msg' in response['error']:
+            message = response['error']['msg']
+        elif 'exception' in response:
+            message = str(response['exception'])
+        else:
+            message = '; '.join(job_feedback.errors) if job_feedback.errors else 'Unknown error'
+        return self.job_result(job, 'import failed', output_file, time.time() - start_time, message)
@@ -25,17 +25,19 @@
 
 import os
 from datetime import datetime
-import subprocess
 # PyQt imports
 from qgis.PyQt.QtCore import (QCoreApplication, QSettings)
 from qgis.PyQt.QtGui import (QIcon)
 # qgis imports
 from qgis.core import (QgsProcessingParameterFile, QgsProcessingParameterBoolean, QgsProcessingAlgorithm,
-                       QgsProcessingParameterString, QgsProcessingParameterEnum)
+                       QgsProcessingParameterString, QgsProcessingParameterEnum, QgsProcessingParameterNumber)
 # plugin imports
 from ..model.access import Access
 from ..model.function_road_class import FunctionalRoadClass
 from ...settings import Settings
+from ..converter_runner import ConverterRunner
+from ..conversion_cache import ConversionCache
+from .add_graph_version_algorithm import AddGraphVersionAlgorithm
 from ...connection.graphium_connection_manager import GraphiumConnectionManager
 
 
@@ -78,6 +80,9 @@ class Gip2GraphiumAlgorithm(QgsProcessingAlgorithm):
         self.KEEP_CONVERTED_FILE = 'KEEP_CONVERTED_FILE'
         self.OVERRIDE_IF_EXISTS = 'OVERRIDE_IF_EXISTS'
         self.OUTPUT_DIRECTORY = 'OUTPUT_DIRECTORY'
+        self.JAVA_HEAP_MB = 'JAVA_HEAP_MB'
+        self.JAVA_THREADS = 'JAVA_THREADS'
+        self.USE_CACHE = 'USE_CACHE'
         self.OUTPUT_JSON = 'OUTPUT_JSON'
 
         self.valid_timestamp_format = '%Y-%m-%d %H:%M'
@@ -213,6 +218,18 @@ class Gip2GraphiumAlgorithm(QgsProcessingAlgorithm):
                                                      QgsProcessingParameterFile.Folder, defaultValue=output_dir,
                                                      optional=False))
 
+        self.addParameter(QgsProcessingParameterNumber(self.JAVA_HEAP_MB,
+                                                       self.tr('Maximum Java heap size [MB] (0 = JVM default)'),
+                                                       QgsProcessingParameterNumber.Integer,
+                                                       int(QSettings().value('plugin-graphium/java_heap_mb', 0)),
+                                                       True, 0))
+        self.addParameter(QgsProcessingParameterNumber(self.JAVA_THREADS,
+                                                       self.tr('Number of processors used by Java (0 = all)'),
+                                                       QgsProcessingParameterNumber.Integer, 0, True, 0))
+        self.addParameter(QgsProcessingParameterBoolean(self.USE_CACHE,
+                                                        self.tr('Reuse converted file of an earlier run with the same '
+                                                                'input file and options'), True, True))
+
     def checkParameterValues(self, parameters, context):
         ok, message = super(Gip2GraphiumAlgorithm, self).checkParameterValues(parameters, context)
         if ok:
@@ -269,74 +286,116 @@ class Gip2GraphiumAlgorithm(QgsProcessingAlgorithm):
         keep_converted_file = self.parameterAsBoolean(parameters, self.KEEP_CONVERTED_FILE, context)
         overrides_if_exists = self.parameterAsBoolean(parameters, self.OVERRIDE_IF_EXISTS, context)
         output_directory = self.parameterAsFileOutput(parameters, self.OUTPUT_DIRECTORY, context)
+        java_heap_mb = self.parameterAsInt(parameters, self.JAVA_HEAP_MB, context)
+        java_threads = self.parameterAsInt(parameters, self.JAVA_THREADS, context)
+        use_cache = self.parameterAsBoolean(parameters, self.USE_CACHE, context)
 
         QSettings().setValue("plugin-graphium/java_exe", source_java)
+        QSettings().setValue("plugin-graphium/java_heap_mb", java_heap_mb)
         QSettings().setValue("plugin-graphium/idf2graphium_jar", source_idf2graphium)
         QSettings().setValue("plugin-graphium/idf2graphium_output_dir", output_directory)
 
         selected_connection = self.connection_manager.select_graphium_server(server_name)
 
-        import_frcs = '"'
+        import_frcs = ''
         for index, frc in enumerate(import_frcs_indexes):
             import_frcs += ',' if index > 0 else ''
             import_frcs += str(self.frc_option_values[frc])
-        import_frcs += '"'
 
-        access_types = '"'
+        access_types = ''
         for index, access in enumerate(access_types_indexes):
             access_types += ',' if index > 0 else ''
             access_types += self.access_option_values[access]
-        access_types += '"'
 
-        args = [source_java, '-jar', source_idf2graphium,
-                '-i', source, '-o', output_directory,
+        if not 0 < len(import_frcs_indexes) < len(FunctionalRoadClass):
+            import_frcs = None
+        if not 0 < len(access_types_indexes) < len(Access):
+            access_types = None
+
+        output_json = os.path.join(output_directory, graph_name + '_' + graph_version + '.json')
+        cache = ConversionCache(output_directory) if use_cache else None
+        cache_key = None
+        if cache is not None:
+            feedback.pushInfo('Check conversion cache...')
+            cache_key = cache.key(source, 'idf2graphium', self.cache_options(
+                source_idf2graphium, graph_name, graph_version, valid_from, valid_to, import_frcs, access_types))
+            cached_json = cache.get(cache_key)
+            if cached_json is not None:
+                feedback.pushInfo('Input file and options have not changed since the conversion into ' + cached_json +
+                                  ', therefore the converter is skipped')
+                if selected_connection and not AddGraphVersionAlgorithm.import_graph_version(
+                        selected_connection, cached_json, graph_name, graph_version, overrides_if_exists, feedback):
+                    return {}
+                return {self.OUTPUT_DIRECTORY: output_directory,
+                        self.OUTPUT_JSON: cached_json}
+
+        import_url = None
+        if selected_connection:
+            import_url = selected_connection.get_connection_url() + "/segments/graphs/" + graph_name + "/versions/" +\
+                graph_version + "?overrideIfExists=" + str(overrides_if_exists)
+
+        args = ConverterRunner.java_args(source_java, source_idf2graphium, java_heap_mb, java_threads)
+        args.extend(self.converter_args(source, output_directory, graph_name, graph_version, valid_from, valid_to,
+                                        import_frcs, access_types, keep_converted_file, import_url))
+
+        feedback.pushInfo(' '.join([str(elem) for elem in args]))
+        feedback.pushInfo('This process will take several minutes...')
+
+        return_code = ConverterRunner(feedback).run(args)
+        if return_code is None:
+            feedback.pushInfo('Conversion canceled')
+        elif return_code != 0:
+            feedback.reportError('Return code ' + str(return_code), True)
+        else:
+            if cache is not None:
+                # the output file is only cached if it is kept
+                cache.put(cache_key, output_json)
+            return {self.OUTPUT_DIRECTORY: output_directory,
+                    self.OUTPUT_JSON: output_json}
+
+        return {}
+
+    @staticmethod
+    def converter_args(source, output_directory, graph_name, graph_version, valid_from='', valid_to='',
+                       import_frcs=None, access_types=None, keep_converted_file=True, import_url=None):
+        """
+        Prepares the arguments of the IDF2Graphium converter
+        :param import_frcs: comma separated functional road classes; all functional road classes if None
+        :param access_types: comma separated access types; all access types if None
+        :param import_url: URL the converted graph version is uploaded to; no upload if None
+        :return: list of arguments
+        """
+        args = ['-i', source, '-o', output_directory,
                 '-n', graph_name, '-v', graph_version]
         if valid_from != '':
             args.extend(['-vf', valid_from])
         if valid_to != '':
             args.extend(['-vt', valid_to])
-        if 0 < len(import_frcs_indexes) < len(FunctionalRoadClass):
+        if import_frcs is not None:
             args.extend(['--import-frcs', import_frcs])
-        if 0 < len(access_types_indexes) < len(Access):
+        if access_types is not None:
             args.extend(['--access-types', access_types])
         args.append('--skip-pixel-cut')
-        # '--valid-from', valid_from, '--valid-to', valid_to,
-        # if skip_gip_import:
-        #     args.append('--skip-gip-import')
-        # if skip_pixel_cut:
-        #     args.append('--skip-pixel-cut')
-        # else:
-        #     args.extend(['--pixel-cut-min-frc', pixel_cut_min_frc, '--pixel-cut-max-frc', pixel_cut_max_frc])
-        #     if pixel_cut_enable_short_conn:
-        #         args.append('--pixel-cut-enable-short-conn')
-        # '--full-connectivity', 'false',
-        # '	--xinfo-csv',
-        # '	--downloadDir',
-        # args.extend(['--keepDownloadFile', str(keep_downloaded_file),
-        #              '--forceDownload', str(force_download)])
         args.extend(['--keepConvertedFile', str(keep_converted_file)])
-        if selected_connection:
-            url = selected_connection.get_connection_url() + "/segments/graphs/" + graph_name + "/versions/" +\
-                  graph_version + "?overrideIfExists=" + str(overrides_if_exists)
-            args.extend(['--importUrl', url])
-
-        feedback.pushInfo(' '.join([str(elem) for elem in args]))
-        feedback.pushInfo('This process will take several minutes...')
-
-        try:
-            process = subprocess.run(args, check=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, shell=True)
+        if import_url:
+            args.extend(['--importUrl', import_url])
+        return args
 
-            try:
-                out = process.stdout.decode('utf-8')
-                if out:
-                    feedback.pushInfo(out)
-            except UnicodeDecodeError:
-                feedback.reportError("Cannot decode response!")
-
-            return {self.OUTPUT_DIRECTORY: output_directory,
-                    self.OUTPUT_JSON: output_directory + '/' + graph_name + '_' + graph_version + '.json'}
-        except subprocess.CalledProcessError as e:
-            feedback.reportError('Return code ' + str(e.returncode), True)
-            feedback.reportError(str(e), True)
-
-        return {}
+    @staticmethod
+    def cache_options(converter_file, graph_name, graph_version, valid_from='', valid_to='', import_frcs=None,
+                      access_types=None):
+        """
+        Prepares the options which identify a converter run in the conversion cache
+        :param import_frcs: comma separated functional road classes; all functional road classes if None
+        :param access_types: comma separated access types; all access types if None
+        """
+        return {
+            'converter_file': os.path.basename(converter_file),
+            'converter_size': os.path.getsize(converter_file),
+            'graph_name': graph_name,
+            'graph_version': graph_version,
+            'valid_from': valid_from,
+            'valid_to': valid_to,
+            'import_frcs': import_frcs.split(',') if import_frcs is not None else None,
+            'access_types': access_types.split(',') if access_types is not None else None
+        }
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ QGIS plugin 'Graphium'
+/***************************************************************************
+ *
+ * Copyright 2020 Simon Gröchenig @ Salzburg Research
+ * eMail     graphium@salzburgresearch.at
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ *
+ ***************************************************************************/
+"""
+
+import os
+import json
+# PyQt5 imports
+from PyQt5.QtGui import (QIcon)
+# qgis imports
+from qgis.core import (QgsProcessingAlgorithm, QgsProcessingParameterFile, QgsProcessingParameterNumber,
+                       QgsProcessingParameterFileDestination, QgsProcessingOutputNumber, QgsProcessingUtils)
+from qgis.PyQt.QtCore import QCoreApplication
+# plugin
+from ...graph_data.graph_json_stream import GraphJsonStreamParser
+from ...graph_data import graph_validation
+from ...utilities.process_pool import ProcessPool
+
+
+class ValidateGraphFileAlgorithm(QgsProcessingAlgorithm):
+    """
+    This algorithm validates a graph version JSON file before it is imported to the Graphium server.
+    """
+
+    plugin_path = os.path.split(os.path.split(os.path.split(os.path.dirname(__file__))[0])[0])[0]
+
+    SOURCE_FILE = 'SOURCE_FILE'
+    WORKERS = 'WORKERS'
+    MAX_ERRORS = 'MAX_ERRORS'
+    OUTPUT_REPORT = 'OUTPUT_REPORT'
+    OUTPUT_ERROR_COUNT = 'OUTPUT_ERROR_COUNT'
+    OUTPUT_WARNING_COUNT = 'OUTPUT_WARNING_COUNT'
+    OUTPUT_SEGMENT_COUNT = 'OUTPUT_SEGMENT_COUNT'
+
+    # number of segments checked by one worker call
+    batch_size = 5000
+
+    def __init__(self):
+        super().__init__()
+
+        self.alg_group = "Graph Management"
+        self.alg_group_id = "graphmanagement"
+        self.alg_name = "ValidateGraphFile"
+        self.alg_display_name = "Validate Graph File"
+
+    def createInstance(self):
+        return ValidateGraphFileAlgorithm()
+
+    def group(self):
+        return self.tr(self.alg_group)
+
+    def groupId(self):
+        return self.alg_group_id
+
+    def name(self):
+        return self.alg_name
+
+    def displayName(self):
+        return self.tr(self.alg_display_name)
+
+    def shortHelpString(self):
+        return self.tr('This algorithm validates a graph version JSON file (optionally gzip compressed) before it is '
+                       'imported to the Graphium server. It checks the attributes and WKT geometries of all segments, '
+                       'duplicate segment IDs, connections to missing segments or to nodes of other segments, nodes '
+                       'shared by several segments without any connection, and the consistency of the metadata. '
+                       'Dangling nodes (start or end nodes referenced by a single segment only, e.g. dead ends) are '
+                       'reported as warnings. The file is read as stream; segments are checked in worker processes. '
+                       'Segment IDs, node IDs and connections are sorted in runs of one million values which are '
+                       'written to temporary files and merged, therefore the memory usage does not grow with the '
+                       'size of the graph (the temporary files need 8 bytes per segment ID, node reference and '
+                       'connection).')
+
+    def icon(self):
+        return QIcon(os.path.join(self.plugin_path, 'icons/icon.svg'))
+
+    def tr(self, string):
+        """
+        Returns a translatable string with the self.tr() function.
+        """
+        return QCoreApplication.translate('Processing', string)
+
+    def initAlgorithm(self, config=None):
+        """
+        Definition of inputs and outputs of the algorithm, along with some other properties.
+        """
+
+        self.addParameter(QgsProcessingParameterFile(self.SOURCE_FILE, self.tr('Input graph file'),
+                                                     QgsProcessingParameterFile.Behavior.File, optional=False))
+        self.addParameter(QgsProcessingParameterNumber(self.WORKERS,
+                                                       self.tr('Number of worker processes (0 = automatic)'),
+                                                       QgsProcessingParameterNumber.Integer, 0, True, 0, 64))
+        self.addParameter(QgsProcessingParameterNumber(self.MAX_ERRORS, self.tr('Maximum number of reported errors'),
+                                                       QgsProcessingParameterNumber.Integer, 100, True, 1))
+        self.addParameter(QgsProcessingParameterFileDestination(self.OUTPUT_REPORT, self.tr('Validation report'),
+                                                                '*.txt', None, True, False))
+
+        self.addOutput(QgsProcessingOutputNumber(self.OUTPUT_ERROR_COUNT, self.tr('Number of errors')))
+        self.addOutput(QgsProcessingOutputNumber(self.OUTPUT_WARNING_COUNT, self.tr('Number of warnings')))
+        self.addOutput(QgsProcessingOutputNumber(self.OUTPUT_SEGMENT_COUNT, self.tr('Number of segments')))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        source_file = self.parameterAsFile(parameters, self.SOURCE_FILE, context)
+        workers = self.parameterAsInt(parameters, self.WORKERS, context)
+        max_errors = self.parameterAsInt(parameters, self.MAX_ERRORS, context)
+        report_file = self.parameterAsFileOutput(parameters, self.OUTPUT_REPORT, context)
+
+        if not os.path.isfile(source_file):
+            feedback.reportError('Cannot find input graph file!', True)
+            return {self.OUTPUT_ERROR_COUNT: None, self.OUTPUT_WARNING_COUNT: None, self.OUTPUT_SEGMENT_COUNT: None}
+
+        state = {'errors': [], 'error_count': 0, 'warnings': [], 'warning_count': 0, 'segments_count': 0}
+        run_files = {key: graph_validation.SortedRunFile(QgsProcessingUtils.tempFolder())
+                     for key in ('ids', 'targets', 'nodes', 'connection_nodes')}
+        try:
+            return self.validate(source_file, workers, max_errors, report_file, state, run_files, feedback)
+        finally:
+            for run_file in run_files.values():
+                run_file.close()
+
+    def validate(self, source_file, workers, max_errors, report_file, state, run_files, feedback):
+        """
+        Checks the segments in worker processes and the collected IDs of all segments
+        """
+        metadata = None
+        segment_type = None
+
+        def add_error(message, count=1):
+            state['error_count'] += count
+            if len(state['errors']) < max_errors:
+                state['errors'].append(message)
+                feedback.reportError(message, False)
+
+        def add_warning(message, count=1):
+            state['warning_count'] += count
+            if len(state['warnings']) < max_errors:
+                state['warnings'].append(message)
+                feedback.pushInfo('Warning: ' + message)
+
+        def collect_result(future):
+            result = future.result()
+            state['error_count'] += result['error_count'] - len(result['errors'])
+            for message in result['errors']:
+                add_error(message)
+            for key, run_file in run_files.items():
+                run_file.add(result[key])
+
+        with ProcessPool(workers) as pool:
+            feedback.pushInfo('Check segments ' + ('in ' + str(pool.max_workers) + ' worker processes'
+                                                   if pool.is_parallel() else 'in the current process'))
+            # limit the number of batches in memory
+            max_pending = 2 * pool.max_workers
+            pending = []
+            batch = []
+            try:
+                for key, value, is_array_item in GraphJsonStreamParser.read_file(source_file):
+                    if feedback.isCanceled():
+                        break
+                    if key in GraphJsonStreamParser.SEGMENT_KEYS and is_array_item:
+                        segment_type = key
+                        batch.append(value)
+                        state['segments_count'] += 1
+                        if len(batch) >= self.batch_size:
+                            pending.append(pool.submit(graph_validation.check_segments, batch, max_errors))
+                            batch = []
+                            while len(pending) >= max_pending:
+                                collect_result(pending.pop(0))
+                            if metadata is not None and metadata.get('segmentsCount'):
+                                feedback.setProgress(90 * state['segments_count'] / metadata['segmentsCount'])
+                    elif key == GraphJsonStreamParser.METADATA_KEY and not is_array_item:
+                        metadata = value
+                    elif not is_array_item:
+                        feedback.pushInfo('Unknown top level attribute ' + key)
+            except json.JSONDecodeError as e:
+                add_error('JSON Decode Error from position ' + str(e.pos) + ': ' + e.msg)
+
+            if len(batch) > 0 and not feedback.isCanceled():
+                pending.append(pool.submit(graph_validation.check_segments, batch, max_errors))
+            for future in pending:
+                if feedback.isCanceled():
+                    break
+                collect_result(future)
+            if feedback.isCanceled():
+                pool.shutdown(True)
+
+        if feedback.isCanceled():
+            return {self.OUTPUT_ERROR_COUNT: None, self.OUTPUT_WARNING_COUNT: None, self.OUTPUT_SEGMENT_COUNT: None}
+
+        feedback.pushInfo('Check segment IDs, nodes and connections')
+        duplicates, count = graph_validation.find_duplicates(run_files['ids'].merged(), max_errors)
+        if count > 0:
+            add_error('Duplicate segment IDs: ' + ', '.join([str(d) for d in duplicates]), count)
+        missing, count = graph_validation.find_missing(run_files['ids'].merged(), run_files['targets'].merged(),
+                                                       max_errors)
+        if count > 0:
+            add_error('Connections to missing segments: ' + ', '.join([str(m) for m in missing]), count)
+        dangling, dangling_count, unconnected, unconnected_count = graph_validation.find_dangling_nodes(
+            run_files['nodes'].merged(), run_files['connection_nodes'].merged(), max_errors)
+        if dangling_count > 0:
+            add_warning('Dangling nodes referenced by a single segment: ' +
+                        ', '.join([str(d) for d in dangling]), dangling_count)
+        # files without any connections (e.g. exports without connectivity) are not checked for unconnected nodes
+        if unconnected_count > 0 and len(run_files['connection_nodes']) > 0:
+            add_error('Nodes shared by several segments without connections: ' +
+                      ', '.join([str(u) for u in unconnected]), unconnected_count)
+
+        for message in graph_validation.check_metadata(metadata, segment_type, state['segments_count']):
+            add_error(message)
+        if state['segments_count'] == 0:
+            add_error('Graph file does not contain any segments')
+
+        feedback.setProgress(100)
+        feedback.pushInfo(str(state['segments_count']) + ' segments checked, ' + str(state['error_count']) +
+                          ' errors and ' + str(state['warning_count']) + ' warnings found')
+
+        if report_file:
+            with open(report_file, 'w') as f:
+                f.write('Graph file: ' + source_file + '\n')
+                f.write('Segments: ' + str(state['segments_count']) + '\n')
+                f.write('Errors: ' + str(state['error_count']) + '\n')
+                for message in state['errors']:
+                    f.write(message + '\n')
+                f.write('Warnings: ' + str(state['warning_count']) + '\n')
+                for message in state['warnings']:
+                    f.write(message + '\n')
+
+        return {self.OUTPUT_ERROR_COUNT: state['error_count'],
+                self.OUTPUT_WARNING_COUNT: state['warning_count'],
+                self.OUTPUT_SEGMENT_COUNT: state['segments_count'],
+                self.OUTPUT_REPORT: report_file}
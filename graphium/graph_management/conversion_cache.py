@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ QGIS plugin 'Graphium'
+/***************************************************************************
+ *
+ * Copyright 2020 Simon Gröchenig @ Salzburg Research
+ * eMail     graphium@salzburgresearch.at
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ *
+ ***************************************************************************/
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+
+class ConversionCache:
+    """
+    Remembers the converted graph files of earlier converter runs. An entry is keyed by the SHA-256 hash of the input
+    file and a canonical form of the converter options, therefore a converter run with the same input file and the
+    same options can be skipped if its output file still exists unchanged.
+    The index is stored as JSON file in the output directory. Hashes of input files are remembered by path, size and
+    modification time, therefore large input files are hashed only once.
+    """
+
+    index_file_name = '.graphium_conversion_cache.json'
+    chunk_size = 1024 * 1024
+    # a lock file older than this is left over from a crashed process
+    stale_lock_sec = 30
+
+    # the index file of one directory may be used by several threads (e.g. batch conversion); other processes (e.g. a
+    # second QGIS instance or qgis_process) are excluded by a lock file next to the index
+    thread_lock = threading.Lock()
+
+    def __init__(self, output_directory):
+        self.output_directory = output_directory
+        self.index_file = os.path.join(output_directory, self.index_file_name)
+        self.lock_file = self.index_file + '.lock'
+
+    @contextmanager
+    def lock(self):
+        """
+        Locks the index against other threads and processes while it is read or updated
+        """
+        with self.thread_lock:
+            while True:
+                try:
+                    os.close(os.open(self.lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                    break
+                except FileExistsError:
+                    try:
+                        if time.time() - os.path.getmtime(self.lock_file) > self.stale_lock_sec:
+                            os.remove(self.lock_file)
+                            continue
+                    except OSError:
+                        # removed by the other process in the meantime
+                        continue
+                    time.sleep(0.05)
+            try:
+                yield
+            finally:
+                os.remove(self.lock_file)
+
+    def key(self, input_file, converter, options):
+        """
+        Calculates the cache key of a converter run
+        :param converter: name of the converter (e.g. 'osm2graphium')
+        :param options: dictionary of converter options; lists are sorted, empty strings are treated like None
+        :return: cache key
+        """
+        canonical_options = {}
+        for name, value in options.items():
+            if isinstance(value, (list, tuple, set)):
+                value = sorted([str(v).strip() for v in value])
+            elif isinstance(value, str):
+                value = value.strip() if value.strip() != '' else None
+            canonical_options[name] = value
+        canonical = json.dumps({'converter': converter, 'input': self.file_hash(input_file),
+                                'options': canonical_options}, sort_keys=True)
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def file_hash(self, file_path):
+        """
+        :return: SHA-256 hash of the file's content; reused from the index if size and modification time match
+        """
+        stat = os.stat(file_path)
+        path = os.path.abspath(file_path)
+        with self.lock():
+            known = self.read_index().get('files', {}).get(path)
+        if known is not None and known.get('size') == stat.st_size and known.get('mtime') == stat.st_mtime:
+            return known['sha256']
+
+        sha256 = hashlib.sha256()
+        with open(file_path, 'rb') as file:
+            for chunk in iter(lambda: file.read(self.chunk_size), b''):
+                sha256.update(chunk)
+        file_hash = sha256.hexdigest()
+
+        with self.lock():
+            index = self.read_index()
+            index.setdefault('files', {})[path] = {'size': stat.st_size, 'mtime': stat.st_mtime,
+                                                   'sha256': file_hash}
+            self.write_index(index)
+        return file_hash
+
+    def get(self, key):
+        """
+        :return: path of the cached output file or None if there is no valid entry
+        """
+        with self.lock():
+            entry = self.read_index().get('entries', {}).get(key)
+        if entry is None:
+            return None
+        output_file = os.path.join(self.output_directory, entry['output_file'])
+        if not os.path.isfile(output_file):
+            return None
+        stat = os.stat(output_file)
+        if stat.st_size != entry.get('size') or stat.st_mtime != entry.get('mtime'):
+            # the output file has been changed or replaced since the conversion
+            return None
+        return output_file
+
+    def put(self, key, output_file):
+        """
+        Adds the output file of a successful converter run
+        """
+        if not os.path.isfile(output_file):
+            return
+        stat = os.stat(output_file)
+        with self.lock():
+            index = self.read_index()
+            index.setdefault('entries', {})[key] = {
+                'output_file': os.path.relpath(output_file, self.output_directory),
+                'size': stat.st_size,
+                'mtime': stat.st_mtime,
+                'created': datetime.now().isoformat(timespec='seconds')
+            }
+            self.write_index(index)
+
+    def read_index(self):
+        try:
+            with open(self.index_file, 'r', encoding='utf-8') as file:
+                index = json.load(file)
+            return index if isinstance(index, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def write_index(self, index):
+        # the index is replaced atomically, therefore an interrupted write does not corrupt the cache
+        temp_file = self.index_file + '.tmp'
+        with open(temp_file, 'w', encoding='utf-8') as file:
+            json.dump(index, file, indent=1)
+        os.replace(temp_file, self.index_file)
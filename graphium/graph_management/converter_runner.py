@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ QGIS plugin 'Graphium'
+/***************************************************************************
+ *
+ * Copyright 2020 Simon Gröchenig @ Salzburg Research
+ * eMail     graphium@salzburgresearch.at
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ *
+ ***************************************************************************/
+"""
+
+import os
+import re
+import sys
+import signal
+import subprocess
+import threading
+import queue
+from collections import deque
+
+
+class ConverterRunner:
+    """
+    Runs a Java based graph converter (e.g. OSM2Graphium or IDF2Graphium) as child process. The output of the
+    converter is streamed line by line to the feedback, progress is parsed from lines containing percentages and the
+    whole process tree is killed if the feedback is canceled.
+    """
+
+    PROGRESS_PATTERN = re.compile(r'(\d{1,3}(?:\.\d+)?)\s?%')
+
+    def __init__(self, feedback=None, poll_interval_sec=0.2, tail_lines=50):
+        self.feedback = feedback
+        self.poll_interval_sec = poll_interval_sec
+        # last lines of the output, e.g. to report errors
+        self.tail = deque(maxlen=tail_lines)
+        self.process = None
+
+    @staticmethod
+    def java_args(java_exe, jar_file, java_heap_mb=0, java_threads=0):
+        """
+        Prepares the arguments to start a JAR file
+        :param java_heap_mb: maximum heap size of the JVM; 0 for the JVM default
+        :param java_threads: number of processors used by the JVM; 0 for all processors
+        :return: list of arguments
+        """
+        args = [java_exe]
+        if java_heap_mb > 0:
+            args.append('-Xmx' + str(java_heap_mb) + 'm')
+        if java_threads > 0:
+            args.extend(['-XX:ActiveProcessorCount=' + str(java_threads),
+                         '-XX:ParallelGCThreads=' + str(java_threads)])
+        args.extend(['-jar', jar_file])
+        return args
+
+    @staticmethod
+    def total_memory_mb():
+        """
+        Determines the physical memory of this machine
+        :return: physical memory in MB or None if unknown
+        """
+        try:
+            if sys.platform == 'win32':
+                import ctypes
+
+                class MemoryStatusEx(ctypes.Structure):
+                    _fields_ = [('dwLength', ctypes.c_ulong), ('dwMemoryLoad', ctypes.c_ulong),
+                                ('ullTotalPhys', ctypes.c_ulonglong), ('ullAvailPhys', ctypes.c_ulonglong),
+                                ('ullTotalPageFile', ctypes.c_ulonglong), ('ullAvailPageFile', ctypes.c_ulonglong),
+                                ('ullTotalVirtual', ctypes.c_ulonglong), ('ullAvailVirtual', ctypes.c_ulonglong),
+                                ('ullAvailExtendedVirtual', ctypes.c_ulonglong)]
+
+                status = MemoryStatusEx()
+                status.dwLength = ctypes.sizeof(MemoryStatusEx)
+                if not ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+                    return None
+                return status.ullTotalPhys // (1024 * 1024)
+            return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // (1024 * 1024)
+        except (AttributeError, ValueError, OSError):
+            return None
+
+    def run(self, args, line_function=None, progress_function=None):
+        """
+        Runs the converter and waits until it has finished or the feedback has been canceled
+        :param args: list of arguments (the process is started without shell)
+        :param line_function: function called with each output line; defaults to feedback.pushInfo
+        :param progress_function: function called with progress in percent; defaults to feedback.setProgress
+        :return: return code of the process or None if canceled
+        """
+        if line_function is None:
+            line_function = self.feedback.pushInfo if self.feedback is not None else print
+        if progress_function is None and self.feedback is not None:
+            progress_function = self.feedback.setProgress
+
+        popen_args = {}
+        if sys.platform == 'win32':
+            popen_args['creationflags'] = subprocess.CREATE_NEW_PROCESS_GROUP | subprocess.CREATE_NO_WINDOW
+        else:
+            # the converter gets its own process group, therefore the whole tree can be killed
+            popen_args['start_new_session'] = True
+
+        self.process = subprocess.Popen([str(arg) for arg in args], stdout=subprocess.PIPE,
+                                        stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL, **popen_args)
+
+        # the output is read in a separate thread, therefore cancellation is checked even if there is no output
+        lines = queue.Queue()
+        reader = threading.Thread(target=self.read_lines, args=(self.process.stdout, lines), daemon=True)
+        reader.start()
+
+        while True:
+            if self.is_canceled():
+                self.kill()
+                reader.join(5)
+                return None
+            try:
+                line = lines.get(timeout=self.poll_interval_sec)
+            except queue.Empty:
+                continue
+            if line is None:
+                break
+            self.tail.append(line)
+            line_function(line)
+            match = self.PROGRESS_PATTERN.search(line)
+            if match is not None and progress_function is not None:
+                progress_function(min(100.0, float(match.group(1))))
+
+        return self.process.wait()
+
+    @staticmethod
+    def read_lines(stream, lines):
+        for raw_line in iter(stream.readline, b''):
+            line = raw_line.decode('utf-8', 'replace').rstrip()
+            if line:
+                lines.put(line)
+        stream.close()
+        lines.put(None)
+
+    def is_canceled(self):
+        return self.feedback is not None and self.feedback.isCanceled()
+
+    def kill(self):
+        """
+        Kills the converter process including all child processes
+        """
+        if self.process is None or self.process.poll() is not None:
+            return
+        try:
+            if sys.platform == 'win32':
+                subprocess.run(['taskkill', '/F', '/T', '/PID', str(self.process.pid)], stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL, creationflags=subprocess.CREATE_NO_WINDOW)
+            else:
+                os.killpg(self.process.pid, signal.SIGKILL)
+        except (OSError, subprocess.SubprocessError):
+            self.process.kill()
+        self.process.wait()
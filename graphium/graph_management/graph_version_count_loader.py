@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ QGIS plugin 'Graphium'
+/***************************************************************************
+ *
+ * Copyright 2020 Simon Gröchenig @ Salzburg Research
+ * eMail     graphium@salzburgresearch.at
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ *
+ ***************************************************************************/
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+# PyQt imports
+from qgis.PyQt.QtCore import (QObject, pyqtSignal)
+# plugin classes
+from ..graphium_graph_management_api import GraphiumGraphManagementApi
+
+
+class GraphVersionCountLoader(QObject):
+    """
+    Loads the number of graph versions per graph name in a bounded pool of background threads. Each worker thread
+    uses its own API instance (HttpRestApi is not thread-safe). Results are emitted as signal and therefore delivered
+    in the thread of the connected receiver (e.g. the GUI thread).
+    """
+
+    graph_version_count_loaded = pyqtSignal(int, int)
+
+    def __init__(self, connection, max_workers=4, parent=None):
+        super(GraphVersionCountLoader, self).__init__(parent)
+        self.connection = connection
+        self.executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+        self.futures = []
+        self.canceled = threading.Event()
+        self.thread_data = threading.local()
+
+    def load(self, graph_names):
+        """
+        Starts loading the graph version counts
+        :param graph_names: list of graph names; the list index is emitted together with the count
+        """
+        for row, graph_name in enumerate(graph_names):
+            self.futures.append(self.executor.submit(self.load_graph_version_count, row, graph_name))
+
+    def load_graph_version_count(self, row, graph_name):
+        if self.canceled.is_set():
+            return
+
+        graphium = getattr(self.thread_data, 'graphium', None)
+        if graphium is None:
+            graphium = GraphiumGraphManagementApi()
+            graphium.connect(self.connection, False)
+            self.thread_data.graphium = graphium
+
+        response = graphium.get_graph_versions(graph_name)
+        if self.canceled.is_set():
+            return
+
+        if 'error' in response:
+            self.graph_version_count_loaded.emit(row, 0)
+        else:
+            self.graph_version_count_loaded.emit(row, len(response))
+
+    def cancel(self):
+        """
+        Cancels all requests which have not been started yet and ignores results of running requests
+        """
+        self.canceled.set()
+        for future in self.futures:
+            future.cancel()
+        self.executor.shutdown(wait=False)
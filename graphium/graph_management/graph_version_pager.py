@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ QGIS plugin 'Graphium'
+/***************************************************************************
+ *
+ * Copyright 2020 Simon Gröchenig @ Salzburg Research
+ * eMail     graphium@salzburgresearch.at
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ *
+ ***************************************************************************/
+"""
+
+
+class GraphVersionPager:
+    """
+    Loads the graph versions of a graph name page by page (e.g. for incremental loading of table or list models).
+    """
+
+    def __init__(self, graphium, graph_name, state_filter=None, page_size=100):
+        self.graphium = graphium
+        self.graph_name = graph_name
+        self.state_filter = state_filter
+        self.page_size = max(1, page_size)
+        self.offset = 0
+        self.has_more = True
+        self.error = None
+        self.version_keys = set()
+
+    def fetch_next_page(self):
+        """
+        Requests the next page of graph versions
+        :return: list of graph versions not loaded yet
+        """
+        if not self.has_more:
+            return []
+
+        versions, has_more = self.graphium.get_graph_versions_paged(self.graph_name, self.offset, self.page_size,
+                                                                    self.state_filter)
+        if 'error' in versions:
+            self.error = versions['error']
+            self.has_more = False
+            return []
+
+        self.offset += self.page_size
+        new_versions = []
+        for version in versions:
+            key = version.get('id', version.get('version'))
+            if key not in self.version_keys:
+                self.version_keys.add(key)
+                new_versions.append(version)
+
+        # stop if a page does not contain new graph versions (e.g. the server ignored the offset)
+        self.has_more = has_more and len(new_versions) > 0
+        return new_versions
@@ -32,6 +32,8 @@ from qgis.core import Qgis
 from .graphium_qgis_graph_select_dialog import GraphiumQGISGraphSelectDialog
 # plugin classes
 from Graphium.graphium.graphium_graph_management_api import GraphiumGraphManagementApi
+from Graphium.graphium.graph_management.graph_version_pager import GraphVersionPager
+from Graphium.graphium.graph_management.model.list_graph_version import ListGraphVersionModel
 from Graphium.graphium.connection.graphium_connection_manager import GraphiumConnectionManager
 from Graphium.graphium.settings import Settings
 
@@ -75,7 +77,7 @@ class GraphiumQGISGraphSelect:
         self.graphium = GraphiumGraphManagementApi()
         self.connection_manager = GraphiumConnectionManager()
         self.graph_names = []
-        self.graph_versions = []
+        self.graph_version_model = None
 
         if select_version:
             self.dlg.groupGraphVersion.setEnabled(True)
@@ -156,19 +158,17 @@ class GraphiumQGISGraphSelect:
         selected_name_index = self.dlg.cboGraphNames.currentIndex()
         selected_name = self.graph_names[selected_name_index]
 
-        self.graph_versions = self.graphium.get_graph_versions(selected_name, state_filter=self.filter_version_state)
-        version_list = list()
+        # the state filter is sent to the server; further graph versions are loaded while scrolling the list
+        pager = GraphVersionPager(self.graphium, selected_name, state_filter=self.filter_version_state,
+                                  page_size=int(Settings().get_value('graph_version_page_size', 100)))
+        self.graph_version_model = ListGraphVersionModel(pager, self.dlg.cboGraphVersions)
+        self.graph_version_model.fetchMore()
 
         selected_graph_version = Settings.get_selected_graph_version()
         current_index = 0
-        i = 0
-        for v in self.graph_versions:
-            version_list.append(v['version'] + ' (' + v['state'] + ')')
-            if isinstance(selected_graph_version, str) and selected_graph_version == v:
-                current_index = i
-            i += 1
-        self.dlg.cboGraphVersions.clear()
-        self.dlg.cboGraphVersions.addItems(version_list)
+        if isinstance(selected_graph_version, str):
+            current_index = max(0, self.graph_version_model.index_of_graph_version(selected_graph_version))
+        self.dlg.cboGraphVersions.setModel(self.graph_version_model)
         self.dlg.cboGraphVersions.setCurrentIndex(current_index)
 
     def graph_server_changed(self):
@@ -213,7 +213,7 @@ class GraphiumQGISGraphSelect:
 
             if self.dlg.cboGraphVersions.count() > 0:
                 selected_version_index = self.dlg.cboGraphVersions.currentIndex()
-                self.selected_graph_version = self.graph_versions[selected_version_index]
+                self.selected_graph_version = self.graph_version_model.graph_version(selected_version_index)
             else:
                 return False
 
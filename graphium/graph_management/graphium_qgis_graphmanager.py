@@ -24,13 +24,14 @@
 """
 
 import os.path
-from datetime import datetime
 import threading
+from functools import partial
 # PyQt imports
 from qgis.PyQt.QtCore import (QTranslator, QCoreApplication, Qt)
-from qgis.PyQt.QtWidgets import (QMenu, QMessageBox)
+from qgis.PyQt.QtWidgets import (QMenu, QMessageBox, QHeaderView)
 # qgis imports
-from qgis.core import Qgis, QgsProcessingException
+from qgis.core import (Qgis, QgsApplication, QgsProject, QgsVectorLayer, QgsProcessingContext, QgsProcessingFeedback,
+                       QgsProcessingAlgRunnerTask, QgsProcessingOutputLayerDefinition)
 from qgis import processing
 # Import the code for the dialog
 from .graphium_qgis_graphmanager_dialog import GraphiumQGISGraphManagerDialog
@@ -46,10 +47,28 @@ from .algorithm.remove_graph_version_algorithm import (RemoveGraphVersionAlgorit
 from .algorithm.update_graph_version_attribute_algorithm import (UpdateGraphVersionAttributeAlgorithm)
 from ..graph_data.algorithm.download_graph_version_algorithm import (DownloadGraphVersionAlgorithm)
 from .model.table_graph_version import TableGraphVersionModel
+from .model.table_graph_version_filter import TableGraphVersionFilterModel
 from .model.table_graph_name import TableGraphNameModel
+from .graph_version_count_loader import GraphVersionCountLoader
+from .graph_version_pager import GraphVersionPager
 from ..settings import Settings
 
 
+class GraphManagerTaskFeedback(QgsProcessingFeedback):
+    """
+    Processing feedback which keeps reported errors, because the Graphium algorithms report errors instead of
+    raising exceptions.
+    """
+
+    def __init__(self):
+        super(GraphManagerTaskFeedback, self).__init__()
+        self.errors = []
+
+    def reportError(self, error, fatalError=False):
+        self.errors.append(error)
+        super(GraphManagerTaskFeedback, self).reportError(error, fatalError)
+
+
 class GraphiumQGISGraphManager:
     """QGIS Plugin Implementation."""
 
@@ -83,10 +102,16 @@ class GraphiumQGISGraphManager:
         self.settings = Settings()
         self.graph_names = []
         self.table_graph_names_data = []
-        self.graph_versions = []
+        self.graph_version_filter_model = None
+        self.graph_version_count_loader = None
+        # running background tasks (task, context, feedback) by task key
+        self.algorithm_tasks = dict()
+        # open non-modal algorithm dialogs
+        self.algorithm_dialogs = set()
 
         # Create the dialog (after translation) and keep reference
         self.dlg = GraphiumQGISGraphManagerDialog(parent=self.iface.mainWindow())
+        self.dlg.finished.connect(self.cancel_graph_version_count_loader)
 
         self.dlg.btnConnect.clicked.connect(self.connect_to_graphium)
         self.dlg.btnNewConnection.clicked.connect(self.new_connection)
@@ -137,9 +162,9 @@ class GraphiumQGISGraphManager:
         self.dlg.chkFilterStateActive.setChecked(True)
         self.dlg.chkFilterStateDeleted.setChecked(False)
 
-        self.dlg.chkFilterStateInitial.toggled.connect(self.switch_to_graph_version_view)
-        self.dlg.chkFilterStateActive.toggled.connect(self.switch_to_graph_version_view)
-        self.dlg.chkFilterStateDeleted.toggled.connect(self.switch_to_graph_version_view)
+        self.dlg.chkFilterStateInitial.toggled.connect(self.filter_graph_versions)
+        self.dlg.chkFilterStateActive.toggled.connect(self.filter_graph_versions)
+        self.dlg.chkFilterStateDeleted.toggled.connect(self.filter_graph_versions)
 
         self.dlg.lblConnectedGraphServer.setTextInteractionFlags(Qt.TextSelectableByMouse)
         self.dlg.lblSelectedGraphName.setTextInteractionFlags(Qt.TextSelectableByMouse)
@@ -295,16 +320,6 @@ class GraphiumQGISGraphManager:
             if graph_name == default_graph_name:
                 default_graph_name_index = index
 
-        threads = []
-        for index, graph_name in enumerate(self.graph_names):
-            t = threading.Thread(target=self.get_number_of_graph_versions, args=(index,),
-                                 daemon=True)
-            threads.append(t)
-            t.start()
-
-        for thread in threads:
-            thread.join()
-
         # create the view
         table_view = self.dlg.tableGraphNames
 
@@ -332,12 +347,18 @@ class GraphiumQGISGraphManager:
         # disable sorting
         table_view.setSortingEnabled(False)
 
-    def get_number_of_graph_versions(self, graphname_index):
-        response = self.graphium.get_graph_versions(self.table_graph_names_data[graphname_index]['name'])
-        if 'error' in response:
-            self.table_graph_names_data[graphname_index]['graph_version_count'] = 0
-        else:
-            self.table_graph_names_data[graphname_index]['graph_version_count'] = len(response)
+        # graph version counts are filled in as soon as they have been loaded in the background
+        self.cancel_graph_version_count_loader()
+        if self.selected_connection and len(self.graph_names) > 0:
+            self.graph_version_count_loader = GraphVersionCountLoader(
+                self.selected_connection, int(self.settings.get_value('graph_version_count_workers', 4)))
+            self.graph_version_count_loader.graph_version_count_loaded.connect(tm.set_graph_version_count)
+            self.graph_version_count_loader.load(self.graph_names)
+
+    def cancel_graph_version_count_loader(self):
+        if self.graph_version_count_loader is not None:
+            self.graph_version_count_loader.cancel()
+            self.graph_version_count_loader = None
 
     def select_graph_name(self):
         selected_graph_name = self.get_selected_graph_name()
@@ -365,40 +386,14 @@ class GraphiumQGISGraphManager:
         self.dlg.btnDownloadGraphVersion.setEnabled(False)
         self.dlg.btnGraphVersionTasks.setEnabled(False)
 
-        response = self.graphium.get_graph_versions(selected_graph_name)
-        if 'error' in response:
+        # further graph versions are loaded as soon as the table has been scrolled to the end
+        pager = GraphVersionPager(self.graphium, selected_graph_name,
+                                  state_filter=self.get_graph_version_state_filter(),
+                                  page_size=int(self.settings.get_value('graph_version_page_size', 100)))
+        table_data = [TableGraphVersionModel.to_table_row(version) for version in pager.fetch_next_page()]
+        if pager.error is not None:
             self.iface.messageBar().pushMessage("Graphium", "Cannot retrieve graph versions from Graphium server [" +
                                                 self.selected_connection.name + "]", level=Qgis.Warning)
-            self.graph_versions = []
-        else:
-            self.graph_versions = response
-
-        if not self.dlg.chkFilterStateInitial.isChecked():
-            self.graph_versions = list(filter(lambda v: v.get('state') != 'INITIAL', self.graph_versions))
-        if not self.dlg.chkFilterStateActive.isChecked():
-            self.graph_versions = list(filter(lambda v: v.get('state') != 'ACTIVE', self.graph_versions))
-        if not self.dlg.chkFilterStateDeleted.isChecked():
-            self.graph_versions = list(filter(lambda v: v.get('state') != 'DELETED', self.graph_versions))
-
-        self.graph_versions = sorted(self.graph_versions, key=lambda entry: entry['validFrom'])
-
-        default_graph_version = Settings.get_selected_graph_version()
-        default_graph_version_index = -1
-
-        table_data = list()
-        for index, version in enumerate(self.graph_versions):
-            valid_from = datetime.utcfromtimestamp(version.get('validFrom', 0) / 1000) if 'validFrom' in version else \
-                None
-            valid_to = datetime.utcfromtimestamp(version.get('validTo', 0) / 1000) if 'validTo' in version else None
-
-            table_data.append({'id': version.get('id', ""),
-                               'version': version.get('version'),
-                               'type': 'HD' if version.get('type', '') == 'hdwaysegment' else '',
-                               'state': version.get('state'),
-                               'validFrom': valid_from,
-                               'validTo': valid_to})
-            if version['version'] == default_graph_version:
-                default_graph_version_index = index
 
         # create the view
         table_view = self.dlg.tableGraphVersions
@@ -406,8 +401,12 @@ class GraphiumQGISGraphManager:
         # set the table model
         header = ['ID', 'Graph version', 'Type', 'State', 'Valid From', 'Valid To']
         tm = TableGraphVersionModel(table_data, header, self.update_graph_version_validity, self)
-        tm.default_graph_version_index = default_graph_version_index
-        table_view.setModel(tm)
+        tm.default_graph_version = Settings.get_selected_graph_version()
+        tm.pager = pager
+        self.graph_version_filter_model = TableGraphVersionFilterModel(table_view)
+        self.graph_version_filter_model.setSourceModel(tm)
+        self.graph_version_filter_model.set_excluded_states(self.get_excluded_graph_version_states())
+        table_view.setModel(self.graph_version_filter_model)
         table_view.selectionModel().selectionChanged.connect(self.select_graph_version)
 
         # # https://gist.github.com/Riateche/5984815
@@ -419,17 +418,52 @@ class GraphiumQGISGraphManager:
         # hide vertical header
         vertical_header = table_view.verticalHeader()
         vertical_header.setVisible(False)
+        # set uniform row height
+        vertical_header.setSectionResizeMode(QHeaderView.Fixed)
+        vertical_header.setDefaultSectionSize(20)
         # set horizontal header properties
         horizontal_header = table_view.horizontalHeader()
         horizontal_header.setVisible(True)
         # horizontal_header.setStretchLastSection(True)
         # set column width to fit contents
         table_view.resizeColumnsToContents()
-        # set row height
-        for row in range(len(table_data)):
-            table_view.setRowHeight(row, 20)
-        # disable sorting
-        table_view.setSortingEnabled(False)
+        # sort by valid from
+        table_view.setSortingEnabled(True)
+        table_view.sortByColumn(4, Qt.AscendingOrder)
+
+    def get_excluded_graph_version_states(self):
+        excluded_states = set()
+        if not self.dlg.chkFilterStateInitial.isChecked():
+            excluded_states.add('INITIAL')
+        if not self.dlg.chkFilterStateActive.isChecked():
+            excluded_states.add('ACTIVE')
+        if not self.dlg.chkFilterStateDeleted.isChecked():
+            excluded_states.add('DELETED')
+        return excluded_states
+
+    def get_graph_version_state_filter(self):
+        """
+        :return: the selected state if exactly one graph version state is selected, else None; sent to the server
+                 when the graph versions of a graph name are loaded
+        """
+        selected_states = {'INITIAL', 'ACTIVE', 'DELETED'} - self.get_excluded_graph_version_states()
+        return next(iter(selected_states)) if len(selected_states) == 1 else None
+
+    def filter_graph_versions(self):
+        """
+        Applies the state filter to the loaded graph versions (no network call, no model rebuild)
+        """
+        if self.graph_version_filter_model is None:
+            return
+        self.graph_version_filter_model.set_excluded_states(self.get_excluded_graph_version_states())
+
+        # the server filter of the pager stays as it was when the graph versions have been loaded
+        pager = self.graph_version_filter_model.sourceModel().pager
+        selected_states = {'INITIAL', 'ACTIVE', 'DELETED'} - self.get_excluded_graph_version_states()
+        if pager is not None and pager.state_filter is not None and selected_states - {pager.state_filter}:
+            self.iface.messageBar().pushMessage("Graphium", "Only graph versions with state " + pager.state_filter +
+                                                " have been loaded. Manage the graph name again to load the graph "
+                                                "versions of all selected states.", level=Qgis.Info)
 
     def select_graph_version(self):
         graph_name, graph_version = self.get_selected_graph_name_and_version(False)
@@ -440,7 +474,8 @@ class GraphiumQGISGraphManager:
 
     def add_graph_version(self):
         """
-        Opens an algorithm dialog to add a new graph version
+        Opens the algorithm dialog to add a new graph version. The dialog does not block the graph manager; the
+        algorithm runs in a background task of the dialog.
         """
         graph_name, graph_version = self.get_selected_graph_name_and_version(False)
         connection_index, connection = self.read_current_connection()
@@ -452,10 +487,21 @@ class GraphiumQGISGraphManager:
             AddGraphVersionAlgorithm.OVERRIDE_IF_EXISTS: False
         }
 
-        processing.execAlgorithmDialog("Graphium:AddGraphVersion", parameters)
-
-        # update ui
-        self.switch_to_graph_version_view()
+        dialog = processing.createAlgorithmDialog("Graphium:AddGraphVersion", parameters)
+        # the graph manager runs modal, therefore the algorithm dialog has to be its child to receive input
+        dialog.setParent(self.dlg, dialog.windowFlags())
+        dialog.setModal(False)
+        self.algorithm_dialogs.add(dialog)
+        if hasattr(dialog, 'algorithmFinished'):
+            # QGIS >= 3.14: refresh as soon as the algorithm has finished, even if the dialog stays open
+            dialog.algorithmFinished.connect(lambda successful, results: self.refresh_view())
+        dialog.finished.connect(partial(self.algorithm_dialog_closed, dialog))
+        dialog.show()
+
+    def algorithm_dialog_closed(self, dialog, result=None):
+        self.algorithm_dialogs.discard(dialog)
+        if not hasattr(dialog, 'algorithmFinished'):
+            self.refresh_view()
 
     def add_graph_version_from_osm(self):
         """
@@ -516,14 +562,8 @@ class GraphiumQGISGraphManager:
                     RemoveGraphVersionAlgorithm.GRAPH_VERSION: graph_version['version']
                 }
 
-                try:
-                    processing.execAlgorithmDialog("Graphium:RemoveGraphVersion", parameters)
-                except QgsProcessingException:
-                    self.iface.messageBar().pushMessage("Warning", "Could not remove graph version",
-                                                        level=Qgis.Critical)
-
-                # update ui
-                self.switch_to_graph_version_view()
+                self.run_algorithm_task("Graphium:RemoveGraphVersion", parameters, "Could not remove graph version",
+                                        refresh_view=True)
 
         else:
             self.iface.messageBar().pushMessage("Warning", "Cannot remove graph version with state [DELETED]",
@@ -552,14 +592,8 @@ class GraphiumQGISGraphManager:
                         ActivateGraphVersionAlgorithm.GRAPH_VERSION: graph_version['version']
                     }
 
-                try:
-                    processing.execAlgorithmDialog("Graphium:ActivateGraphVersion", parameters)
-                except QgsProcessingException:
-                    self.iface.messageBar().pushMessage("Warning", "Could not activate graph version",
-                                                        level=Qgis.Critical)
-
-                # update ui
-                self.switch_to_graph_version_view()
+                self.run_algorithm_task("Graphium:ActivateGraphVersion", parameters,
+                                        "Could not activate graph version", refresh_view=True)
         else:
             self.iface.messageBar().pushMessage("Warning", "Cannot activate graph version with state [" +
                                                 graph_version['state'] + "]", level=Qgis.Warning)
@@ -577,14 +611,8 @@ class GraphiumQGISGraphManager:
             UpdateGraphVersionAttributeAlgorithm.NEW_VALUE: valid_date
         }
 
-        try:
-            processing.execAlgorithmDialog("Graphium:UpdateGraphVersionValidity", parameters)
-        except QgsProcessingException:
-            self.iface.messageBar().pushMessage("Warning", "Could not update graph version validity",
-                                                level=Qgis.Critical)
-
-        # update ui
-        self.switch_to_graph_version_view()
+        self.run_algorithm_task("Graphium:UpdateGraphVersionValidity", parameters,
+                                "Could not update graph version validity", refresh_view=True)
 
     def download_graph_version_to_map(self):
         """
@@ -597,17 +625,83 @@ class GraphiumQGISGraphManager:
 
         connection_index, connection = self.read_current_connection()
 
+        # the downloaded segments are added to the project as soon as the task has finished
+        output_segments = QgsProcessingOutputLayerDefinition('TEMPORARY_OUTPUT', QgsProject.instance())
+        output_segments.destinationName = graph_name + '_' + graph_version['version']
+
         parameters = {
                 DownloadGraphVersionAlgorithm.SERVER_NAME: connection_index,
                 DownloadGraphVersionAlgorithm.GRAPH_NAME: graph_name,
-                DownloadGraphVersionAlgorithm.GRAPH_VERSION: graph_version['version']
+                DownloadGraphVersionAlgorithm.GRAPH_VERSION: graph_version['version'],
+                DownloadGraphVersionAlgorithm.OUTPUT_SEGMENTS: output_segments
             }
 
-        try:
-            processing.execAlgorithmDialog("Graphium:DownloadGraphVersion", parameters)
-        except QgsProcessingException:
-            self.iface.messageBar().pushMessage("Warning", "Could not download the selected graph version",
+        self.run_algorithm_task("Graphium:DownloadGraphVersion", parameters,
+                                "Could not download the selected graph version", load_layers=True)
+
+    def run_algorithm_task(self, algorithm_id, parameters, error_message, refresh_view=False, load_layers=False):
+        """
+        Runs an algorithm as background task in the QGIS task manager. Several tasks can run at the same time.
+        :param algorithm_id: ID of the processing algorithm
+        :param parameters: algorithm parameters
+        :param error_message: message shown if the algorithm fails
+        :param refresh_view: refresh graph names / versions after the task has finished
+        :param load_layers: add the output layers to the project after the task has finished
+        :return: task or None
+        """
+        algorithm = QgsApplication.processingRegistry().createAlgorithmById(algorithm_id)
+        if algorithm is None:
+            self.iface.messageBar().pushMessage("Warning", "Cannot find algorithm " + algorithm_id,
                                                 level=Qgis.Critical)
+            return None
+
+        context = QgsProcessingContext()
+        context.setProject(QgsProject.instance())
+        feedback = GraphManagerTaskFeedback()
+
+        task = QgsProcessingAlgRunnerTask(algorithm, parameters, context, feedback)
+        task_key = id(task)
+        # context and feedback have to be referenced until the task has finished
+        self.algorithm_tasks[task_key] = (task, context, feedback)
+        task.executed.connect(partial(self.algorithm_task_executed, task_key, error_message, refresh_view,
+                                      load_layers))
+        QgsApplication.taskManager().addTask(task)
+        return task
+
+    def algorithm_task_executed(self, task_key, error_message, refresh_view, load_layers, successful, results):
+        """
+        Applies the result of a finished background task
+        """
+        task, context, feedback = self.algorithm_tasks.pop(task_key, (None, None, None))
+        if context is None or feedback.isCanceled():
+            return
+
+        if not successful or len(feedback.errors) > 0:
+            message = error_message + (': ' + feedback.errors[-1] if len(feedback.errors) > 0 else '')
+            self.iface.messageBar().pushMessage("Warning", message, level=Qgis.Critical)
+        elif load_layers:
+            for layer_id, details in context.layersToLoadOnCompletion().items():
+                layer = context.takeResultLayer(layer_id)
+                if layer is None:
+                    # output has been written to a file
+                    layer = QgsVectorLayer(layer_id, details.name, 'ogr')
+                if layer.isValid():
+                    layer.setName(details.name)
+                    QgsProject.instance().addMapLayer(layer)
+
+        # update ui
+        if refresh_view:
+            self.refresh_view()
+
+    def refresh_view(self):
+        """
+        Reloads the graph names or versions shown in the dialog
+        """
+        if self.dlg.isVisible():
+            if self.dlg.widgetGraphVersions.isVisible():
+                self.switch_to_graph_version_view()
+            else:
+                self.switch_to_graph_name_view()
 
     def set_default_graph_version(self):
         """
@@ -651,8 +745,10 @@ class GraphiumQGISGraphManager:
         selected_graph_version = None
         if self.dlg.tableGraphVersions.selectionModel():
             selected_version_indexes = self.dlg.tableGraphVersions.selectionModel().selectedRows()
-            if len(selected_version_indexes) == 1:
-                selected_graph_version = self.graph_versions[selected_version_indexes[0].row()]
+            if len(selected_version_indexes) == 1 and self.graph_version_filter_model is not None:
+                source_index = self.graph_version_filter_model.mapToSource(selected_version_indexes[0])
+                selected_graph_version = self.graph_version_filter_model.sourceModel().graph_version(
+                    source_index.row())
 
         if selected_graph_version is None:
             if push_messages:
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ QGIS plugin 'Graphium'
+/***************************************************************************
+ *
+ * Copyright 2020 Simon Gröchenig @ Salzburg Research
+ * eMail     graphium@salzburgresearch.at
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ *
+ ***************************************************************************/
+"""
+
+from PyQt5.QtCore import Qt, QAbstractListModel, QModelIndex
+
+
+class ListGraphVersionModel(QAbstractListModel):
+    """ Data model for graph version lists (e.g. combo boxes) with incremental loading """
+
+    def __init__(self, pager, parent=None):
+        """ pager: GraphVersionPager
+        """
+        super(ListGraphVersionModel, self).__init__(parent)
+        self.pager = pager
+        self._graph_versions = []
+
+    def graph_version(self, row):
+        return self._graph_versions[row]
+
+    def index_of_graph_version(self, graph_version):
+        """
+        :return: row of the given graph version or -1
+        """
+        for row, version in enumerate(self._graph_versions):
+            if version.get('version') == graph_version:
+                return row
+        return -1
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._graph_versions)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        elif role == Qt.DisplayRole:
+            version = self._graph_versions[index.row()]
+            return version.get('version', '') + ' (' + version.get('state', '') + ')'
+        return None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self.pager.has_more
+
+    def fetchMore(self, parent=QModelIndex()):
+        graph_versions = self.pager.fetch_next_page()
+        if len(graph_versions) > 0:
+            self.beginInsertRows(QModelIndex(), len(self._graph_versions),
+                                 len(self._graph_versions) + len(graph_versions) - 1)
+            self._graph_versions.extend(graph_versions)
+            self.endInsertRows()
+
+    def removeRows(self, row, count, parent=QModelIndex()):
+        if parent.isValid() or row < 0 or count <= 0 or row + count > len(self._graph_versions):
+            return False
+        self.beginRemoveRows(parent, row, row + count - 1)
+        del self._graph_versions[row:row + count]
+        self.endRemoveRows()
+        return True
@@ -51,3 +51,10 @@ class OsmHighwayTypes(Enum):
     PATH = 'path'
     SIDEWALK = 'sidewalk'
     CYCLEWAY = 'cycleway'
+
+
+# highway types converted by default (all roads down to tertiary roads and their links)
+DEFAULT_OSM_HIGHWAY_TYPES = [OsmHighwayTypes.MOTORWAY, OsmHighwayTypes.MOTORWAY_LINK, OsmHighwayTypes.TRUNK,
+                             OsmHighwayTypes.TRUNK_LINK, OsmHighwayTypes.PRIMARY, OsmHighwayTypes.PRIMARY_LINK,
+                             OsmHighwayTypes.SECONDARY, OsmHighwayTypes.SECONDARY_LINK, OsmHighwayTypes.TERTIARY,
+                             OsmHighwayTypes.TERTIARY_LINK]
@@ -72,6 +72,17 @@ class TableGraphNameModel(QAbstractTableModel):
                 return font
         return None
 
+    def set_graph_version_count(self, row, graph_version_count):
+        """
+        Updates the graph version count of a single row
+        :param row:
+        :param graph_version_count:
+        """
+        if 0 <= row < len(self._array_data):
+            self._array_data[row]['graph_version_count'] = graph_version_count
+            index = self.index(row, 1)
+            self.dataChanged.emit(index, index, [Qt.DisplayRole])
+
     def setData(self, index, value, role=Qt.EditRole):
         """
         Reads edited data from the table
@@ -23,7 +23,7 @@
  ***************************************************************************/
 """
 
-from PyQt5.QtCore import Qt, QAbstractTableModel
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex
 from PyQt5.QtGui import QFont
 from datetime import datetime
 
@@ -33,6 +33,9 @@ class TableGraphVersionModel(QAbstractTableModel):
 
     date_format = '%Y-%m-%d %H:%M:%S'
     date_read_format = '%Y-%m-%d %H:%M:%S%z'
+    columns = ['id', 'version', 'type', 'state', 'validFrom', 'validTo']
+    # role which provides raw values for sorting
+    SortRole = Qt.UserRole
 
     def __init__(self, data_in, header_data, update_graph_version_validity,  parent=None, *args):
         """ datain: a list of lists
@@ -41,9 +44,58 @@ class TableGraphVersionModel(QAbstractTableModel):
         # QAbstractTableModel.__init__(self, parent, *args)
         super(TableGraphVersionModel, self).__init__()
         self._array_data = data_in
+        # display strings are prepared once instead of on every paint
+        self._display_data = [self.to_display_row(row) for row in data_in]
         self._header_data = header_data
-        self.default_graph_version_index = -1
+        self.default_graph_version = None
         self.update_graph_version_validity = update_graph_version_validity
+        # optional GraphVersionPager for incremental loading
+        self.pager = None
+
+    @staticmethod
+    def to_table_row(graph_version):
+        """
+        Converts graph version metadata to a table row
+        """
+        valid_from = datetime.utcfromtimestamp(graph_version.get('validFrom', 0) / 1000) \
+            if 'validFrom' in graph_version else None
+        valid_to = datetime.utcfromtimestamp(graph_version.get('validTo', 0) / 1000) \
+            if 'validTo' in graph_version else None
+
+        return {'id': graph_version.get('id', ""),
+                'version': graph_version.get('version'),
+                'type': 'HD' if graph_version.get('type', '') == 'hdwaysegment' else '',
+                'state': graph_version.get('state'),
+                'validFrom': valid_from,
+                'validTo': valid_to,
+                'metadata': graph_version}
+
+    def graph_version(self, row):
+        """
+        :return: graph version metadata of the given row
+        """
+        return self._array_data[row]['metadata']
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return self.pager is not None and self.pager.has_more
+
+    def fetchMore(self, parent=QModelIndex()):
+        if self.pager is None:
+            return
+        rows = [self.to_table_row(graph_version) for graph_version in self.pager.fetch_next_page()]
+        if len(rows) > 0:
+            self.beginInsertRows(QModelIndex(), len(self._array_data), len(self._array_data) + len(rows) - 1)
+            self._array_data.extend(rows)
+            self._display_data.extend([self.to_display_row(row) for row in rows])
+            self.endInsertRows()
+
+    def to_display_row(self, row):
+        return [row['id'], row['version'], row['type'], row['state'],
+                row['validFrom'].strftime(self.date_format) if row['validFrom'] is not None else '',
+                row['validTo'].strftime(self.date_format) if row['validTo'] is not None else '']
+
+    def state(self, row):
+        return self._array_data[row]['state']
 
     def rowCount(self, parent=None, *args):
         return len(self._array_data)
@@ -67,22 +119,15 @@ class TableGraphVersionModel(QAbstractTableModel):
         if not index.isValid():
             return ""
         elif role == Qt.DisplayRole or role == Qt.EditRole:
-            if index.column() == 0:
-                return self._array_data[index.row()]['id']
-            elif index.column() == 1:
-                return self._array_data[index.row()]['version']
-            elif index.column() == 2:
-                return self._array_data[index.row()]['type']
-            elif index.column() == 3:
-                return self._array_data[index.row()]['state']
-            elif index.column() == 4:
-                d = self._array_data[index.row()]['validFrom']
-                return d.strftime(self.date_format) if d is not None else ''
-            elif index.column() == 5:
-                d = self._array_data[index.row()]['validTo']
-                return d.strftime(self.date_format) if d is not None else ''
+            return self._display_data[index.row()][index.column()]
+        elif role == self.SortRole:
+            value = self._array_data[index.row()][self.columns[index.column()]]
+            if isinstance(value, datetime):
+                return value.timestamp()
+            return value if value is not None else ''
         elif role == Qt.FontRole:
-            if self.default_graph_version_index >= 0 and index.row() == self.default_graph_version_index:
+            if self.default_graph_version is not None and \
+                    self._array_data[index.row()]['version'] == self.default_graph_version:
                 font = QFont()
                 font.setBold(True)
                 return font
@@ -107,6 +152,7 @@ class TableGraphVersionModel(QAbstractTableModel):
                     return False
                 if self._array_data[index.row()]['validFrom'] != new_datetime:
                     self._array_data[index.row()]['validFrom'] = new_datetime
+                    self._display_data[index.row()][4] = new_datetime.strftime(self.date_format)
                     self.update_graph_version_validity(graph_version, 'validFrom', value)
             if index.column() == 5:
                 try:
@@ -115,6 +161,7 @@ class TableGraphVersionModel(QAbstractTableModel):
                     return False
                 if self._array_data[index.row()]['validTo'] != new_datetime:
                     self._array_data[index.row()]['validTo'] = new_datetime
+                    self._display_data[index.row()][5] = new_datetime.strftime(self.date_format)
                     self.update_graph_version_validity(graph_version, 'validTo', value)
         return True
 
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ QGIS plugin 'Graphium'
+/***************************************************************************
+ *
+ * Copyright 2020 Simon Gröchenig @ Salzburg Research
+ * eMail     graphium@salzburgresearch.at
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ *
+ ***************************************************************************/
+"""
+
+from PyQt5.QtCore import QSortFilterProxyModel
+from .table_graph_version import TableGraphVersionModel
+
+
+class TableGraphVersionFilterModel(QSortFilterProxyModel):
+    """ Filters graph versions by state and sorts them by raw values of the TableGraphVersionModel """
+
+    def __init__(self, parent=None):
+        super(TableGraphVersionFilterModel, self).__init__(parent)
+        self.excluded_states = set()
+        self.setSortRole(TableGraphVersionModel.SortRole)
+
+    def set_excluded_states(self, excluded_states):
+        """
+        Hides all graph versions with one of the given states
+        :param excluded_states: set of graph version states
+        """
+        if self.excluded_states != excluded_states:
+            self.excluded_states = set(excluded_states)
+            self.invalidateFilter()
+
+    def filterAcceptsRow(self, source_row, source_parent):
+        return self.sourceModel().state(source_row) not in self.excluded_states
@@ -44,6 +44,10 @@ class GraphiumGraphDataApi(GraphiumApi):
         super(GraphiumGraphDataApi, self).__init__(feedback)
 
     def get_segment(self, graph_name, graph_version, segment_id, is_hd_segments=False):
+        """
+        Requests one or more segments
+        :param segment_id: ID or comma separated list of IDs
+        """
         if self.connection is None:
             return []
 
@@ -62,3 +66,17 @@ class GraphiumGraphDataApi(GraphiumApi):
         url = self.connection.get_connection_url() + '/' + ('hdwaysegments' if is_hd_segments else 'segments') +\
               '/graphs/' + graph_name + '/versions/' + graph_version
         return self.process_get_call(url, None)
+
+    def export_graph_streamed(self, graph_name, graph_version, chunk_function, is_hd_segments=False,
+                              validators=None):
+        """
+        Exports a graph version without parsing the response. The raw response is passed in chunks to chunk_function.
+        :param validators: optional dict with 'etag' and 'last_modified' of an earlier export; if the graph version
+                           has not been modified, the response contains 'not_modified' and no chunk is passed
+        """
+        if self.connection is None:
+            return {"error": {"msg": "No connection selected"}}
+
+        url = self.connection.get_connection_url() + '/' + ('hdwaysegments' if is_hd_segments else 'segments') +\
+              '/graphs/' + graph_name + '/versions/' + graph_version
+        return self.process_get_call_streamed(url, None, chunk_function, validators=validators)
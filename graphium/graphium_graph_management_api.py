@@ -23,16 +23,14 @@
  ***************************************************************************/
 """
 
-import urllib.request
-import urllib.error
-import urllib.parse
-import requests
-import os.path
-import json
+import os
 # PyQt
 from qgis.PyQt.QtCore import (QUrlQuery)
+# qgis
+from qgis.core import (QgsApplication)
 # Graphium
 from .graphium_api import (GraphiumApi)
+from .utilities.resumable_upload import (ResumableUpload)
 
 
 class GraphiumGraphManagementApi(GraphiumApi):
@@ -46,6 +44,9 @@ class GraphiumGraphManagementApi(GraphiumApi):
      - https://doc.qt.io/qt-5/qnetworkreply.html#NetworkError-enum
     """
 
+    # paging support of graph version requests by connection URL (None if unknown)
+    paging_support = dict()
+
     def __init__(self, feedback=None):
         super(GraphiumGraphManagementApi, self).__init__(feedback)
 
@@ -55,7 +56,7 @@ class GraphiumGraphManagementApi(GraphiumApi):
 
         url = self.connection.get_connection_url() + '/metadata/graphs'
 
-        response = self.process_get_call(url, None)
+        response = self.process_get_call(url, None, use_cache=True)
 
         if return_function is not None:
             return_function([] if response == '' else response)
@@ -67,76 +68,137 @@ class GraphiumGraphManagementApi(GraphiumApi):
             return []
 
         url = self.connection.get_connection_url() + '/metadata/graphs/' + graph_name + '/versions'
-        versions = self.process_get_call(url, None)
-
-        if state_filter is not None:
-            versions_filtered = []
-            for version in versions:
-                if version.get('state') == state_filter:
-                    versions_filtered.append(version)
-            versions = versions_filtered
+        versions = self.filter_graph_versions(self.process_get_call(url, None, use_cache=True), state_filter)
 
         if return_function is not None:
             return_function(versions)
         else:
             return versions
 
-    def get_graph_version_metadata(self, graph_name, graph_version):
+    def get_graph_versions_paged(self, graph_name, offset=0, limit=100, state_filter=None):
+        """
+        Requests one page of graph versions. Paging parameters and state filter are sent to the server. Whether a
+        server supports paging is probed once per connection URL; for servers without paging (or as long as paging
+        support is unknown) the page is taken from the (cached) list of all graph versions.
+        :return: tuple (list of graph versions or error dict, True if there are further graph versions)
+        """
         if self.connection is None:
-            return []
+            return [], False
+
+        paging_support = self.paging_support.get(self.connection.get_connection_url())
+        if paging_support is None:
+            paging_support = self.probe_paging_support(graph_name)
+            if isinstance(paging_support, dict):
+                return paging_support, False
+
+        if paging_support:
+            # request one more graph version to know whether there are further graph versions
+            versions = self.request_graph_versions_page(graph_name, offset, limit + 1, state_filter)
+            if 'error' in versions:
+                return versions, False
+            return self.filter_graph_versions(versions[:limit], state_filter), len(versions) > limit
+
+        versions = self.get_graph_versions(graph_name)
+        if 'error' in versions:
+            return versions, False
+        versions = self.filter_graph_versions(versions, state_filter)
+        return versions[offset:offset + limit], len(versions) > offset + limit
+
+    def probe_paging_support(self, graph_name):
+        """
+        Probes whether the server applies the limit of graph version requests. The probe is only conclusive for graphs
+        with at least two graph versions: a page of two versions is requested first, then a page of one version. Only
+        a conclusive result is remembered for the connection URL.
+        :return: True / False if paging is (not) supported, None if unknown, or error dict
+        """
+        versions = self.request_graph_versions_page(graph_name, 0, 2)
+        if 'error' in versions:
+            return versions
+        if len(versions) < 2:
+            return None
 
-        url = self.connection.get_connection_url() + '/metadata/graphs/' + graph_name + '/versions/' + graph_version
-        return self.process_get_call(url, None)
+        if len(versions) > 2:
+            # a server without paging responds with all graph versions
+            paging_support = False
+        else:
+            versions = self.request_graph_versions_page(graph_name, 0, 1)
+            if 'error' in versions:
+                return versions
+            paging_support = len(versions) == 1
 
-    def add_graph_version_new(self, new_graph_file, graph_name, graph_version, is_hd_segments, override_if_exists):
-        if self.connection is None:
-            return {"error": {"msg": "No connection selected"}}
+        self.paging_support[self.connection.get_connection_url()] = paging_support
+        return paging_support
 
-        url = self.connection.get_connection_url() + '/' + ('hdwaysegments' if is_hd_segments else 'segments') + \
-            '/graphs/' + graph_name + '/versions/' + graph_version
+    def request_graph_versions_page(self, graph_name, offset, limit, state_filter=None):
+        url = self.connection.get_connection_url() + '/metadata/graphs/' + graph_name + '/versions'
 
         url_query_items = QUrlQuery()
-        url_query_items.addQueryItem('overrideIfExists', str(override_if_exists))
+        url_query_items.addQueryItem('offset', str(offset))
+        url_query_items.addQueryItem('limit', str(limit))
+        if state_filter is not None:
+            url_query_items.addQueryItem('state', state_filter)
 
-        return self.process_post_call(url, url_query_items, new_graph_file, False)
+        return self.process_get_call(url, url_query_items, use_cache=True)
 
-    def add_graph_version(self, new_graph_file, graph_name, graph_version, is_hd_segments, override_if_exists):
+    @staticmethod
+    def filter_graph_versions(versions, state_filter=None):
+        if state_filter is None or 'error' in versions:
+            return versions
+        return [version for version in versions if version.get('state') == state_filter]
+
+    def get_graph_version_metadata(self, graph_name, graph_version):
         if self.connection is None:
             return []
 
-        url = self.connection.get_connection_url() + '/' + ('hdwaysegments' if is_hd_segments else 'segments') + \
-            '/graphs/' + graph_name + '/versions/' + graph_version
-
-        self.report_info('POST ' + url)
+        url = self.connection.get_connection_url() + '/metadata/graphs/' + graph_name + '/versions/' + graph_version
+        return self.process_get_call(url, None, use_cache=True)
 
-        params = {"overrideIfExists": override_if_exists}
+    def add_graph_version(self, new_graph_file, graph_name, graph_version, is_hd_segments, override_if_exists):
+        """
+        Uploads a graph version file (streamed as multipart/form-data)
+        """
+        if self.connection is None:
+            return {"error": {"msg": "No connection selected"}}
 
-        try:
-            with open(new_graph_file, 'r') as f:
-                response = requests.post(url, data=params, files={'file': f})  # , headers=headers)
+        url = self.connection.get_connection_url() + '/' + ('hdwaysegments' if is_hd_segments else 'segments') + \
+            '/graphs/' + graph_name + '/versions/' + graph_version
 
-        except urllib.error.HTTPError as e:
-            print("HTTP error: %d" % e.code)
-            return None
-        except urllib.error.URLError as e:
-            print("Network error: %s" % e.reason.args[1])
-            return None
+        return self.process_post_multipart_call(url, None, new_graph_file,
+                                                form_fields={'overrideIfExists': override_if_exists},
+                                                is_read_only=False)
+
+    def add_graph_version_resumable(self, new_graph_file, graph_name, graph_version, is_hd_segments,
+                                    override_if_exists, chunk_size_mb=8, max_retries=5):
+        """
+        Uploads a graph version file in chunks which are retried on failures. The upload session is stored in the
+        QGIS profile, therefore an interrupted upload is continued by the next call for the same file. Falls back to
+        add_graph_version if the server does not support resumable uploads.
+        """
+        if self.connection is None:
+            return {"error": {"msg": "No connection selected"}}
+        if self.connection.read_only:
+            return {"error": {"msg": "Graphium connection is set to read-only!"}}
 
-        if response.status_code == 404:
-            return {"error": {"msg": "404 ContentNotFoundError"}}
-        elif response.status_code == 500:
-            response_json = response.json()
-            return {"error": {"msg": '500 ' + response_json['exception'] + ' - ' + response_json['message']}}
-        elif response.status_code != 200:
-            response_json = response.json()
-            return {"error": {"msg": str(response.status_code) + ' ' + response_json['exception'] + ' - ' +
-                                     response_json['message']}}
-        else:
-            try:
-                return response.json()
-            except json.JSONDecodeError as e:
-                self.report_error("JSON Decode Error from position " + str(e.pos), True)
-                return {"error": {"msg": "JSON Decode Error from position " + str(e.pos)}}
+        url_query_items = QUrlQuery()
+        url_query_items.addQueryItem('overrideIfExists', str(override_if_exists))
+        url = self.connection.get_connection_url() + '/' + ('hdwaysegments' if is_hd_segments else 'segments') + \
+            '/graphs/' + graph_name + '/versions/' + graph_version + '?' + url_query_items.toString()
+
+        upload = ResumableUpload(self.process_raw_call, self.resumable_upload_directory(), self.feedback,
+                                 chunk_size_mb * 1024 * 1024, max_retries)
+        response = upload.upload(url, new_graph_file)
+        if response is None:
+            self.report_info('Server does not support resumable uploads, upload the whole file')
+            return self.add_graph_version(new_graph_file, graph_name, graph_version, is_hd_segments,
+                                          override_if_exists)
+        return response
+
+    @staticmethod
+    def resumable_upload_directory():
+        """
+        :return: directory in the QGIS profile which keeps the state of interrupted uploads
+        """
+        return os.path.join(QgsApplication.qgisSettingsDirPath(), 'graphium', 'uploads')
 
     def remove_graph_version(self, graph_name, graph_version, is_hd_segments=False, keep_metadata=True):
         if self.connection is None:
@@ -32,10 +32,20 @@ from qgis.core import (QgsProcessingProvider)
 from ..graphium.utilities.algorithm.mapmatcher_algorithm import (MapMatcherAlgorithm)
 from ..graphium.utilities.algorithm.track_gpx2json_algorithm import (TrackGpx2JsonAlgorithm)
 from ..graphium.utilities.algorithm.routing_algorithm import (RoutingAlgorithm)
+from ..graphium.utilities.algorithm.local_routing_algorithm import (LocalRoutingAlgorithm)
+from ..graphium.utilities.algorithm.build_contraction_hierarchy_algorithm import (
+    BuildContractionHierarchyAlgorithm)
+from ..graphium.utilities.algorithm.travel_matrix_algorithm import (TravelMatrixAlgorithm)
+from ..graphium.utilities.algorithm.isochrone_algorithm import (IsochroneAlgorithm)
+from ..graphium.utilities.algorithm.local_mapmatcher_algorithm import (LocalMapMatcherAlgorithm)
 from ..graphium.utilities.algorithm.points_to_trajectory_algorithm import (PointsToTrajectoryAlgorithm)
 from ..graphium.utilities.algorithm.trajectory_to_points_algorithm import (TrajectoryToPointsAlgorithm)
 from ..graphium.graph_data.algorithm.add_segment_geometry_algorithm import (AddSegmentGeometryAlgorithm)
 from ..graphium.graph_data.algorithm.download_graph_version_algorithm import (DownloadGraphVersionAlgorithm)
+from ..graphium.graph_data.algorithm.load_graph_file_algorithm import (LoadGraphFileAlgorithm)
+from ..graphium.graph_data.algorithm.snap_to_segments_algorithm import (SnapToSegmentsAlgorithm)
+from ..graphium.graph_data.algorithm.build_graph_topology_algorithm import (BuildGraphTopologyAlgorithm)
+from ..graphium.graph_data.algorithm.connectivity_analysis_algorithm import (ConnectivityAnalysisAlgorithm)
 from ..graphium.graph_data.algorithm.update_segment_attribute_algorithm import (UpdateSegmentAttributeAlgorithm)
 from ..graphium.graph_data.algorithm.update_segment_geometry_algorithm import (UpdateSegmentGeometryAlgorithm)
 from ..graphium.graph_management.algorithm.update_graph_version_attribute_algorithm import\
@@ -43,11 +53,13 @@ from ..graphium.graph_management.algorithm.update_graph_version_attribute_algori
 from ..graphium.graph_management.algorithm.update_graph_version_validity_algorithm import (
     UpdateGraphVersionValidityAlgorithm)
 from ..graphium.graph_management.algorithm.add_graph_version_algorithm import (AddGraphVersionAlgorithm)
+from ..graphium.graph_management.algorithm.validate_graph_file_algorithm import (ValidateGraphFileAlgorithm)
 from ..graphium.graph_management.algorithm.activate_graph_version_algorithm import (ActivateGraphVersionAlgorithm)
 from ..graphium.graph_management.algorithm.remove_graph_version_algorithm import (RemoveGraphVersionAlgorithm)
 from ..graphium.graph_management.algorithm.set_default_graph_version_algorithm import (SetDefaultGraphVersionAlgorithm)
 from ..graphium.graph_management.algorithm.gip2graphium_algorithm import (Gip2GraphiumAlgorithm)
 from ..graphium.graph_management.algorithm.osm2graphium_algorithm import (Osm2GraphiumAlgorithm)
+from ..graphium.graph_management.algorithm.batch_convert_algorithm import (BatchConvertAlgorithm)
 
 
 class GraphiumProcessingProvider(QgsProcessingProvider):
@@ -118,17 +130,28 @@ class GraphiumProcessingProvider(QgsProcessingProvider):
         self.addAlgorithm(MapMatcherAlgorithm())
         self.addAlgorithm(TrackGpx2JsonAlgorithm())
         self.addAlgorithm(RoutingAlgorithm())
+        self.addAlgorithm(LocalRoutingAlgorithm())
+        self.addAlgorithm(BuildContractionHierarchyAlgorithm())
+        self.addAlgorithm(TravelMatrixAlgorithm())
+        self.addAlgorithm(IsochroneAlgorithm())
+        self.addAlgorithm(LocalMapMatcherAlgorithm())
         self.addAlgorithm(PointsToTrajectoryAlgorithm())
         self.addAlgorithm(TrajectoryToPointsAlgorithm())
         self.addAlgorithm(AddSegmentGeometryAlgorithm())
         self.addAlgorithm(UpdateSegmentGeometryAlgorithm())
         self.addAlgorithm(DownloadGraphVersionAlgorithm())
+        self.addAlgorithm(LoadGraphFileAlgorithm())
+        self.addAlgorithm(SnapToSegmentsAlgorithm())
+        self.addAlgorithm(BuildGraphTopologyAlgorithm())
+        self.addAlgorithm(ConnectivityAnalysisAlgorithm())
         self.addAlgorithm(UpdateGraphVersionAttributeAlgorithm())
         self.addAlgorithm(AddGraphVersionAlgorithm())
+        self.addAlgorithm(ValidateGraphFileAlgorithm())
         self.addAlgorithm(ActivateGraphVersionAlgorithm())
         self.addAlgorithm(RemoveGraphVersionAlgorithm())
         self.addAlgorithm(SetDefaultGraphVersionAlgorithm())
         self.addAlgorithm(Gip2GraphiumAlgorithm())
         self.addAlgorithm(Osm2GraphiumAlgorithm())
+        self.addAlgorithm(BatchConvertAlgorithm())
         self.addAlgorithm(UpdateSegmentAttributeAlgorithm())
         self.addAlgorithm(UpdateGraphVersionValidityAlgorithm())
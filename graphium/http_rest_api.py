@@ -26,13 +26,17 @@
 import urllib.request
 import urllib.error
 import urllib.parse
+import copy
 import json
 import requests
 import base64
+import threading
+import os.path
+from collections import OrderedDict
 from requests import Timeout
 # PyQt imports
-from qgis.PyQt.QtCore import (QUrl, QEventLoop)
-from qgis.PyQt.QtNetwork import (QNetworkRequest, QNetworkReply)
+from qgis.PyQt.QtCore import (QUrl, QEventLoop, QFile, QIODevice, QTimer)
+from qgis.PyQt.QtNetwork import (QNetworkRequest, QNetworkReply, QHttpMultiPart, QHttpPart)
 from qgis.PyQt.QtCore import (QJsonDocument)
 # qgis imports
 from qgis.core import (QgsApplication, QgsNetworkAccessManager, QgsAuthMethodConfig)
@@ -51,6 +55,15 @@ class HttpRestApi:
      - https://doc.qt.io/qt-5/qnetworkreply.html#NetworkError-enum
     """
 
+    # Responses with validators (ETag / Last-Modified), shared by all instances; key: (auth_cfg, url)
+    response_cache = OrderedDict()
+    response_cache_size = 0
+    response_cache_lock = threading.Lock()
+
+    # GET requests in flight, shared by all instances; key: (auth_cfg, url)
+    pending_requests = dict()
+    pending_requests_lock = threading.Lock()
+
     def __init__(self, feedback=None):
         self.network_access_manager = QgsNetworkAccessManager.instance()
         self.network_access_manager.downloadProgress.connect(self.download_progress)
@@ -62,13 +75,15 @@ class HttpRestApi:
 
         self.network_access_manager.setTimeout(self.settings.get_timeout_sec() * 1000)
 
-    def process_get_call(self, url, url_query_items, timeout=None, report_url=True):
+    def process_get_call(self, url, url_query_items, timeout=None, report_url=True, use_cache=False):
         """
         Run a GET request and return reply data
         :param url: url for request
         :param url_query_items:
         :param timeout: in ms
         :param report_url: True if URL should be reported to feedback
+        :param use_cache: True if the response should be validated with ETag / Last-Modified and served from the
+                          response cache if it has not been modified
         :return: response or error message in json format
         """
 
@@ -79,14 +94,209 @@ class HttpRestApi:
         if url_query_items:
             url_query.setQuery(url_query_items)
 
+        # identical requests running concurrently in other threads share one network call and its result
+        request_key = (self.connection.auth_cfg, url_query.toString(QUrl.FullyEncoded))
+        is_owner = False
+        with HttpRestApi.pending_requests_lock:
+            pending_request = HttpRestApi.pending_requests.get(request_key)
+            if pending_request is None:
+                pending_request = {'thread': threading.get_ident(), 'finished': threading.Event(), 'response': None,
+                                   'waiters': 0}
+                HttpRestApi.pending_requests[request_key] = pending_request
+                is_owner = True
+            elif pending_request['thread'] == threading.get_ident():
+                # nested request of the same thread (e.g. from an event loop), do not wait for itself
+                pending_request = None
+            else:
+                pending_request['waiters'] += 1
+
+        if pending_request is not None and not is_owner:
+            if pending_request['finished'].wait(self.settings.get_timeout_sec()) \
+                    and pending_request['response'] is not None:
+                # every waiter gets its own copy, responses are modified by some callers
+                return copy.deepcopy(pending_request['response'])
+
+        response = None
+        try:
+            response = self.process_blocking_get_call(url_query, timeout, use_cache)
+        finally:
+            if is_owner:
+                with HttpRestApi.pending_requests_lock:
+                    HttpRestApi.pending_requests.pop(request_key, None)
+                    has_waiters = pending_request['waiters'] > 0
+                if has_waiters:
+                    # snapshot before the owner returns, so its own modifications cannot reach the waiters
+                    pending_request['response'] = copy.deepcopy(response)
+                pending_request['finished'].set()
+        return response
+
+    def process_blocking_get_call(self, url_query, timeout=None, use_cache=False):
+        """
+        Run a GET request with a blocking call and return reply data
+        :param url_query: url including query
+        :param timeout: in ms
+        :param use_cache: True if the response should be validated with ETag / Last-Modified
+        :return: response or error message in json format
+        """
+
         request = QNetworkRequest(url_query)
         if self.connection.auth_cfg != '':
             request.setRawHeader("Accept".encode("utf-8"), "*/*".encode("utf-8"))
         if timeout is not None and "setTransferTimeout" in dir(request):
             request.setTransferTimeout(timeout)
 
+        cache_key = None
+        cache_entry = None
+        if use_cache:
+            cache_key = (self.connection.auth_cfg, url_query.toString(QUrl.FullyEncoded))
+            cache_entry = self.get_cached_response(cache_key)
+            if cache_entry is not None:
+                if cache_entry['etag']:
+                    request.setRawHeader("If-None-Match".encode("utf-8"), cache_entry['etag'])
+                if cache_entry['last_modified']:
+                    request.setRawHeader("If-Modified-Since".encode("utf-8"), cache_entry['last_modified'])
+
         reply = self.network_access_manager.blockingGet(request, self.connection.auth_cfg, True, self.feedback)
-        return self.process_qgs_reply(reply)
+
+        if cache_entry is not None and reply.attribute(QNetworkRequest.HttpStatusCodeAttribute) == 304:
+            # callers get their own copy, the cached response is never handed out
+            return copy.deepcopy(cache_entry['response'])
+
+        response = self.process_qgs_reply(reply)
+        if use_cache:
+            self.cache_response(cache_key, reply, response)
+        return response
+
+    def get_cached_response(self, cache_key):
+        with HttpRestApi.response_cache_lock:
+            cache_entry = HttpRestApi.response_cache.get(cache_key)
+            if cache_entry is not None:
+                HttpRestApi.response_cache.move_to_end(cache_key)
+            return cache_entry
+
+    def cache_response(self, cache_key, reply, response):
+        """
+        Stores a successful response together with its validators (ETag / Last-Modified)
+        """
+        if isinstance(response, dict) and 'error' in response:
+            return
+
+        etag = reply.rawHeader("ETag".encode("utf-8")).data() \
+            if reply.hasRawHeader("ETag".encode("utf-8")) else None
+        last_modified = reply.rawHeader("Last-Modified".encode("utf-8")).data() \
+            if reply.hasRawHeader("Last-Modified".encode("utf-8")) else None
+        if not etag and not last_modified:
+            return
+
+        size = len(reply.content())
+        max_size = self.settings.get_response_cache_size_mb() * 1024 * 1024
+        with HttpRestApi.response_cache_lock:
+            previous_entry = HttpRestApi.response_cache.pop(cache_key, None)
+            if previous_entry is not None:
+                HttpRestApi.response_cache_size -= previous_entry['size']
+            if size > max_size:
+                return
+            HttpRestApi.response_cache[cache_key] = {'etag': etag, 'last_modified': last_modified,
+                                                     'response': copy.deepcopy(response), 'size': size}
+            HttpRestApi.response_cache_size += size
+            while HttpRestApi.response_cache_size > max_size:
+                oldest_key, oldest_entry = HttpRestApi.response_cache.popitem(last=False)
+                HttpRestApi.response_cache_size -= oldest_entry['size']
+
+    @staticmethod
+    def clear_response_cache():
+        with HttpRestApi.response_cache_lock:
+            HttpRestApi.response_cache.clear()
+            HttpRestApi.response_cache_size = 0
+
+    def process_get_call_streamed(self, url, url_query_items, chunk_function, report_url=True, validators=None):
+        """
+        Run a GET request and pass the raw reply data in chunks to chunk_function (the reply will not be parsed)
+        :param url: url for request
+        :param url_query_items:
+        :param chunk_function: function called with each received chunk of bytes
+        :param report_url: True if URL should be reported to feedback
+        :param validators: optional dict with 'etag' and 'last_modified' of an earlier response (e.g. of a file saved
+                           from it); sent as If-None-Match / If-Modified-Since
+        :return: dict with number of received 'bytes', 'not_modified' (True if the server replied 304 to the
+                 validators; chunk_function has not been called) and the validators 'etag' and 'last_modified' of
+                 the response, or error message in json format
+        """
+
+        url_query = QUrl(url)
+        if report_url:
+            self.report_info('GET ' + url_query.toString())
+
+        if url_query_items:
+            url_query.setQuery(url_query_items)
+
+        request = QNetworkRequest(url_query)
+        if self.connection.auth_cfg != '':
+            request.setRawHeader("Accept".encode("utf-8"), "*/*".encode("utf-8"))
+            QgsApplication.authManager().updateNetworkRequest(request, self.connection.auth_cfg)
+        if validators is not None:
+            if validators.get('etag'):
+                request.setRawHeader("If-None-Match".encode("utf-8"), validators['etag'].encode("utf-8"))
+            if validators.get('last_modified'):
+                request.setRawHeader("If-Modified-Since".encode("utf-8"),
+                                     validators['last_modified'].encode("utf-8"))
+
+        stream_state = {'bytes': 0, 'exception': None}
+        loop = QEventLoop()
+        reply = self.network_access_manager.get(request)
+
+        def read_chunk():
+            status_code = reply.attribute(QNetworkRequest.HttpStatusCodeAttribute)
+            if status_code is not None and status_code >= 300:
+                # error replies are processed after the request has finished
+                return
+            if self.feedback is not None and self.feedback.isCanceled():
+                reply.abort()
+                return
+            data = reply.readAll().data()
+            if len(data) == 0 or stream_state['exception'] is not None:
+                return
+            stream_state['bytes'] += len(data)
+            try:
+                chunk_function(data)
+            except Exception as e:
+                stream_state['exception'] = e
+                reply.abort()
+
+        reply.readyRead.connect(read_chunk)
+        reply.finished.connect(loop.quit)
+        if self.feedback is not None:
+            self.feedback.canceled.connect(reply.abort)
+        loop.exec_()
+        if self.feedback is not None:
+            self.feedback.canceled.disconnect(reply.abort)
+
+        if stream_state['exception'] is not None:
+            reply.deleteLater()
+            raise stream_state['exception']
+
+        if reply.error() == QNetworkReply.NoError:
+            read_chunk()
+            if stream_state['exception'] is not None:
+                reply.deleteLater()
+                raise stream_state['exception']
+            response = {"bytes": stream_state['bytes'],
+                        "not_modified": reply.attribute(QNetworkRequest.HttpStatusCodeAttribute) == 304,
+                        "etag": self.raw_header(reply, "ETag"),
+                        "last_modified": self.raw_header(reply, "Last-Modified")}
+            reply.deleteLater()
+            return response
+        else:
+            return self.process_q_reply(reply)
+
+    @staticmethod
+    def raw_header(reply, name):
+        """
+        :return: value of a reply header as string or None if the reply does not contain the header
+        """
+        if not reply.hasRawHeader(name.encode("utf-8")):
+            return None
+        return bytes(reply.rawHeader(name.encode("utf-8"))).decode("utf-8")
 
     def process_post_call(self, url, url_query_items, data, is_read_only=True, report_url=True):
         """
@@ -121,6 +331,121 @@ class HttpRestApi:
                                                          True, self.feedback)
         return self.process_qgs_reply(reply)
 
+    def process_post_multipart_call(self, url, url_query_items, file_path, file_field='file', form_fields=None,
+                                    is_read_only=True, report_url=True):
+        """
+        Run a multipart/form-data POST request which streams a file from disk and return reply data
+        :param url: url for request
+        :param url_query_items:
+        :param file_path: path of the file to upload
+        :param file_field: name of the form field containing the file
+        :param form_fields: dict of further form fields
+        :param is_read_only: True if the request does not update data
+        :param report_url: True if URL should be reported to feedback
+        :return: response or error message in json format
+        """
+
+        if self.connection.read_only and not is_read_only:
+            return {"error": {"msg": "Graphium connection is set to read-only!"}}
+
+        url_query = QUrl(url)
+        if report_url:
+            self.report_info('POST ' + url_query.toString())
+
+        if url_query_items:
+            url_query.setQuery(url_query_items)
+
+        multi_part = QHttpMultiPart(QHttpMultiPart.FormDataType)
+        for name, value in (form_fields or {}).items():
+            form_part = QHttpPart()
+            form_part.setHeader(QNetworkRequest.ContentDispositionHeader, 'form-data; name="' + name + '"')
+            form_part.setBody(str(value).encode('utf-8'))
+            multi_part.append(form_part)
+
+        # the file is read in chunks while sending
+        file = QFile(file_path)
+        if not file.open(QIODevice.ReadOnly):
+            return {"error": {"msg": "Cannot open file " + file_path}}
+        file_part = QHttpPart()
+        file_part.setHeader(QNetworkRequest.ContentTypeHeader, 'application/octet-stream')
+        file_part.setHeader(QNetworkRequest.ContentDispositionHeader, 'form-data; name="' + file_field +
+                            '"; filename="' + os.path.basename(file_path) + '"')
+        file_part.setBodyDevice(file)
+        file.setParent(multi_part)
+        multi_part.append(file_part)
+
+        request = QNetworkRequest(url_query)
+        if self.connection.auth_cfg != '':
+            request.setRawHeader("Accept".encode("utf-8"), "*/*".encode("utf-8"))
+            QgsApplication.authManager().updateNetworkRequest(request, self.connection.auth_cfg)
+
+        loop = QEventLoop()
+        reply = self.network_access_manager.post(request, multi_part)
+        multi_part.setParent(reply)
+        reply.uploadProgress.connect(self.upload_progress)
+        reply.finished.connect(loop.quit)
+        if self.feedback is not None:
+            self.feedback.canceled.connect(reply.abort)
+        loop.exec_()
+        if self.feedback is not None:
+            self.feedback.canceled.disconnect(reply.abort)
+
+        if self.feedback is not None and self.feedback.isCanceled():
+            reply.deleteLater()
+            return {"error": {"msg": "Upload canceled"}}
+
+        return self.process_q_reply(reply)
+
+    def process_raw_call(self, method, url, data=None, headers=None, report_url=False):
+        """
+        Run a request with a raw body and return status code, headers and content without processing the reply.
+        Redirects are not followed (e.g. for 308 replies of resumable uploads).
+        :param method: HTTP method
+        :param url: url for request including query items
+        :param data: body as bytes
+        :param headers: dict of request headers
+        :param report_url: True if URL should be reported to feedback
+        :return: dict with 'status' (None if no HTTP response has been received), 'headers' (lower case names),
+                 'content' (bytes) and 'error' (message of network errors)
+        """
+
+        url_query = QUrl(url)
+        if report_url:
+            self.report_info(method + ' ' + url_query.toString())
+
+        request = QNetworkRequest(url_query)
+        request.setAttribute(QNetworkRequest.FollowRedirectsAttribute, False)
+        for name, value in (headers or {}).items():
+            request.setRawHeader(name.encode('utf-8'), str(value).encode('utf-8'))
+        if self.connection.auth_cfg != '':
+            request.setRawHeader("Accept".encode("utf-8"), "*/*".encode("utf-8"))
+            QgsApplication.authManager().updateNetworkRequest(request, self.connection.auth_cfg)
+
+        loop = QEventLoop()
+        reply = self.network_access_manager.sendCustomRequest(request, method.encode('utf-8'), data or b'')
+        timer = QTimer()
+        timer.setSingleShot(True)
+        timer.timeout.connect(reply.abort)
+        timer.start(self.settings.get_timeout_sec() * 1000)
+        reply.finished.connect(loop.quit)
+        if self.feedback is not None:
+            self.feedback.canceled.connect(reply.abort)
+        loop.exec_()
+        timer.stop()
+        if self.feedback is not None:
+            self.feedback.canceled.disconnect(reply.abort)
+
+        status = reply.attribute(QNetworkRequest.HttpStatusCodeAttribute)
+        response = {
+            'status': status,
+            'headers': {bytes(name).decode('utf-8').lower(): bytes(value).decode('utf-8')
+                        for name, value in reply.rawHeaderPairs()},
+            'content': reply.readAll().data(),
+            'error': reply.errorString() if status is None else None
+        }
+        reply.deleteLater()
+        return response
+
     def process_put_call_using_requests(self, url, data=None, report_url=True):
         """
         Deprecated
@@ -304,6 +629,10 @@ class HttpRestApi:
         if self.feedback:
             self.feedback.setProgress(int(sent * total))
 
+    def upload_progress(self, sent, total):
+        if self.feedback and total > 0:
+            self.feedback.setProgress(100 * sent / total)
+
     def download_progress(self, request_id, received, total):
         if self.feedback and total != -1:
             self.feedback.setProgress(int(received * total))
@@ -121,6 +121,17 @@ class Settings:
             timeout_sec = int(QSettings().value(self.plugin_id + '/timeout_sec'))
         return timeout_sec
 
+    def set_response_cache_size_mb(self, response_cache_size_mb):
+        QSettings().setValue(self.plugin_id + '/response_cache_size_mb', response_cache_size_mb)
+
+    def get_response_cache_size_mb(self) -> int:
+        response_cache_size_mb = int(QSettings().value(self.plugin_id + '/response_cache_size_mb', -1))
+        if response_cache_size_mb == -1:
+            # set default value
+            self.set_response_cache_size_mb(256)
+            response_cache_size_mb = int(QSettings().value(self.plugin_id + '/response_cache_size_mb'))
+        return response_cache_size_mb
+
     # map-matcher
 
     def set_gpx_file_default_dir(self, gpx_file_default_dir):
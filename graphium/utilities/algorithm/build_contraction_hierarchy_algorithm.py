@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ QGIS plugin 'Graphium'
+/***************************************************************************
+ *
+ * Copyright 2020 Simon Gröchenig @ Salzburg Research
+ * eMail     graphium@salzburgresearch.at
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ *
+ ***************************************************************************/
+"""
+
+import os
+import time
+from concurrent.futures import (wait, FIRST_COMPLETED)
+# PyQt5 imports
+from PyQt5.QtGui import (QIcon)
+# qgis imports
+from qgis.PyQt.QtCore import (QCoreApplication, QSettings)
+from qgis.core import (QgsProcessingAlgorithm, QgsProcessingParameterFile, QgsProcessingParameterEnum,
+                       QgsProcessingOutputString)
+# plugin
+from .. import contraction_hierarchy
+from ..routing_engine import RoutingEngine
+from ..process_pool import ProcessPool
+from ...graph_data.graph_topology import (GraphTopology, GraphTopologyCache)
+
+
+class BuildContractionHierarchyAlgorithm(QgsProcessingAlgorithm):
+    """
+    This algorithm builds contraction hierarchies of a local graph file for fast routing queries.
+    """
+
+    plugin_path = os.path.split(os.path.split(os.path.split(os.path.dirname(__file__))[0])[0])[0]
+
+    SOURCE_FILE = 'SOURCE_FILE'
+    ROUTING_MODES = 'ROUTING_MODES'
+    ROUTING_CRITERIA = 'ROUTING_CRITERIA'
+    OUTPUT_DIRECTORY = 'OUTPUT_DIRECTORY'
+    OUTPUT_FILES = 'OUTPUT_FILES'
+
+    def __init__(self):
+        super().__init__()
+
+        self.alg_group = "Utilities"
+        self.alg_group_id = "graphutilities"
+        self.alg_name = "buildcontractionhierarchy"
+        self.alg_display_name = "Build contraction hierarchy (local routing)"
+
+        # car and bike profiles; pedestrians are routed without hierarchy
+        self.routing_mode_options = ['CAR', 'BIKE']
+        self.routing_criteria_options = list(RoutingEngine.CRITERIA)
+
+    def createInstance(self):
+        return BuildContractionHierarchyAlgorithm()
+
+    def group(self):
+        return self.tr(self.alg_group)
+
+    def groupId(self):
+        return self.alg_group_id
+
+    def name(self):
+        return self.alg_name
+
+    def displayName(self):
+        return self.tr(self.alg_display_name)
+
+    def shortHelpString(self):
+        return self.tr('This algorithm preprocesses a local graph version JSON file for fast repeated routing queries. '
+                       'A contraction hierarchy is built per routing mode (the profiles are based on the access '
+                       'attributes of the segments) and saved as file named by graph name, graph version, routing '
+                       'mode and criteria in the output directory. The profiles are built in parallel worker '
+                       'processes; the graph file is read once and its topology is saved next to the graph file (see '
+                       'algorithm Build graph topology file) for the worker processes.\n\n'
+                       'The algorithm Routing (local graph file) uses the hierarchies of its hierarchy directory. '
+                       'The files are memory-mapped, therefore they are not loaded into memory completely.\n\n'
+                       'Preprocessing of large graphs takes a long time, but has to be done only once per graph '
+                       'version.')
+
+    def icon(self):
+        return QIcon(os.path.join(self.plugin_path, 'icons/icon_routing.svg'))
+
+    def tr(self, string):
+        """
+        Returns a translatable string with the self.tr() function.
+        """
+        return QCoreApplication.translate('Processing', string)
+
+    def initAlgorithm(self, config=None):
+        """
+        Definition of inputs and outputs of the algorithm, along with some other properties.
+        """
+
+        self.addParameter(QgsProcessingParameterFile(self.SOURCE_FILE, self.tr('Input graph file'),
+                                                     QgsProcessingParameterFile.Behavior.File, optional=False))
+        self.addParameter(QgsProcessingParameterEnum(self.ROUTING_MODES, self.tr('Routing modes'),
+                                                     self.routing_mode_options, True, [0, 1], False))
+        self.addParameter(QgsProcessingParameterEnum(self.ROUTING_CRITERIA, self.tr('Routing criteria'),
+                                                     self.routing_criteria_options, False, 1, False))
+        output_dir = QSettings().value('plugin-graphium/contraction_hierarchy_dir', '')
+        self.addParameter(QgsProcessingParameterFile(self.OUTPUT_DIRECTORY, self.tr('Output directory'),
+                                                     QgsProcessingParameterFile.Folder, defaultValue=output_dir,
+                                                     optional=False))
+
+        self.addOutput(QgsProcessingOutputString(self.OUTPUT_FILES, self.tr('Hierarchy files')))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        source_file = self.parameterAsFile(parameters, self.SOURCE_FILE, context)
+        routing_modes = [self.routing_mode_options[i] for i in
+                         self.parameterAsEnums(parameters, self.ROUTING_MODES, context)]
+        routing_criteria = self.routing_criteria_options[self.parameterAsInt(parameters, self.ROUTING_CRITERIA,
+                                                                             context)]
+        output_directory = self.parameterAsFile(parameters, self.OUTPUT_DIRECTORY, context)
+
+        if not os.path.isfile(source_file):
+            feedback.reportError('Cannot find input graph file!', True)
+            return {self.OUTPUT_FILES: None}
+        if not os.path.isdir(output_directory):
+            feedback.reportError('Cannot find output directory!', True)
+            return {self.OUTPUT_FILES: None}
+        if len(routing_modes) == 0:
+            feedback.reportError('No routing mode selected', True)
+            return {self.OUTPUT_FILES: None}
+
+        QSettings().setValue('plugin-graphium/contraction_hierarchy_dir', output_directory)
+
+        start_time = time.time()
+        feedback.pushInfo('Read topology of graph file...')
+        try:
+            topology = GraphTopologyCache.get(source_file, feedback)
+        except ValueError as e:
+            feedback.reportError('Cannot read graph file: ' + str(e), True)
+            return {self.OUTPUT_FILES: None}
+        if topology is None:
+            return {self.OUTPUT_FILES: None}
+        # the worker processes memory-map the saved topology instead of parsing the graph file again
+        if topology.mmap is None:
+            topology_file = GraphTopology.store_file(source_file)
+            try:
+                topology.save(topology_file, source_file)
+                feedback.pushInfo('Saved topology to ' + topology_file)
+            except OSError as e:
+                feedback.pushInfo('Cannot write topology file, every worker process reads the graph file: ' + str(e))
+
+        files = []
+        with ProcessPool(len(routing_modes)) as pool:
+            feedback.pushInfo('Build contraction hierarchies for ' + ', '.join(routing_modes) +
+                              (' in parallel worker processes' if pool.is_parallel() else ''))
+            futures = {pool.submit(contraction_hierarchy.build_file, source_file, mode, routing_criteria,
+                                   output_directory): mode for mode in routing_modes}
+            pending = set(futures.keys())
+            while pending:
+                if feedback.isCanceled():
+                    pool.shutdown(True)
+                    return {self.OUTPUT_FILES: None}
+                done, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        files.append(future.result())
+                    except (OSError, ValueError) as e:
+                        feedback.reportError('Cannot build contraction hierarchy for ' + futures[future] + ': ' +
+                                             str(e), True)
+                        continue
+                    feedback.pushInfo('Saved contraction hierarchy for ' + futures[future] + ' to ' + files[-1] +
+                                      ' after ' + str(round(time.time() - start_time)) + ' seconds')
+                feedback.setProgress(100 * (len(futures) - len(pending)) / len(futures))
+
+        return {self.OUTPUT_FILES: ';'.join(files)}
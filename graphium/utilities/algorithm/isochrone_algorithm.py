@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ QGIS plugin 'Graphium'
+/***************************************************************************
+ *
+ * Copyright 2020 Simon Gröchenig @ Salzburg Research
+ * eMail     graphium@salzburgresearch.at
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ *
+ ***************************************************************************/
+"""
+
+import os
+import math
+from concurrent.futures import (wait, FIRST_COMPLETED)
+# PyQt5 imports
+from PyQt5.QtCore import QVariant
+from PyQt5.QtGui import (QIcon)
+# qgis imports
+from qgis.PyQt.QtCore import QCoreApplication
+from qgis.core import (QgsProcessingAlgorithm, QgsProcessingParameterFile, QgsProcessingParameterEnum,
+                       QgsProcessingParameterFeatureSource, QgsProcessingParameterField, QgsProcessingParameterNumber,
+                       QgsProcessingParameterString, QgsProcessingParameterFeatureSink, QgsProcessing, QgsFeature,
+                       QgsFeatureSink, QgsFields, QgsField, QgsWkbTypes, QgsCoordinateReferenceSystem, QgsGeometry,
+                       QgsPointXY)
+# plugin
+from .. import service_area
+from .. import travel_matrix
+from ..geom_tools import GeomTools
+from ..routing_engine import RoutingEngine
+from ..process_pool import ProcessPool
+from ...graph_data.graph_topology import GraphTopologyCache
+
+
+class IsochroneAlgorithm(QgsProcessingAlgorithm):
+    """
+    This algorithm calculates the service areas (isochrones) of points on a local graph file.
+    """
+
+    plugin_path = os.path.split(os.path.split(os.path.split(os.path.dirname(__file__))[0])[0])[0]
+
+    SOURCE_FILE = 'SOURCE_FILE'
+    INPUT = 'INPUT'
+    ID_FIELD = 'ID_FIELD'
+    ROUTING_MODE = 'ROUTING_MODE'
+    ROUTING_CRITERIA = 'ROUTING_CRITERIA'
+    THRESHOLDS = 'THRESHOLDS'
+    CONCAVITY = 'CONCAVITY'
+    MAX_SNAP_DISTANCE = 'MAX_SNAP_DISTANCE'
+    WORKERS = 'WORKERS'
+    OUTPUT_SEGMENTS = 'OUTPUT_SEGMENTS'
+    OUTPUT_POLYGONS = 'OUTPUT_POLYGONS'
+
+    def __init__(self):
+        super().__init__()
+
+        self.alg_group = "Utilities"
+        self.alg_group_id = "graphutilities"
+        self.alg_name = "isochrone"
+        self.alg_display_name = "Isochrones / service areas (local graph file)"
+
+        self.routing_mode_options = list(RoutingEngine.MODES)
+        self.routing_criteria_options = list(RoutingEngine.CRITERIA)
+
+    def createInstance(self):
+        return IsochroneAlgorithm()
+
+    def group(self):
+        return self.tr(self.alg_group)
+
+    def groupId(self):
+        return self.alg_group_id
+
+    def name(self):
+        return self.alg_name
+
+    def displayName(self):
+        return self.tr(self.alg_display_name)
+
+    def shortHelpString(self):
+        return self.tr('This algorithm calculates the parts of the graph which are reachable from the input points '
+                       'within the given thresholds on a local graph version JSON file. Thresholds are minutes for '
+                       'the criteria MIN_DURATION and CURRENT_DURATION and meters for the criteria LENGTH.\n\n'
+                       'The reachable segments output contains the reachable (parts of) segments of the largest '
+                       'threshold with their costs; the polygons output contains one concave hull per input point '
+                       'and threshold (convex hull if concave hulls are not supported by the QGIS version). A '
+                       'concavity of 1 results in convex hulls.\n\n'
+                       'The input points are snapped to the nearest accessible segment and distributed to parallel '
+                       'worker processes.')
+
+    def icon(self):
+        return QIcon(os.path.join(self.plugin_path, 'icons/icon_routing.svg'))
+
+    def tr(self, string):
+        """
+        Returns a translatable string with the self.tr() function.
+        """
+        return QCoreApplication.translate('Processing', string)
+
+    def initAlgorithm(self, config=None):
+        """
+        Definition of inputs and outputs of the algorithm, along with some other properties.
+        """
+
+        self.addParameter(QgsProcessingParameterFile(self.SOURCE_FILE, self.tr('Input graph file'),
+                                                     QgsProcessingParameterFile.Behavior.File, optional=False))
+        self.addParameter(QgsProcessingParameterFeatureSource(self.INPUT, self.tr('Input points'),
+                                                              [QgsProcessing.TypeVectorPoint], None, False))
+        self.addParameter(QgsProcessingParameterField(self.ID_FIELD, self.tr('ID field (feature ID if not set)'),
+                                                      parentLayerParameterName=self.INPUT, optional=True))
+        self.addParameter(QgsProcessingParameterEnum(self.ROUTING_MODE,
+                                                     self.tr('Select routing mode'),
+                                                     options=self.routing_mode_options,
+                                                     allowMultiple=False, defaultValue=0, optional=False))
+        self.addParameter(QgsProcessingParameterEnum(self.ROUTING_CRITERIA,
+                                                     self.tr('Select routing criteria'),
+                                                     options=self.routing_criteria_options,
+                                                     allowMultiple=False, defaultValue=1, optional=False))
+        self.addParameter(QgsProcessingParameterString(self.THRESHOLDS,
+                                                       self.tr('Thresholds (comma separated minutes or meters)'),
+                                                       '5,10,15', False, False))
+        self.addParameter(QgsProcessingParameterNumber(self.CONCAVITY, self.tr('Concavity of polygons (0..1)'),
+                                                       QgsProcessingParameterNumber.Double, 0.3, True, 0, 1))
+        self.addParameter(QgsProcessingParameterNumber(self.MAX_SNAP_DISTANCE,
+                                                       self.tr('Maximum snapping distance [m]'),
+                                                       QgsProcessingParameterNumber.Double, 500, True, 0))
+        self.addParameter(QgsProcessingParameterNumber(self.WORKERS,
+                                                       self.tr('Number of worker processes (0 = automatic)'),
+                                                       QgsProcessingParameterNumber.Integer, 0, True, 0, 64))
+
+        self.addParameter(QgsProcessingParameterFeatureSink(self.OUTPUT_SEGMENTS, self.tr('Reachable segments'),
+                                                            QgsProcessing.TypeVectorLine, optional=True))
+        self.addParameter(QgsProcessingParameterFeatureSink(self.OUTPUT_POLYGONS, self.tr('Isochrone polygons'),
+                                                            QgsProcessing.TypeVectorPolygon))
+
+    def checkParameterValues(self, parameters, context):
+        ok, message = super(IsochroneAlgorithm, self).checkParameterValues(parameters, context)
+        if ok:
+            try:
+                thresholds = self.parse_thresholds(self.parameterAsString(parameters, self.THRESHOLDS, context))
+                if len(thresholds) == 0:
+                    ok, message = False, 'No threshold defined'
+            except ValueError:
+                ok, message = False, 'Cannot parse thresholds (comma separated numbers)'
+        return ok, message
+
+    @staticmethod
+    def parse_thresholds(thresholds):
+        return sorted(set([float(threshold) for threshold in thresholds.split(',') if threshold.strip() != '']))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        source_file = self.parameterAsFile(parameters, self.SOURCE_FILE, context)
+        source = self.parameterAsSource(parameters, self.INPUT, context)
+        id_field = self.parameterAsString(parameters, self.ID_FIELD, context)
+        routing_mode = self.routing_mode_options[self.parameterAsInt(parameters, self.ROUTING_MODE, context)]
+        routing_criteria = self.routing_criteria_options[self.parameterAsInt(parameters, self.ROUTING_CRITERIA,
+                                                                             context)]
+        thresholds = self.parse_thresholds(self.parameterAsString(parameters, self.THRESHOLDS, context))
+        concavity = self.parameterAsDouble(parameters, self.CONCAVITY, context)
+        max_snap_distance = self.parameterAsDouble(parameters, self.MAX_SNAP_DISTANCE, context)
+        workers = self.parameterAsInt(parameters, self.WORKERS, context)
+
+        if not os.path.isfile(source_file):
+            feedback.reportError('Cannot find input graph file!', True)
+            return {self.OUTPUT_POLYGONS: None}
+
+        feedback.pushInfo('Read topology of graph file...')
+        try:
+            topology = GraphTopologyCache.get(source_file, feedback)
+        except ValueError as e:
+            feedback.reportError('Cannot read graph file: ' + str(e), True)
+            return {self.OUTPUT_POLYGONS: None}
+        if topology is None:
+            return {self.OUTPUT_POLYGONS: None}
+
+        # costs are seconds for duration criteria
+        cost_factor = 1 if routing_criteria == 'LENGTH' else 60
+        max_cost = thresholds[-1] * cost_factor
+
+        points = GeomTools.read_points_wgs84(source, id_field or None, context.transformContext())
+        positions = travel_matrix.snap_points(source_file, [p[1:] if p[1] is not None else None for p in points],
+                                              routing_mode, max_snap_distance if max_snap_distance > 0 else math.inf)
+
+        segment_fields = QgsFields()
+        segment_fields.append(QgsField('source_id', QVariant.String, 'String'))
+        segment_fields.append(QgsField('segment_id', QVariant.LongLong, 'Integer'))
+        segment_fields.append(QgsField('linkDirectionForward', QVariant.Bool, 'Boolean'))
+        segment_fields.append(QgsField('start_cost', QVariant.Double, 'Real'))
+        segment_fields.append(QgsField('end_cost', QVariant.Double, 'Real'))
+        segment_fields.append(QgsField('threshold', QVariant.Double, 'Real'))
+        (segment_sink, segment_dest_id) = self.parameterAsSink(parameters, self.OUTPUT_SEGMENTS, context,
+                                                               segment_fields, QgsWkbTypes.LineString,
+                                                               QgsCoordinateReferenceSystem(4326))
+        polygon_fields = QgsFields()
+        polygon_fields.append(QgsField('source_id', QVariant.String, 'String'))
+        polygon_fields.append(QgsField('threshold', QVariant.Double, 'Real'))
+        polygon_fields.append(QgsField('segment_count', QVariant.Int, 'Integer'))
+        (polygon_sink, polygon_dest_id) = self.parameterAsSink(parameters, self.OUTPUT_POLYGONS, context,
+                                                               polygon_fields, QgsWkbTypes.Polygon,
+                                                               QgsCoordinateReferenceSystem(4326))
+
+        with ProcessPool(workers) as pool:
+            feedback.pushInfo('Calculate service areas of ' + str(len(points)) + ' points ' +
+                              ('in ' + str(pool.max_workers) + ' worker processes' if pool.is_parallel()
+                               else 'in the current process'))
+            futures = {}
+            for index, (point, position) in enumerate(zip(points, positions)):
+                # without worker processes submit() calculates the service area before it returns
+                if not pool.is_parallel():
+                    if feedback.isCanceled():
+                        return {self.OUTPUT_POLYGONS: None}
+                    feedback.setProgress(100 * index / len(points))
+                if position is None:
+                    feedback.reportError('Point ' + str(point[0]) + ' cannot be snapped to a segment', False)
+                    continue
+                futures[pool.submit(service_area.reachable_pieces, source_file, routing_mode, routing_criteria,
+                                    position[:2], max_cost)] = point
+            pending = set(futures.keys())
+            while pending:
+                if feedback.isCanceled():
+                    pool.shutdown(True)
+                    return {self.OUTPUT_POLYGONS: None}
+                done, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+                for future in done:
+                    point_id = str(futures[future][0])
+                    pieces = future.result()
+                    if segment_sink is not None:
+                        segment_sink.addFeatures(self.segment_features(topology, point_id, pieces, thresholds,
+                                                                       cost_factor, segment_fields),
+                                                 QgsFeatureSink.FastInsert)
+                    polygon_sink.addFeatures(self.polygon_features(topology, point_id, pieces, thresholds,
+                                                                   cost_factor, concavity, polygon_fields),
+                                             QgsFeatureSink.FastInsert)
+                feedback.setProgress(100 * (len(futures) - len(pending)) / max(1, len(futures)))
+
+        outputs = {self.OUTPUT_POLYGONS: polygon_dest_id}
+        if segment_sink is not None:
+            outputs[self.OUTPUT_SEGMENTS] = segment_dest_id
+        return outputs
+
+    @staticmethod
+    def piece_coordinates(topology, piece, cost_limit):
+        segment, forward, start_fraction, _, _ = piece
+        end_fraction = service_area.piece_end_fraction(piece, cost_limit)
+        coordinates = RoutingEngine.cut_line(topology.segment_coordinates(segment),
+                                             min(start_fraction, end_fraction), max(start_fraction, end_fraction))
+        return coordinates if forward else coordinates[::-1]
+
+    def segment_features(self, topology, point_id, pieces, thresholds, cost_factor, fields):
+        max_cost = thresholds[-1] * cost_factor
+        features = []
+        for piece in pieces:
+            segment, forward, start_fraction, start_cost, segment_cost = piece
+            end_fraction = service_area.piece_end_fraction(piece, max_cost)
+            if end_fraction == start_fraction:
+                continue
+            feature = QgsFeature(fields)
+            feature.setGeometry(QgsGeometry.fromPolylineXY([QgsPointXY(x, y) for x, y in
+                                                            self.piece_coordinates(topology, piece, max_cost)]))
+            end_cost = start_cost + abs(end_fraction - start_fraction) * segment_cost
+            threshold = next(t for t in thresholds if t * cost_factor >= start_cost)
+            feature.setAttributes([point_id, topology.segment_ids[segment], forward, round(start_cost, 2),
+                                   round(end_cost, 2), threshold])
+            features.append(feature)
+        return features
+
+    def polygon_features(self, topology, point_id, pieces, thresholds, cost_factor, concavity, fields):
+        features = []
+        for threshold in thresholds:
+            cost_limit = threshold * cost_factor
+            points = []
+            segment_count = 0
+            for piece in pieces:
+                if piece[3] > cost_limit:
+                    continue
+                segment_count += 1
+                points.extend([QgsPointXY(x, y) for x, y in self.piece_coordinates(topology, piece, cost_limit)])
+            if len(points) < 3:
+                continue
+            feature = QgsFeature(fields)
+            feature.setGeometry(self.hull(QgsGeometry.fromMultiPointXY(points), concavity))
+            feature.setAttributes([point_id, threshold, segment_count])
+            features.append(feature)
+        return features
+
+    @staticmethod
+    def hull(geometry, concavity):
+        """
+        :return: concave hull of the geometry; convex hull if concave hulls are not supported (QGIS < 3.28)
+        """
+        if concavity < 1 and hasattr(geometry, 'concaveHull'):
+            hull = geometry.concaveHull(concavity)
+            if not hull.isNull() and not hull.isEmpty() and hull.type() == QgsWkbTypes.PolygonGeometry:
+                return hull
+        return geometry.convexHull()
@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ QGIS plugin 'Graphium'
+/***************************************************************************
+ *
+ * Copyright 2020 Simon Gröchenig @ Salzburg Research
+ * eMail     graphium@salzburgresearch.at
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ *
+ ***************************************************************************/
+"""
+
+import os
+import json
+import math
+import glob
+from concurrent.futures import (wait, FIRST_COMPLETED)
+# PyQt5 imports
+from PyQt5.QtCore import QVariant
+from PyQt5.QtGui import (QIcon)
+# qgis imports
+from qgis.PyQt.QtCore import QCoreApplication
+from qgis.core import (QgsProcessingAlgorithm, QgsProcessingParameterFile, QgsProcessingParameterEnum,
+                       QgsProcessingParameterNumber, QgsProcessingParameterFeatureSink, QgsProcessingOutputNumber,
+                       QgsProcessing, QgsFeature, QgsFeatureSink, QgsField, QgsGeometry, QgsWkbTypes)
+# plugin
+from .. import map_matcher
+from ..routing_engine import RoutingEngine
+from ..process_pool import ProcessPool
+from .mapmatcher_algorithm import MapMatcherAlgorithm
+from ...graph_data.graph_topology import GraphTopologyCache
+
+
+class LocalMapMatcherAlgorithm(QgsProcessingAlgorithm):
+    """
+    This algorithm links trajectories to the road network of a local graph file.
+    """
+
+    plugin_path = os.path.split(os.path.split(os.path.split(os.path.dirname(__file__))[0])[0])[0]
+
+    SOURCE_FILE = 'SOURCE_FILE'
+    INPUT = 'INPUT'
+    INPUT_FOLDER = 'INPUT_FOLDER'
+    ROUTING_MODE = 'ROUTING_MODE'
+    SIGMA = 'SIGMA'
+    SEARCH_RADIUS = 'SEARCH_RADIUS'
+    MAX_CANDIDATES = 'MAX_CANDIDATES'
+    WORKERS = 'WORKERS'
+    OUTPUT_MATCHED_SEGMENTS = 'OUTPUT_MATCHED_SEGMENTS'
+    OUTPUT_TRACK_COUNT = 'OUTPUT_TRACK_COUNT'
+    OUTPUT_FAILED_COUNT = 'OUTPUT_FAILED_COUNT'
+    OUTPUT_LENGTH = 'OUTPUT_LENGTH'
+
+    def __init__(self):
+        super().__init__()
+
+        self.alg_group = "Utilities"
+        self.alg_group_id = "graphutilities"
+        self.alg_name = "localmapmatcher"
+        self.alg_display_name = "Map Matcher (local graph file)"
+
+        self.routing_mode_options = list(RoutingEngine.MODES)
+
+    def createInstance(self):
+        return LocalMapMatcherAlgorithm()
+
+    def group(self):
+        return self.tr(self.alg_group)
+
+    def groupId(self):
+        return self.alg_group_id
+
+    def name(self):
+        return self.alg_name
+
+    def displayName(self):
+        return self.tr(self.alg_display_name)
+
+    def shortHelpString(self):
+        return self.tr('This algorithm links trajectories to the road network of a local graph version JSON file '
+                       'without a Graphium server. Input is a track file in Graphium JSON format (one track or a '
+                       'list of tracks) and/or a folder of such files.\n\n'
+                       'Tracks are matched with a hidden markov model: the candidates of a track point are the '
+                       'nearest segments within the search radius, the most likely sequence of candidates is found '
+                       'with the Viterbi algorithm based on the distances of the track points (GPS accuracy sigma) '
+                       'and the route lengths between consecutive candidates. Tracks are distributed to parallel '
+                       'worker processes.\n\n'
+                       'The output has the same attributes as the output of the Map Matcher algorithm plus the ID '
+                       'of the track.')
+
+    def icon(self):
+        return QIcon(os.path.join(self.plugin_path, 'icons/icon_map_matcher.svg'))
+
+    def tr(self, string):
+        """
+        Returns a translatable string with the self.tr() function.
+        """
+        return QCoreApplication.translate('Processing', string)
+
+    def initAlgorithm(self, config=None):
+        """
+        Definition of inputs and outputs of the algorithm, along with some other properties.
+        """
+
+        self.addParameter(QgsProcessingParameterFile(self.SOURCE_FILE, self.tr('Input graph file'),
+                                                     QgsProcessingParameterFile.Behavior.File, optional=False))
+        self.addParameter(QgsProcessingParameterFile(self.INPUT, self.tr('Input track file'),
+                                                     QgsProcessingParameterFile.Behavior.File, 'json', None, True))
+        self.addParameter(QgsProcessingParameterFile(self.INPUT_FOLDER, self.tr('Input folder with track files'),
+                                                     QgsProcessingParameterFile.Behavior.Folder, optional=True))
+        self.addParameter(QgsProcessingParameterEnum(self.ROUTING_MODE,
+                                                     self.tr('Select routing mode'),
+                                                     options=self.routing_mode_options,
+                                                     allowMultiple=False, defaultValue=0, optional=False))
+        self.addParameter(QgsProcessingParameterNumber(self.SIGMA, self.tr('GPS accuracy (sigma) [m]'),
+                                                       QgsProcessingParameterNumber.Double, 10, True, 1, 500))
+        self.addParameter(QgsProcessingParameterNumber(self.SEARCH_RADIUS, self.tr('Search radius [m]'),
+                                                       QgsProcessingParameterNumber.Double, 50, True, 1, 1000))
+        self.addParameter(QgsProcessingParameterNumber(self.MAX_CANDIDATES,
+                                                       self.tr('Maximum number of candidate segments per point'),
+                                                       QgsProcessingParameterNumber.Integer, 5, True, 1, 50))
+        self.addParameter(QgsProcessingParameterNumber(self.WORKERS,
+                                                       self.tr('Number of worker processes (0 = automatic)'),
+                                                       QgsProcessingParameterNumber.Integer, 0, True, 0, 64))
+
+        self.addParameter(QgsProcessingParameterFeatureSink(self.OUTPUT_MATCHED_SEGMENTS,
+                                                            self.tr('Map matching output'),
+                                                            QgsProcessing.TypeVectorLine))
+
+        self.addOutput(QgsProcessingOutputNumber(self.OUTPUT_TRACK_COUNT, self.tr('Number of matched tracks')))
+        self.addOutput(QgsProcessingOutputNumber(self.OUTPUT_FAILED_COUNT, self.tr('Number of unmatched tracks')))
+        self.addOutput(QgsProcessingOutputNumber(self.OUTPUT_LENGTH, self.tr('Map-matched length')))
+
+    def checkParameterValues(self, parameters, context):
+        ok, message = super(LocalMapMatcherAlgorithm, self).checkParameterValues(parameters, context)
+        if ok and not self.parameterAsFile(parameters, self.INPUT, context) and \
+                not self.parameterAsFile(parameters, self.INPUT_FOLDER, context):
+            ok, message = False, 'Select a track file or a folder with track files'
+        return ok, message
+
+    def processAlgorithm(self, parameters, context, feedback):
+        source_file = self.parameterAsFile(parameters, self.SOURCE_FILE, context)
+        track_file = self.parameterAsFile(parameters, self.INPUT, context)
+        track_folder = self.parameterAsFile(parameters, self.INPUT_FOLDER, context)
+        routing_mode = self.routing_mode_options[self.parameterAsInt(parameters, self.ROUTING_MODE, context)]
+        sigma = self.parameterAsDouble(parameters, self.SIGMA, context)
+        search_radius = self.parameterAsDouble(parameters, self.SEARCH_RADIUS, context)
+        max_candidates = self.parameterAsInt(parameters, self.MAX_CANDIDATES, context)
+        workers = self.parameterAsInt(parameters, self.WORKERS, context)
+
+        if not os.path.isfile(source_file):
+            feedback.reportError('Cannot find input graph file!', True)
+            return {self.OUTPUT_MATCHED_SEGMENTS: None}
+
+        track_files = [track_file] if track_file else []
+        if track_folder:
+            track_files.extend(sorted(glob.glob(os.path.join(track_folder, '*.json'))))
+        tracks = []
+        for file in track_files:
+            tracks.extend(self.read_tracks(file, feedback))
+        if not tracks:
+            feedback.reportError('No tracks found', True)
+            return {self.OUTPUT_MATCHED_SEGMENTS: None}
+
+        feedback.pushInfo('Read topology of graph file...')
+        try:
+            topology = GraphTopologyCache.get(source_file, feedback)
+        except ValueError as e:
+            feedback.reportError('Cannot read graph file: ' + str(e), True)
+            return {self.OUTPUT_MATCHED_SEGMENTS: None}
+        if topology is None:
+            return {self.OUTPUT_MATCHED_SEGMENTS: None}
+
+        vector_layer = MapMatcherAlgorithm.prepare_vector_layer('matched_track')
+        fields = vector_layer.fields()
+        fields.append(QgsField('trackId', QVariant.String, 'String'))
+        (sink, dest_id) = self.parameterAsSink(parameters, self.OUTPUT_MATCHED_SEGMENTS, context, fields,
+                                               QgsWkbTypes.LineString, vector_layer.sourceCrs())
+
+        track_count, failed_count, length = 0, 0, 0.0
+        with ProcessPool(workers) as pool:
+            batch_size = max(1, min(20, math.ceil(len(tracks) / (4 * pool.max_workers))))
+            feedback.pushInfo('Match ' + str(len(tracks)) + ' tracks ' +
+                              ('in ' + str(pool.max_workers) + ' worker processes' if pool.is_parallel()
+                               else 'in the current process'))
+            futures = []
+            for start in range(0, len(tracks), batch_size):
+                # without worker processes submit() matches the batch before it returns
+                if not pool.is_parallel():
+                    if feedback.isCanceled():
+                        return {self.OUTPUT_MATCHED_SEGMENTS: None}
+                    feedback.setProgress(100 * start / len(tracks))
+                futures.append(pool.submit(map_matcher.match_tracks, source_file, tracks[start:start + batch_size],
+                                           routing_mode, sigma, search_radius, max_candidates))
+            pending = set(futures)
+            while pending:
+                if feedback.isCanceled():
+                    pool.shutdown(True)
+                    return {self.OUTPUT_MATCHED_SEGMENTS: None}
+                done, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+                for future in done:
+                    for track_id, response in future.result():
+                        if not response['segments']:
+                            feedback.reportError('Track ' + str(track_id) + ' cannot be matched', False)
+                            failed_count += 1
+                            continue
+                        track_count += 1
+                        length += response['length']
+                        sink.addFeatures(self.segment_features(track_id, response, fields),
+                                         QgsFeatureSink.FastInsert)
+                feedback.setProgress(100 * (len(futures) - len(pending)) / len(futures))
+
+        feedback.pushInfo('Matched ' + str(track_count) + ' of ' + str(len(tracks)) + ' tracks')
+        return {self.OUTPUT_MATCHED_SEGMENTS: dest_id,
+                self.OUTPUT_TRACK_COUNT: track_count,
+                self.OUTPUT_FAILED_COUNT: failed_count,
+                self.OUTPUT_LENGTH: round(length, 2)}
+
+    @staticmethod
+    def read_tracks(track_file, feedback):
+        """
+        Reads the tracks of a Graphium JSON track file (one track or a list of tracks)
+        :return: list of tuples (track ID, list of WGS84 coordinates (x, y))
+        """
+        try:
+            with open(track_file) as json_data:
+                track_data = json.load(json_data)
+        except (OSError, ValueError) as e:
+            feedback.reportError('Cannot read track file ' + track_file + ': ' + str(e), False)
+            return []
+
+        tracks = []
+        for index, track in enumerate(track_data if isinstance(track_data, list) else [track_data]):
+            if not isinstance(track, dict) or not isinstance(track.get('trackPoints'), list):
+                feedback.reportError('Track ' + str(index) + ' of ' + track_file + ' has no track points', False)
+                continue
+            track_id = track.get('id')
+            if track_id is None:
+                track_id = os.path.splitext(os.path.basename(track_file))[0] + '_' + str(index)
+            tracks.append((str(track_id), [(float(point['x']), float(point['y'])) for point in track['trackPoints']
+                                           if point.get('x') is not None and point.get('y') is not None]))
+        return tracks
+
+    @staticmethod
+    def segment_features(track_id, response, fields):
+        features = []
+        for current, segment in enumerate(response['segments']):
+            feature = QgsFeature(fields)
+            feature.setGeometry(QgsGeometry.fromWkt(segment['geometry']))
+            feature.setAttribute('order', current)
+            for attribute_key in segment:
+                try:
+                    feature.setAttribute(attribute_key, segment[attribute_key])
+                except KeyError:
+                    pass
+            feature.setAttribute('trackId', track_id)
+            features.append(feature)
+        return features
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ QGIS plugin 'Graphium'
+/***************************************************************************
+ *
+ * Copyright 2020 Simon Gröchenig @ Salzburg Research
+ * eMail     graphium@salzburgresearch.at
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ *
+ ***************************************************************************/
+"""
+
+import os
+# PyQt5 imports
+from PyQt5.QtGui import (QIcon)
+# qgis imports
+from qgis.PyQt.QtCore import (QCoreApplication, QSettings)
+from qgis.core import (QgsProcessingParameterEnum, QgsProcessingParameterFile, QgsProcessingParameterPoint,
+                       QgsProcessingParameterFeatureSink, QgsProcessing, QgsFeature, QgsFeatureSink, QgsWkbTypes,
+                       QgsCoordinateReferenceSystem, QgsGeometry, QgsProcessingAlgorithm,
+                       QgsProcessingMultiStepFeedback)
+# plugin
+from .routing_algorithm import RoutingAlgorithm
+from ..routing_engine import RoutingEngine
+from ..contraction_hierarchy import (ContractionHierarchy, ContractionHierarchyCache,
+                                     ContractionHierarchyRoutingEngine)
+from ...graph_data.graph_topology import GraphTopologyCache
+
+
+class LocalRoutingAlgorithm(QgsProcessingAlgorithm):
+    """
+    This algorithm finds the fastest or shortest route between two coordinates on a local graph file.
+    """
+
+    plugin_path = os.path.split(os.path.split(os.path.split(os.path.dirname(__file__))[0])[0])[0]
+
+    SOURCE_FILE = 'SOURCE_FILE'
+    START_COORDINATE = 'START_COORDINATE'
+    END_COORDINATE = 'END_COORDINATE'
+    ROUTING_MODE = 'ROUTING_MODE'
+    ROUTING_CRITERIA = 'ROUTING_CRITERIA'
+    HIERARCHY_DIRECTORY = 'HIERARCHY_DIRECTORY'
+    OUTPUT = 'OUTPUT'
+    OUTPUT_PATH = 'OUTPUT_PATH'
+
+    def __init__(self):
+        super().__init__()
+
+        self.alg_group = "Utilities"
+        self.alg_group_id = "graphutilities"
+        self.alg_name = "localrouting"
+        self.alg_display_name = "Routing (local graph file)"
+
+        self.routing_mode_options = list(RoutingEngine.MODES)
+        self.routing_criteria_options = list(RoutingEngine.CRITERIA)
+
+    def createInstance(self):
+        return LocalRoutingAlgorithm()
+
+    def group(self):
+        return self.tr(self.alg_group)
+
+    def groupId(self):
+        return self.alg_group_id
+
+    def name(self):
+        return self.alg_name
+
+    def displayName(self):
+        return self.tr(self.alg_display_name)
+
+    def shortHelpString(self):
+        return self.tr('Use this algorithm to find the fastest or shortest route between two coordinates without a '
+                       'Graphium server. The route is calculated on a local graph version JSON file (e.g. downloaded '
+                       'with the algorithm DownloadGraphVersion or converted with the OSM / GIP converter). The output '
+                       'is the same as the one of the Routing algorithm.\n\n'
+                       'The topology of the graph file is kept in memory, therefore further routes on the same graph '
+                       'file are calculated without reading the file again.\n\n'
+                       'If the hierarchy directory contains a contraction hierarchy of the graph version for the '
+                       'routing mode and criteria (see algorithm Build contraction hierarchy), the route is calculated '
+                       'with the hierarchy.\n\n'
+                       'The start and end coordinates can be set (1) with the [...] button right to the text input or '
+                       '(2) manually according to format "lon,lat [coordinate reference system]" '
+                       '(e.g. 13.0,47.8 [EPSG:4326])')
+
+    def icon(self):
+        return QIcon(os.path.join(self.plugin_path, 'icons/icon_routing.svg'))
+
+    def tr(self, string):
+        """
+        Returns a translatable string with the self.tr() function.
+        """
+        return QCoreApplication.translate('Processing', string)
+
+    def initAlgorithm(self, config=None):
+        """
+        Definition of inputs and outputs of the algorithm, along with some other properties.
+        """
+
+        self.addParameter(QgsProcessingParameterFile(self.SOURCE_FILE, self.tr('Input graph file'),
+                                                     QgsProcessingParameterFile.Behavior.File, optional=False))
+        self.addParameter(QgsProcessingParameterPoint(self.START_COORDINATE,
+                                                      self.tr('Start coordinate'),
+                                                      None, False))
+        self.addParameter(QgsProcessingParameterPoint(self.END_COORDINATE,
+                                                      self.tr('End coordinate'),
+                                                      None, False))
+        self.addParameter(QgsProcessingParameterEnum(self.ROUTING_MODE,
+                                                     self.tr('Select routing mode'),
+                                                     options=self.routing_mode_options,
+                                                     allowMultiple=False, defaultValue=0, optional=False))
+        self.addParameter(QgsProcessingParameterEnum(self.ROUTING_CRITERIA,
+                                                     self.tr('Select routing criteria'),
+                                                     options=self.routing_criteria_options,
+                                                     allowMultiple=False, defaultValue=1, optional=False))
+        hierarchy_dir = QSettings().value('plugin-graphium/contraction_hierarchy_dir', '')
+        self.addParameter(QgsProcessingParameterFile(self.HIERARCHY_DIRECTORY,
+                                                     self.tr('Directory of contraction hierarchies'),
+                                                     QgsProcessingParameterFile.Folder, defaultValue=hierarchy_dir,
+                                                     optional=True))
+
+        self.addParameter(QgsProcessingParameterFeatureSink(self.OUTPUT, self.tr('Routing output'),
+                                                            QgsProcessing.TypeVectorLine))
+
+        self.addParameter(QgsProcessingParameterFeatureSink(self.OUTPUT_PATH, self.tr('Routing path output'),
+                                                            QgsProcessing.TypeVector))
+
+    def processAlgorithm(self, parameters, context, model_feedback):
+        feedback = QgsProcessingMultiStepFeedback(3, model_feedback)
+
+        source_file = self.parameterAsFile(parameters, self.SOURCE_FILE, context)
+        start_coordinate = self.parameterAsPoint(parameters, self.START_COORDINATE, context,
+                                                 QgsCoordinateReferenceSystem(4326))
+        end_coordinate = self.parameterAsPoint(parameters, self.END_COORDINATE, context,
+                                               QgsCoordinateReferenceSystem(4326))
+        routing_mode = self.routing_mode_options[self.parameterAsInt(parameters, self.ROUTING_MODE, context)]
+        routing_criteria = self.routing_criteria_options[self.parameterAsInt(parameters, self.ROUTING_CRITERIA,
+                                                                             context)]
+        hierarchy_directory = self.parameterAsFile(parameters, self.HIERARCHY_DIRECTORY, context)
+
+        if not os.path.isfile(source_file):
+            feedback.reportError('Cannot find input graph file!', True)
+            return {self.OUTPUT: None, self.OUTPUT_PATH: None}
+
+        feedback.setCurrentStep(0)
+        feedback.pushInfo('Read topology of graph file...')
+        try:
+            topology = GraphTopologyCache.get(source_file, feedback)
+        except ValueError as e:
+            feedback.reportError('Cannot read graph file: ' + str(e), True)
+            return {self.OUTPUT: None, self.OUTPUT_PATH: None}
+        if topology is None:
+            return {self.OUTPUT: None, self.OUTPUT_PATH: None}
+        feedback.pushInfo('Topology contains ' + str(topology.segment_count) + ' segments and ' +
+                          str(topology.node_count) + ' nodes')
+
+        feedback.setCurrentStep(1)
+        feedback.pushInfo('Calculate route...')
+        engine = RoutingEngine(topology)
+        if hierarchy_directory:
+            hierarchy_file = os.path.join(hierarchy_directory, ContractionHierarchy.file_name(
+                topology.graph_name, topology.graph_version, routing_mode, routing_criteria))
+            if os.path.isfile(hierarchy_file):
+                try:
+                    hierarchy = ContractionHierarchyCache.get(hierarchy_file)
+                except ValueError as e:
+                    feedback.reportError('Cannot read contraction hierarchy: ' + str(e), False)
+                    hierarchy = None
+                if hierarchy is not None and hierarchy.matches(topology, routing_mode, routing_criteria):
+                    feedback.pushInfo('Use contraction hierarchy ' + hierarchy_file)
+                    engine = ContractionHierarchyRoutingEngine(topology, hierarchy)
+                elif hierarchy is not None:
+                    feedback.pushInfo('Contraction hierarchy ' + hierarchy_file + ' does not match the graph file')
+            else:
+                feedback.pushInfo('No contraction hierarchy for routing mode ' + routing_mode + ' and criteria ' +
+                                  routing_criteria)
+        response = engine.route(start_coordinate.x(), start_coordinate.y(), end_coordinate.x(), end_coordinate.y(),
+                                routing_mode, routing_criteria)
+
+        if 'error' in response:
+            feedback.reportError(response['error']['msg'], True)
+            return {self.OUTPUT: None, self.OUTPUT_PATH: None}
+        if response['route']['length'] == 0:
+            feedback.reportError('No route found', False)
+            return {self.OUTPUT: None, self.OUTPUT_PATH: None}
+
+        # create feature output
+        feedback.setCurrentStep(2)
+        vector_layer = RoutingAlgorithm.prepare_vector_layer('route')
+
+        (sink, dest_id) = self.parameterAsSink(parameters, self.OUTPUT, context, vector_layer.fields(),
+                                               QgsWkbTypes.LineString, vector_layer.sourceCrs())
+        feature = QgsFeature()
+        feature.setGeometry(QgsGeometry.fromWkt(response['route']['geometry']))
+        feature.setFields(vector_layer.fields(), True)
+        for attribute_key in response['route']:
+            try:
+                feature.setAttribute(attribute_key, response['route'][attribute_key])
+            except KeyError:
+                pass
+        sink.addFeature(feature, QgsFeatureSink.FastInsert)
+
+        # create path output
+        path_layer = RoutingAlgorithm.prepare_path_layer('route_path')
+
+        (sink_path, dest_id_path) = self.parameterAsSink(parameters, self.OUTPUT_PATH, context, path_layer.fields(),
+                                                         QgsWkbTypes.NoGeometry, vector_layer.sourceCrs())
+        total = 100.0 / len(response['route']['segments'])
+        for current, path_segment in enumerate(response['route']['segments']):
+            if feedback.isCanceled():
+                break
+            feature = QgsFeature()
+            feature.setFields(path_layer.fields(), True)
+            feature.setAttribute('order', current)
+            feature.setAttribute('segment_id', path_segment['id'])
+            feature.setAttribute('linkDirectionForward', path_segment['linkDirectionForward'])
+            sink_path.addFeature(feature, QgsFeatureSink.FastInsert)
+            feedback.setProgress(int(current * total))
+
+        return {self.OUTPUT: dest_id, self.OUTPUT_PATH: dest_id_path}
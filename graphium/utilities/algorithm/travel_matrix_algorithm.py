@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ QGIS plugin 'Graphium'
+/***************************************************************************
+ *
+ * Copyright 2020 Simon Gröchenig @ Salzburg Research
+ * eMail     graphium@salzburgresearch.at
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ *
+ ***************************************************************************/
+"""
+
+import os
+import csv
+import math
+from concurrent.futures import (wait, FIRST_COMPLETED)
+# PyQt5 imports
+from PyQt5.QtCore import QVariant
+from PyQt5.QtGui import (QIcon)
+# qgis imports
+from qgis.PyQt.QtCore import QCoreApplication
+from qgis.core import (QgsProcessingAlgorithm, QgsProcessingParameterFile, QgsProcessingParameterEnum,
+                       QgsProcessingParameterFeatureSource, QgsProcessingParameterField, QgsProcessingParameterNumber,
+                       QgsProcessingParameterFeatureSink, QgsProcessingParameterFileDestination,
+                       QgsProcessingOutputNumber, QgsProcessing, QgsFeature, QgsFeatureSink, QgsFields, QgsField,
+                       QgsWkbTypes, QgsCoordinateReferenceSystem)
+# plugin
+from .. import travel_matrix
+from ..geom_tools import GeomTools
+from ..routing_engine import RoutingEngine
+from ..process_pool import ProcessPool
+from ...graph_data.graph_topology import GraphTopologyCache
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class TravelMatrixAlgorithm(QgsProcessingAlgorithm):
+    """
+    This algorithm calculates a distance and travel time matrix between origin and destination points.
+    """
+
+    plugin_path = os.path.split(os.path.split(os.path.split(os.path.dirname(__file__))[0])[0])[0]
+
+    SOURCE_FILE = 'SOURCE_FILE'
+    ORIGINS = 'ORIGINS'
+    ORIGIN_ID_FIELD = 'ORIGIN_ID_FIELD'
+    DESTINATIONS = 'DESTINATIONS'
+    DESTINATION_ID_FIELD = 'DESTINATION_ID_FIELD'
+    ROUTING_MODE = 'ROUTING_MODE'
+    ROUTING_CRITERIA = 'ROUTING_CRITERIA'
+    MAX_SNAP_DISTANCE = 'MAX_SNAP_DISTANCE'
+    WORKERS = 'WORKERS'
+    OUTPUT = 'OUTPUT'
+    OUTPUT_MATRIX = 'OUTPUT_MATRIX'
+    OUTPUT_UNREACHABLE_COUNT = 'OUTPUT_UNREACHABLE_COUNT'
+
+    def __init__(self):
+        super().__init__()
+
+        self.alg_group = "Utilities"
+        self.alg_group_id = "graphutilities"
+        self.alg_name = "travelmatrix"
+        self.alg_display_name = "Travel matrix (local graph file)"
+
+        self.routing_mode_options = list(RoutingEngine.MODES)
+        self.routing_criteria_options = list(RoutingEngine.CRITERIA)
+
+    def createInstance(self):
+        return TravelMatrixAlgorithm()
+
+    def group(self):
+        return self.tr(self.alg_group)
+
+    def groupId(self):
+        return self.alg_group_id
+
+    def name(self):
+        return self.alg_name
+
+    def displayName(self):
+        return self.tr(self.alg_display_name)
+
+    def shortHelpString(self):
+        return self.tr('This algorithm calculates the length and travel time of the best routes between all origin '
+                       'and destination points on a local graph version JSON file. Points are snapped to the nearest '
+                       'segment accessible by the routing mode. The routes of one origin to all destinations are '
+                       'calculated with one search; origins are distributed to parallel worker processes.\n\n'
+                       'The matrix is written as table (one row per origin and destination) and optionally as matrix '
+                       'file: a NumPy file (*.npy, requires NumPy) contains an array of shape (2, origins, '
+                       'destinations) with lengths [m] and durations [s] in the order of the features; a CSV file '
+                       'contains the lengths (criteria LENGTH) or durations with origin IDs as rows and destination '
+                       'IDs as columns. Unreachable destinations are empty (NaN).')
+
+    def icon(self):
+        return QIcon(os.path.join(self.plugin_path, 'icons/icon_routing.svg'))
+
+    def tr(self, string):
+        """
+        Returns a translatable string with the self.tr() function.
+        """
+        return QCoreApplication.translate('Processing', string)
+
+    def initAlgorithm(self, config=None):
+        """
+        Definition of inputs and outputs of the algorithm, along with some other properties.
+        """
+
+        self.addParameter(QgsProcessingParameterFile(self.SOURCE_FILE, self.tr('Input graph file'),
+                                                     QgsProcessingParameterFile.Behavior.File, optional=False))
+        self.addParameter(QgsProcessingParameterFeatureSource(self.ORIGINS, self.tr('Origin points'),
+                                                              [QgsProcessing.TypeVectorPoint], None, False))
+        self.addParameter(QgsProcessingParameterField(self.ORIGIN_ID_FIELD,
+                                                      self.tr('Origin ID field (feature ID if not set)'),
+                                                      parentLayerParameterName=self.ORIGINS, optional=True))
+        self.addParameter(QgsProcessingParameterFeatureSource(self.DESTINATIONS, self.tr('Destination points'),
+                                                              [QgsProcessing.TypeVectorPoint], None, False))
+        self.addParameter(QgsProcessingParameterField(self.DESTINATION_ID_FIELD,
+                                                      self.tr('Destination ID field (feature ID if not set)'),
+                                                      parentLayerParameterName=self.DESTINATIONS, optional=True))
+        self.addParameter(QgsProcessingParameterEnum(self.ROUTING_MODE,
+                                                     self.tr('Select routing mode'),
+                                                     options=self.routing_mode_options,
+                                                     allowMultiple=False, defaultValue=0, optional=False))
+        self.addParameter(QgsProcessingParameterEnum(self.ROUTING_CRITERIA,
+                                                     self.tr('Select routing criteria'),
+                                                     options=self.routing_criteria_options,
+                                                     allowMultiple=False, defaultValue=1, optional=False))
+        self.addParameter(QgsProcessingParameterNumber(self.MAX_SNAP_DISTANCE,
+                                                       self.tr('Maximum snapping distance [m]'),
+                                                       QgsProcessingParameterNumber.Double, 500, True, 0))
+        self.addParameter(QgsProcessingParameterNumber(self.WORKERS,
+                                                       self.tr('Number of worker processes (0 = automatic)'),
+                                                       QgsProcessingParameterNumber.Integer, 0, True, 0, 64))
+
+        self.addParameter(QgsProcessingParameterFeatureSink(self.OUTPUT, self.tr('Travel matrix table'),
+                                                            QgsProcessing.TypeVector, optional=True))
+        self.addParameter(QgsProcessingParameterFileDestination(self.OUTPUT_MATRIX, self.tr('Travel matrix file'),
+                                                                'NumPy files (*.npy);;CSV files (*.csv)', None,
+                                                                True, False))
+        self.addOutput(QgsProcessingOutputNumber(self.OUTPUT_UNREACHABLE_COUNT,
+                                                 self.tr('Number of unreachable destinations')))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        source_file = self.parameterAsFile(parameters, self.SOURCE_FILE, context)
+        origins_source = self.parameterAsSource(parameters, self.ORIGINS, context)
+        origin_id_field = self.parameterAsString(parameters, self.ORIGIN_ID_FIELD, context)
+        destinations_source = self.parameterAsSource(parameters, self.DESTINATIONS, context)
+        destination_id_field = self.parameterAsString(parameters, self.DESTINATION_ID_FIELD, context)
+        routing_mode = self.routing_mode_options[self.parameterAsInt(parameters, self.ROUTING_MODE, context)]
+        routing_criteria = self.routing_criteria_options[self.parameterAsInt(parameters, self.ROUTING_CRITERIA,
+                                                                             context)]
+        max_snap_distance = self.parameterAsDouble(parameters, self.MAX_SNAP_DISTANCE, context)
+        workers = self.parameterAsInt(parameters, self.WORKERS, context)
+        matrix_file = self.parameterAsFileOutput(parameters, self.OUTPUT_MATRIX, context)
+
+        if not os.path.isfile(source_file):
+            feedback.reportError('Cannot find input graph file!', True)
+            return {self.OUTPUT: None}
+        if matrix_file and matrix_file.lower().endswith('.npy') and numpy is None:
+            feedback.reportError('NumPy is not available, please choose a CSV matrix file', True)
+            return {self.OUTPUT: None}
+
+        feedback.pushInfo('Read topology of graph file...')
+        try:
+            topology = GraphTopologyCache.get(source_file, feedback)
+        except ValueError as e:
+            feedback.reportError('Cannot read graph file: ' + str(e), True)
+            return {self.OUTPUT: None}
+        if topology is None:
+            return {self.OUTPUT: None}
+
+        origins = GeomTools.read_points_wgs84(origins_source, origin_id_field or None, context.transformContext())
+        destinations = GeomTools.read_points_wgs84(destinations_source, destination_id_field or None,
+                                                   context.transformContext())
+        feedback.pushInfo('Snap ' + str(len(origins)) + ' origins and ' + str(len(destinations)) + ' destinations')
+        max_distance = max_snap_distance if max_snap_distance > 0 else math.inf
+        origin_positions = [position[:2] if position is not None else None for position in travel_matrix.snap_points(
+            source_file, [p[1:] if p[1] is not None else None for p in origins], routing_mode, max_distance)]
+        destination_positions = [position[:2] if position is not None else None for position in
+                                 travel_matrix.snap_points(source_file,
+                                                           [p[1:] if p[1] is not None else None for p in destinations],
+                                                           routing_mode, max_distance)]
+        for points, positions, name in [(origins, origin_positions, 'Origin'),
+                                        (destinations, destination_positions, 'Destination')]:
+            for point, position in zip(points, positions):
+                if position is None:
+                    feedback.reportError(name + ' ' + str(point[0]) + ' cannot be snapped to a segment', False)
+
+        rows = [None] * len(origins)
+        with ProcessPool(workers) as pool:
+            batch_size = max(1, min(100, math.ceil(len(origins) / (4 * pool.max_workers))))
+            feedback.pushInfo('Calculate matrix ' + ('in ' + str(pool.max_workers) + ' worker processes'
+                                                     if pool.is_parallel() else 'in the current process'))
+            futures = {}
+            for start in range(0, len(origins), batch_size):
+                # without worker processes submit() calculates the batch before it returns
+                if not pool.is_parallel():
+                    if feedback.isCanceled():
+                        return {self.OUTPUT: None}
+                    feedback.setProgress(90 * start / max(1, len(origins)))
+                future = pool.submit(travel_matrix.matrix_rows, source_file, routing_mode, routing_criteria,
+                                     origin_positions[start:start + batch_size], destination_positions)
+                futures[future] = start
+            pending = set(futures.keys())
+            while pending:
+                if feedback.isCanceled():
+                    pool.shutdown(True)
+                    return {self.OUTPUT: None}
+                done, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+                for future in done:
+                    start = futures[future]
+                    batch_rows = future.result()
+                    rows[start:start + len(batch_rows)] = batch_rows
+                feedback.setProgress(90 * (len(futures) - len(pending)) / max(1, len(futures)))
+
+        unreachable_count = sum([row.count(None) for row in rows])
+        feedback.pushInfo(str(unreachable_count) + ' of ' + str(len(origins) * len(destinations)) +
+                          ' destinations are unreachable')
+
+        outputs = {self.OUTPUT_UNREACHABLE_COUNT: unreachable_count}
+        fields = QgsFields()
+        fields.append(QgsField('origin_id', QVariant.String, 'String'))
+        fields.append(QgsField('destination_id', QVariant.String, 'String'))
+        fields.append(QgsField('length', QVariant.Double, 'Real'))
+        fields.append(QgsField('duration', QVariant.Double, 'Real'))
+        (sink, dest_id) = self.parameterAsSink(parameters, self.OUTPUT, context, fields, QgsWkbTypes.NoGeometry,
+                                               QgsCoordinateReferenceSystem(4326))
+        if sink is not None:
+            for origin, row in zip(origins, rows):
+                if feedback.isCanceled():
+                    break
+                features = []
+                for destination, value in zip(destinations, row):
+                    feature = QgsFeature(fields)
+                    feature.setAttributes([str(origin[0]), str(destination[0]),
+                                           round(value[0], 2) if value is not None else None,
+                                           round(value[1], 1) if value is not None else None])
+                    features.append(feature)
+                sink.addFeatures(features, QgsFeatureSink.FastInsert)
+            outputs[self.OUTPUT] = dest_id
+
+        if matrix_file:
+            self.write_matrix(matrix_file, origins, destinations, rows, 0 if routing_criteria == 'LENGTH' else 1)
+            outputs[self.OUTPUT_MATRIX] = matrix_file
+        feedback.setProgress(100)
+        return outputs
+
+    @staticmethod
+    def write_matrix(matrix_file, origins, destinations, rows, value_index):
+        if matrix_file.lower().endswith('.npy'):
+            matrix = numpy.full((2, len(origins), len(destinations)), numpy.nan)
+            for i, row in enumerate(rows):
+                for j, value in enumerate(row):
+                    if value is not None:
+                        matrix[0, i, j] = value[0]
+                        matrix[1, i, j] = value[1]
+            numpy.save(matrix_file, matrix)
+        else:
+            with open(matrix_file, 'w', newline='', encoding='utf-8') as file:
+                writer = csv.writer(file)
+                writer.writerow([''] + [str(destination[0]) for destination in destinations])
+                for origin, row in zip(origins, rows):
+                    writer.writerow([str(origin[0])] + [round(value[value_index], 2) if value is not None else ''
+                                                        for value in row])
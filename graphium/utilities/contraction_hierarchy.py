@@ -0,0 +1,472 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ QGIS plugin 'Graphium'
+/***************************************************************************
+ *
+ * Copyright 2020 Simon Gröchenig @ Salzburg Research
+ * eMail     graphium@salzburgresearch.at
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ *
+ ***************************************************************************/
+"""
+
+import os
+import re
+import sys
+import json
+import math
+import mmap
+import heapq
+import struct
+from array import array
+# plugin
+from .routing_engine import RoutingEngine
+from ..graph_data.graph_topology import GraphTopologyCache
+
+# Contraction hierarchies for fast repeated routing queries on a GraphTopology. This module must not import qgis,
+# because queries are answered in worker processes.
+
+
+class ContractionHierarchy:
+    """
+    Contraction hierarchy of a graph version for one routing mode and criteria. Nodes are contracted in the order of
+    their importance (edge difference and number of contracted neighbors); shortcuts are added if a witness search does
+    not find another path of the same cost. Queries are answered by a bidirectional Dijkstra which only uses edges to
+    more important nodes, therefore only a small part of the graph is visited.
+
+    The hierarchy is stored as binary file which is memory-mapped for queries:
+     - magic bytes, header size (uint32) and JSON header
+     - arrays of 8 byte integers / doubles: upward edges per node in CSR format for the forward search (fwd_*) and the
+       backward search (bwd_*); shortcuts refer to the contracted node in the middle, original edges to the directed
+       edge of the GraphTopology
+    """
+
+    MAGIC = b'GRCH'
+    FORMAT_VERSION = 1
+    file_suffix = '.ch'
+
+    ARRAYS = [('rank', 'q'),
+              ('fwd_offsets', 'q'), ('fwd_targets', 'q'), ('fwd_costs', 'd'), ('fwd_middle', 'q'), ('fwd_edges', 'q'),
+              ('bwd_offsets', 'q'), ('bwd_sources', 'q'), ('bwd_costs', 'd'), ('bwd_middle', 'q'), ('bwd_edges', 'q')]
+
+    # maximum number of settled nodes per witness search
+    witness_settle_limit = 60
+
+    def __init__(self):
+        self.header = {}
+        self.arrays = {}
+        self.mmap = None
+
+    def __getattr__(self, name):
+        # arrays are accessible as attributes (e.g. self.fwd_offsets)
+        arrays = self.__dict__.get('arrays')
+        if arrays is not None and name in arrays:
+            return arrays[name]
+        raise AttributeError(name)
+
+    @classmethod
+    def file_name(cls, graph_name, graph_version, mode, criteria):
+        """
+        :return: name of the index file of a graph version and routing profile
+        """
+        name = '_'.join([str(graph_name), str(graph_version), mode, criteria])
+        return re.sub(r'[^\w.-]', '_', name) + cls.file_suffix
+
+    @classmethod
+    def build(cls, topology, mode, criteria, feedback=None):
+        """
+        Contracts all nodes of the topology
+        :param feedback: optional feedback for cancellation and progress information
+        :return: contraction hierarchy or None if canceled
+        """
+        engine = RoutingEngine(topology)
+        costs = engine.edge_costs(mode, criteria)
+        node_count = topology.node_count
+
+        # working graph: node -> {neighbor: (cost, middle node or -1, topology edge or -1)}
+        outgoing = [dict() for _ in range(node_count)]
+        incoming = [dict() for _ in range(node_count)]
+        for node in range(node_count):
+            for e in topology.edges(node):
+                target = topology.edge_targets[e]
+                if costs[e] == math.inf or target == node:
+                    continue
+                if costs[e] < outgoing[node].get(target, (math.inf,))[0]:
+                    outgoing[node][target] = (costs[e], -1, e)
+                    incoming[target][node] = (costs[e], -1, e)
+
+        hierarchy = cls()
+        contracted = bytearray(node_count)
+        contracted_neighbors = array('l', bytes(array('l').itemsize * node_count))
+        # level in the hierarchy; contracting nodes of low levels first keeps the hierarchy flat
+        levels = array('l', bytes(array('l').itemsize * node_count))
+        rank = array('q', bytes(8 * node_count))
+        upward_forward = [None] * node_count
+        upward_backward = [None] * node_count
+
+        def priority(node):
+            shortcuts = hierarchy.shortcuts(node, outgoing, incoming)
+            return 2 * (len(shortcuts) - len(outgoing[node]) - len(incoming[node])) + contracted_neighbors[node] + \
+                levels[node]
+
+        queue = [(priority(node), node) for node in range(node_count)]
+        heapq.heapify(queue)
+        current_rank = 0
+        while queue:
+            _, node = heapq.heappop(queue)
+            if contracted[node]:
+                continue
+            # lazy update: the priority is recalculated before the node is contracted
+            node_priority = priority(node)
+            if queue and node_priority > queue[0][0]:
+                heapq.heappush(queue, (node_priority, node))
+                continue
+
+            for source, target, cost in hierarchy.shortcuts(node, outgoing, incoming):
+                # the witness search is limited, therefore an existing edge could be cheaper
+                if cost < outgoing[source].get(target, (math.inf,))[0]:
+                    outgoing[source][target] = (cost, node, -1)
+                    incoming[target][source] = (cost, node, -1)
+
+            # remaining edges lead to nodes which are contracted later (higher rank)
+            upward_forward[node] = outgoing[node]
+            upward_backward[node] = incoming[node]
+            for neighbor in outgoing[node]:
+                del incoming[neighbor][node]
+                contracted_neighbors[neighbor] += 1
+                levels[neighbor] = max(levels[neighbor], levels[node] + 1)
+            for neighbor in incoming[node]:
+                del outgoing[neighbor][node]
+                contracted_neighbors[neighbor] += 1
+                levels[neighbor] = max(levels[neighbor], levels[node] + 1)
+            outgoing[node] = None
+            incoming[node] = None
+            contracted[node] = 1
+            rank[node] = current_rank
+            current_rank += 1
+
+            if feedback is not None and current_rank % 10000 == 0:
+                if feedback.isCanceled():
+                    return None
+                feedback.setProgress(100 * current_rank / node_count)
+
+        hierarchy.header = {'version': cls.FORMAT_VERSION, 'byteorder': sys.byteorder,
+                            'graph_name': topology.graph_name, 'graph_version': topology.graph_version,
+                            'mode': mode, 'criteria': criteria, 'node_count': node_count,
+                            'edge_count': topology.edge_count}
+        hierarchy.arrays['rank'] = rank
+        for prefix, neighbor_name, upward in [('fwd', 'targets', upward_forward),
+                                              ('bwd', 'sources', upward_backward)]:
+            offsets, neighbors = array('q', [0]), array('q')
+            edge_costs, middle, edges = array('d'), array('q'), array('q')
+            for node in range(node_count):
+                for neighbor, (cost, middle_node, edge) in upward[node].items():
+                    neighbors.append(neighbor)
+                    edge_costs.append(cost)
+                    middle.append(middle_node)
+                    edges.append(edge)
+                offsets.append(len(neighbors))
+            hierarchy.arrays[prefix + '_offsets'] = offsets
+            hierarchy.arrays[prefix + '_' + neighbor_name] = neighbors
+            hierarchy.arrays[prefix + '_costs'] = edge_costs
+            hierarchy.arrays[prefix + '_middle'] = middle
+            hierarchy.arrays[prefix + '_edges'] = edges
+        return hierarchy
+
+    def shortcuts(self, node, outgoing, incoming):
+        """
+        :return: list of shortcuts (source, target, cost) required if the node is contracted
+        """
+        shortcuts = []
+        if not outgoing[node] or not incoming[node]:
+            return shortcuts
+        max_outgoing = max([value[0] for value in outgoing[node].values()])
+        for source, (source_cost, _, _) in incoming[node].items():
+            targets = set(outgoing[node].keys())
+            targets.discard(source)
+            if not targets:
+                continue
+            distances = self.witness_search(source, node, source_cost + max_outgoing, targets, outgoing)
+            for target in targets:
+                cost = source_cost + outgoing[node][target][0]
+                if distances.get(target, math.inf) > cost:
+                    shortcuts.append((source, target, cost))
+        return shortcuts
+
+    def witness_search(self, source, excluded_node, max_cost, targets, outgoing):
+        """
+        Limited Dijkstra which ignores the node to be contracted; stops as soon as all targets are settled
+        """
+        distances = {source: 0.0}
+        heap = [(0.0, source)]
+        settled = 0
+        remaining = len(targets)
+        while heap:
+            cost, node = heapq.heappop(heap)
+            if cost > distances[node]:
+                continue
+            if cost > max_cost:
+                break
+            if node in targets:
+                remaining -= 1
+                if remaining == 0:
+                    break
+            settled += 1
+            if settled > self.witness_settle_limit:
+                break
+            for neighbor, (edge_cost, _, _) in outgoing[node].items():
+                if neighbor == excluded_node:
+                    continue
+                next_cost = cost + edge_cost
+                if next_cost < distances.get(neighbor, math.inf):
+                    distances[neighbor] = next_cost
+                    heapq.heappush(heap, (next_cost, neighbor))
+        return distances
+
+    def save(self, file_path):
+        """
+        Writes the hierarchy into a file; arrays are aligned to 8 bytes
+        """
+        header = dict(self.header)
+        header['arrays'] = {}
+        header_size = 4096
+        while True:
+            offset = len(self.MAGIC) + 4 + header_size
+            for name, typecode in self.ARRAYS:
+                header['arrays'][name] = [offset, len(self.arrays[name]), typecode]
+                offset += 8 * len(self.arrays[name])
+            header_bytes = json.dumps(header).encode('utf-8')
+            if len(header_bytes) <= header_size:
+                break
+            header_size *= 2
+
+        temp_file = file_path + '.tmp'
+        with open(temp_file, 'wb') as file:
+            file.write(self.MAGIC)
+            file.write(struct.pack('<I', header_size))
+            file.write(header_bytes.ljust(header_size, b' '))
+            for name, typecode in self.ARRAYS:
+                self.arrays[name].tofile(file)
+        os.replace(temp_file, file_path)
+
+    @classmethod
+    def load(cls, file_path):
+        """
+        Memory-maps a hierarchy file; the arrays are not copied into memory
+        """
+        with open(file_path, 'rb') as file:
+            memory_map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if memory_map[:len(cls.MAGIC)] != cls.MAGIC:
+            memory_map.close()
+            raise ValueError('Not a contraction hierarchy file')
+        header_size = struct.unpack('<I', memory_map[len(cls.MAGIC):len(cls.MAGIC) + 4])[0]
+        start = len(cls.MAGIC) + 4
+        header = json.loads(memory_map[start:start + header_size].decode('utf-8'))
+        if header.get('version') != cls.FORMAT_VERSION or header.get('byteorder') != sys.byteorder:
+            memory_map.close()
+            raise ValueError('Unsupported contraction hierarchy file (version or byte order)')
+
+        hierarchy = cls()
+        hierarchy.header = header
+        hierarchy.mmap = memory_map
+        view = memoryview(memory_map)
+        for name, (offset, count, typecode) in header['arrays'].items():
+            hierarchy.arrays[name] = view[offset:offset + 8 * count].cast(typecode)
+        return hierarchy
+
+    def close(self):
+        if self.mmap is not None:
+            for value in self.arrays.values():
+                value.release()
+            self.arrays = {}
+            self.mmap.close()
+            self.mmap = None
+
+    def matches(self, topology, mode, criteria):
+        """
+        :return: True if the hierarchy has been built for the topology and routing profile
+        """
+        return self.header.get('graph_name') == topology.graph_name and \
+            self.header.get('graph_version') == topology.graph_version and \
+            self.header.get('node_count') == topology.node_count and \
+            self.header.get('edge_count') == topology.edge_count and \
+            self.header.get('mode') == mode and self.header.get('criteria') == criteria
+
+    def query(self, sources, targets):
+        """
+        Bidirectional upward search
+        :param sources: dictionary of source node and initial cost
+        :param targets: dictionary of target node and additional cost
+        :return: tuple of total cost, meeting node, forward and backward search trees (node -> (neighbor, index of
+                 upward edge)); the meeting node is None if there is no path
+        """
+        searches = [(dict(sources), {node: None for node in sources},
+                     [(cost, node) for node, cost in sources.items()],
+                     self.fwd_offsets, self.fwd_targets, self.fwd_costs),
+                    (dict(targets), {node: None for node in targets},
+                     [(cost, node) for node, cost in targets.items()],
+                     self.bwd_offsets, self.bwd_sources, self.bwd_costs)]
+        for search in searches:
+            heapq.heapify(search[2])
+        best_cost, meeting_node = math.inf, None
+
+        while True:
+            forward_top = searches[0][2][0][0] if searches[0][2] else math.inf
+            backward_top = searches[1][2][0][0] if searches[1][2] else math.inf
+            if min(forward_top, backward_top) >= best_cost:
+                break
+            direction = 0 if forward_top <= backward_top else 1
+            distances, tree, heap, offsets, neighbors, costs = searches[direction]
+            other_distances = searches[1 - direction][0]
+
+            cost, node = heapq.heappop(heap)
+            if cost > distances[node]:
+                continue
+            if node in other_distances and cost + other_distances[node] < best_cost:
+                best_cost, meeting_node = cost + other_distances[node], node
+            for index in range(offsets[node], offsets[node + 1]):
+                neighbor = neighbors[index]
+                next_cost = cost + costs[index]
+                if next_cost < distances.get(neighbor, math.inf):
+                    distances[neighbor] = next_cost
+                    tree[neighbor] = (node, index)
+                    heapq.heappush(heap, (next_cost, neighbor))
+        return best_cost, meeting_node, searches[0][1], searches[1][1]
+
+    def distance(self, sources, targets):
+        return self.query(sources, targets)[0]
+
+    def path(self, sources, targets):
+        """
+        :return: tuple of total cost, list of directed edges of the topology, source node and target node; the target
+                 node is None if there is no path
+        """
+        best_cost, meeting_node, forward_tree, backward_tree = self.query(sources, targets)
+        if meeting_node is None:
+            return math.inf, None, None, None
+
+        upward_edges = []
+        node = meeting_node
+        while forward_tree[node] is not None:
+            node, index = forward_tree[node]
+            upward_edges.append(('fwd', index))
+        source_node = node
+        upward_edges.reverse()
+        node = meeting_node
+        while backward_tree[node] is not None:
+            node, index = backward_tree[node]
+            upward_edges.append(('bwd', index))
+        target_node = node
+
+        edges = []
+        for prefix, index in upward_edges:
+            edges.extend(self.unpack(prefix, index))
+        return best_cost, edges, source_node, target_node
+
+    def unpack(self, prefix, index):
+        """
+        Replaces an upward edge (and its shortcuts recursively) by directed edges of the topology
+        """
+        edges = []
+        stack = [(prefix, index)]
+        while stack:
+            prefix, index = stack.pop()
+            middle = self.arrays[prefix + '_middle'][index]
+            if middle < 0:
+                edges.append(self.arrays[prefix + '_edges'][index])
+                continue
+            if prefix == 'fwd':
+                source, target = self.node_of(self.fwd_offsets, index), self.fwd_targets[index]
+            else:
+                source, target = self.bwd_sources[index], self.node_of(self.bwd_offsets, index)
+            # the middle node has been contracted first, therefore both parts are upward edges of the middle node
+            second = self.find(self.fwd_offsets, self.fwd_targets, middle, target)
+            first = self.find(self.bwd_offsets, self.bwd_sources, middle, source)
+            stack.append(('fwd', second))
+            stack.append(('bwd', first))
+        return edges
+
+    @staticmethod
+    def find(offsets, neighbors, node, neighbor):
+        for index in range(offsets[node], offsets[node + 1]):
+            if neighbors[index] == neighbor:
+                return index
+        raise ValueError('Inconsistent contraction hierarchy')
+
+    @staticmethod
+    def node_of(offsets, index):
+        """
+        :return: node of an upward edge (binary search in the CSR offsets)
+        """
+        low, high = 0, len(offsets) - 2
+        while low < high:
+            mid = (low + high + 1) // 2
+            if offsets[mid] <= index:
+                low = mid
+            else:
+                high = mid - 1
+        return low
+
+
+class ContractionHierarchyRoutingEngine(RoutingEngine):
+    """
+    Routing engine which answers queries with a contraction hierarchy; the hierarchy determines routing mode and
+    criteria
+    """
+
+    def __init__(self, topology, hierarchy):
+        super(ContractionHierarchyRoutingEngine, self).__init__(topology)
+        self.hierarchy = hierarchy
+
+    def find_path(self, sources, targets, mode, criteria):
+        if not self.hierarchy.matches(self.topology, mode, criteria):
+            raise ValueError('Contraction hierarchy does not match graph version or routing profile')
+        return self.hierarchy.path(sources, targets)
+
+
+class ContractionHierarchyCache:
+    """
+    Keeps hierarchy files memory-mapped, therefore repeated queries do not open the files again
+    """
+
+    entries = {}
+
+    @classmethod
+    def get(cls, file_path):
+        stat = os.stat(file_path)
+        key = os.path.abspath(file_path)
+        entry = cls.entries.get(key)
+        if entry is not None:
+            if entry[0] == (stat.st_size, stat.st_mtime):
+                return entry[1]
+            entry[1].close()
+        hierarchy = ContractionHierarchy.load(file_path)
+        cls.entries[key] = ((stat.st_size, stat.st_mtime), hierarchy)
+        return hierarchy
+
+
+def build_file(graph_file, mode, criteria, output_directory):
+    """
+    Builds and saves the hierarchy of a graph file; used as function of worker processes. A saved topology file of the
+    graph file is memory-mapped instead of parsing the graph file.
+    :return: path of the hierarchy file
+    """
+    topology = GraphTopologyCache.get(graph_file)
+    hierarchy = ContractionHierarchy.build(topology, mode, criteria)
+    file_path = os.path.join(output_directory, ContractionHierarchy.file_name(topology.graph_name,
+                                                                              topology.graph_version, mode, criteria))
+    hierarchy.save(file_path)
+    return file_path
@@ -1,4 +1,5 @@
-from qgis.core import (QgsProject, QgsDistanceArea, QgsPointXY, QgsGeometryUtils)
+from qgis.core import (QgsProject, QgsDistanceArea, QgsPointXY, QgsGeometryUtils, QgsCoordinateTransform,
+                       QgsCoordinateReferenceSystem)
 import datetime
 
 
@@ -43,3 +44,26 @@ class GeomTools:
     @staticmethod
     def calculate_angle(point_a, point_b):
         return QgsGeometryUtils.lineAngle(point_a.x(), point_a.y(), point_b.x(), point_b.y())
+
+    @staticmethod
+    def read_points_wgs84(source, id_field=None, transform_context=None, value_fields=None):
+        """
+        Reads the points of a feature source in WGS84; the centroid is used for other geometry types
+        :param id_field: name of the ID field; feature IDs are used if None
+        :param value_fields: optional list of field names whose values are appended to the tuples
+        :return: list of tuples (ID, x, y); x and y are None for features without geometry
+        """
+        transform = QgsCoordinateTransform(source.sourceCrs(), QgsCoordinateReferenceSystem(4326),
+                                           transform_context if transform_context is not None
+                                           else QgsProject.instance().transformContext())
+        points = []
+        for feature in source.getFeatures():
+            feature_id = feature[id_field] if id_field else feature.id()
+            values = tuple(feature[field] for field in value_fields) if value_fields else ()
+            geometry = feature.geometry()
+            if geometry is None or geometry.isEmpty():
+                points.append((feature_id, None, None) + values)
+                continue
+            point = transform.transform(geometry.centroid().asPoint())
+            points.append((feature_id, point.x(), point.y()) + values)
+        return points
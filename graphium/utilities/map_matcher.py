@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ QGIS plugin 'Graphium'
+/***************************************************************************
+ *
+ * Copyright 2020 Simon Gröchenig @ Salzburg Research
+ * eMail     graphium@salzburgresearch.at
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ *
+ ***************************************************************************/
+"""
+
+import math
+# plugin
+from .travel_matrix import engine_of
+from ..graph_data.graph_topology import haversine
+
+# Local map matching on graph files based on a hidden markov model. This module must not import qgis, because tracks
+# are matched in worker processes.
+
+
+class HmmMapMatcher:
+    """
+    Matches a track to the segments of a graph (Newson & Krumm, 2009). Candidates of a track point are the nearest
+    accessible positions on segments within the search radius. Emission probabilities depend on the distance between
+    track point and candidate (normal distribution with standard deviation sigma), transition probabilities on the
+    difference between route length and great circle distance of consecutive track points (exponential distribution
+    with parameter beta). The most likely sequence of candidates is found with the Viterbi algorithm. If no candidate
+    of a track point can be reached from the previous track point, the track is split and matching continues with a new
+    part.
+    """
+
+    def __init__(self, engine, mode='CAR', sigma=10.0, beta=50.0, search_radius=50.0, max_candidates=5,
+                 max_route_factor=2.0):
+        self.engine = engine
+        self.topology = engine.topology
+        self.index = engine.topology.spatial_index()
+        self.mode = mode
+        self.sigma = sigma
+        self.beta = beta
+        self.search_radius = search_radius
+        self.max_candidates = max_candidates
+        self.max_route_factor = max_route_factor
+        self.searches = 0
+
+    def candidates(self, x, y):
+        """
+        :return: list of tuples (segment index, fraction of length, distance in meters, direction of travel); a segment
+                 accessible in both directions results in two candidates
+        """
+        engine, mode = self.engine, self.mode
+
+        def accessible(s):
+            return engine.is_accessible(s, True, mode) or engine.is_accessible(s, False, mode)
+
+        return [(segment, fraction, distance, forward)
+                for segment, fraction, distance in self.index.nearest(x, y, self.max_candidates, accessible,
+                                                                      self.search_radius)
+                for forward in (True, False) if engine.is_accessible(segment, forward, mode)]
+
+    def emission(self, distance):
+        return -0.5 * (distance / self.sigma) ** 2
+
+    def transition(self, route_length, distance):
+        return -abs(route_length - distance) / self.beta
+
+    def route_lengths(self, sources, targets, distance):
+        """
+        Calculates the lengths of the routes between all pairs of candidates with one bounded search per source
+        :return: matrix of route lengths (math.inf if there is no route)
+        """
+        engine, mode = self.engine, self.mode
+        max_cost = self.max_route_factor * (distance + 2 * self.search_radius)
+        entries = [engine.position_values(segment, fraction, mode, 'LENGTH', leave=False, direction=forward)
+                   for segment, fraction, _, forward in targets]
+        target_nodes = set()
+        for entry in entries:
+            target_nodes.update(entry.keys())
+
+        lengths = []
+        for segment, fraction, _, forward in sources:
+            tree = engine.tree(engine.position_values(segment, fraction, mode, 'LENGTH', direction=forward), mode,
+                               'LENGTH', target_nodes, max_cost)
+            self.searches += 1
+            row = []
+            for (target_segment, target_fraction, _, target_forward), entry in zip(targets, entries):
+                length = min([tree[node][0] + value[0] for node, value in entry.items() if node in tree],
+                             default=math.inf)
+                # both positions on the same segment in direction of travel
+                if target_segment == segment and target_forward == forward and \
+                        (target_fraction - fraction) * (1 if forward else -1) >= 0:
+                    length = min(length, abs(target_fraction - fraction) *
+                                 engine.segment_cost(segment, forward, mode, 'LENGTH'))
+                row.append(length)
+            lengths.append(row)
+        return lengths
+
+    def viterbi(self, points, candidates):
+        """
+        :return: list of parts of the track; a part is a list of tuples (point index, candidate)
+        """
+        parts = []
+        steps = []
+        for i, candidate_list in enumerate(candidates):
+            if not candidate_list:
+                continue
+            emissions = [self.emission(candidate[2]) for candidate in candidate_list]
+            scores, back_pointers = emissions, [-1] * len(candidate_list)
+            if steps:
+                previous_index, previous_candidates, previous_scores, _ = steps[-1]
+                distance = haversine(points[previous_index][0], points[previous_index][1], points[i][0], points[i][1])
+                # track points close to the previous one do not add information, except the last one
+                if distance < 2 * self.sigma and i < len(candidates) - 1:
+                    continue
+                lengths = self.route_lengths(previous_candidates, candidate_list, distance)
+                scores, back_pointers = [], []
+                for j, emission in enumerate(emissions):
+                    best_score, best_k = -math.inf, -1
+                    for k, previous_score in enumerate(previous_scores):
+                        if previous_score == -math.inf or lengths[k][j] == math.inf:
+                            continue
+                        score = previous_score + self.transition(lengths[k][j], distance)
+                        if score > best_score:
+                            best_score, best_k = score, k
+                    scores.append(best_score + emission)
+                    back_pointers.append(best_k)
+                if all(score == -math.inf for score in scores):
+                    # no candidate is reachable: the track is split
+                    parts.append(self.backtrack(steps))
+                    steps = []
+                    scores, back_pointers = emissions, [-1] * len(candidate_list)
+            steps.append((i, candidate_list, scores, back_pointers))
+        if steps:
+            parts.append(self.backtrack(steps))
+        return parts
+
+    @staticmethod
+    def backtrack(steps):
+        scores = steps[-1][2]
+        k = max(range(len(scores)), key=lambda c: scores[c])
+        part = []
+        for i, candidate_list, _, back_pointers in reversed(steps):
+            part.append((i, candidate_list[k]))
+            k = back_pointers[k]
+        part.reverse()
+        return part
+
+    def match(self, points):
+        """
+        Matches a track
+        :param points: list of WGS84 coordinates (x, y) of the track points
+        :return: dictionary in the format of the map matching response of the Graphium server; start and end point
+                 index of a matched segment are inclusive, segments found by path searches refer to the index of the
+                 previous matched track point
+        """
+        self.searches = 0
+        parts = self.viterbi(points, [self.candidates(x, y) for x, y in points])
+
+        result = MatchResult(self)
+        for part_number, part in enumerate(parts):
+            point_index, (segment, _, distance, forward) = part[0]
+            result.open(segment, forward, point_index, entering=False, start_segment=part_number == 0,
+                        after_skipped_part=part_number > 0)
+            result.add_point(point_index, distance)
+            for (previous_index, previous), (point_index, current) in zip(part, part[1:]):
+                pieces = self.engine.route_pieces(previous[0], previous[1], current[0], current[1], self.mode,
+                                                  'LENGTH', previous[3], current[3])
+                self.searches += 1
+                if pieces is None:
+                    continue
+                result.add_length(pieces)
+                if len(pieces) > 1:
+                    result.leave()
+                    for segment, forward, _, _ in pieces[1:-1]:
+                        result.open(segment, forward, previous_index, from_path_search=True)
+                        result.leave()
+                    result.open(current[0], current[3], point_index)
+                result.add_point(point_index, current[2])
+        return result.response(len(points), sum(part[-1][0] - part[0][0] + 1 for part in parts))
+
+
+class MatchResult:
+    """
+    Collects the matched segments of a track in the format of the map matching response of the Graphium server
+    """
+
+    def __init__(self, matcher):
+        self.matcher = matcher
+        self.topology = matcher.topology
+        self.segments = []
+        self.directions = []
+        self.distances = []
+        self.u_turns = 0
+        self.length = 0.0
+
+    def open(self, segment, forward, point_index, entering=True, start_segment=False, after_skipped_part=False,
+             from_path_search=False):
+        # the same segment again in opposite direction
+        u_turn = len(self.segments) > 0 and self.segments[-1]['segmentId'] == self.topology.segment_ids[segment]
+        if u_turn:
+            self.u_turns += 1
+        self.segments.append({
+            'segmentId': self.topology.segment_ids[segment],
+            'startPointIndex': point_index,
+            'endPointIndex': point_index,
+            'enteringThroughStartNode': entering and forward,
+            'leavingThroughStartNode': False,
+            'enteringThroughEndNode': entering and not forward,
+            'leavingThroughEndNode': False,
+            'startSegment': start_segment,
+            'afterSkippedPart': after_skipped_part,
+            'fromPathSearch': from_path_search,
+            'uTurnSegment': u_turn,
+            'weight': 0.0,
+            'matchedFactor': 0.0,
+            'geometry': 'LINESTRING (' + ', '.join([str(x) + ' ' + str(y) for x, y in
+                                                    self.topology.segment_coordinates(segment)]) + ')'
+        })
+        self.directions.append(forward)
+        self.distances.append([])
+
+    def add_point(self, point_index, distance):
+        self.segments[-1]['endPointIndex'] = point_index
+        self.distances[-1].append(distance)
+
+    def leave(self):
+        self.segments[-1]['leavingThroughEndNode'] = self.directions[-1]
+        self.segments[-1]['leavingThroughStartNode'] = not self.directions[-1]
+
+    def add_length(self, pieces):
+        lengths = self.topology.lengths
+        self.length += sum(abs(to_fraction - from_fraction) * lengths[segment]
+                           for segment, _, from_fraction, to_fraction in pieces)
+
+    def response(self, points_count, matched_points):
+        search_radius = self.matcher.search_radius
+        for segment, distances in zip(self.segments, self.distances):
+            if distances:
+                # weight is the mean distance of the matched track points, the matched factor its relation to the
+                # search radius
+                segment['weight'] = round(sum(distances) / len(distances), 2)
+                segment['matchedFactor'] = round(max(0.0, 1 - segment['weight'] / search_radius), 3)
+        return {
+            'segments': self.segments,
+            'nrOfUTurns': self.u_turns,
+            'nrOfShortestPathSearches': self.matcher.searches,
+            'length': round(self.length, 2),
+            'matchedFactor': round(matched_points / points_count, 3) if points_count > 0 else 0.0,
+            'matchedPoints': matched_points,
+            'certainPathEndSegmentId': self.segments[-1]['segmentId'] if self.segments else None
+        }
+
+
+def match_tracks(graph_file, tracks, mode, sigma, search_radius, max_candidates):
+    """
+    Matches a batch of tracks
+    :param tracks: list of tuples (track ID, list of WGS84 coordinates (x, y))
+    :return: list of tuples (track ID, map matching response)
+    """
+    matcher = HmmMapMatcher(engine_of(graph_file), mode, sigma, 5 * sigma, search_radius, max_candidates)
+    return [(track_id, matcher.match(points)) for track_id, points in tracks]
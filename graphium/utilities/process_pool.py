@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ QGIS plugin 'Graphium'
+/***************************************************************************
+ *
+ * Copyright 2020 Simon Gröchenig @ Salzburg Research
+ * eMail     graphium@salzburgresearch.at
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ *
+ ***************************************************************************/
+"""
+
+import os
+import sys
+import multiprocessing
+from concurrent.futures import (ProcessPoolExecutor, Future)
+
+
+class ProcessPool:
+    """
+    Runs functions in worker processes. Inside QGIS sys.executable is not necessarily a Python interpreter, therefore
+    the workers are spawned with the Python interpreter of the QGIS installation. If no interpreter can be found or
+    only one worker is requested, functions are executed in the current process. Functions and arguments have to be
+    picklable and must not depend on qgis modules.
+    """
+
+    def __init__(self, max_workers=0):
+        """
+        :param max_workers: number of worker processes; 0 for the number of CPUs minus one
+        """
+        self.max_workers = max_workers if max_workers > 0 else max(1, (os.cpu_count() or 1) - 1)
+        self.executor = None
+
+        executable = self.python_executable()
+        if self.max_workers > 1 and executable is not None:
+            try:
+                context = multiprocessing.get_context('spawn')
+                context.set_executable(executable)
+                self.executor = ProcessPoolExecutor(self.max_workers, mp_context=context)
+            except (OSError, ValueError, NotImplementedError):
+                self.executor = None
+
+    @staticmethod
+    def python_executable():
+        """
+        :return: path of the Python interpreter or None
+        """
+        if os.path.basename(sys.executable).lower().startswith('python'):
+            return sys.executable
+        candidates = [os.path.join(sys.exec_prefix, 'python.exe'),
+                      os.path.join(sys.exec_prefix, 'bin', 'python' + str(sys.version_info[0]) + '.' +
+                                   str(sys.version_info[1])),
+                      os.path.join(sys.exec_prefix, 'bin', 'python3')]
+        for candidate in candidates:
+            if os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+                return candidate
+        return None
+
+    def is_parallel(self):
+        return self.executor is not None
+
+    def submit(self, function, *args):
+        """
+        :return: concurrent.futures.Future
+        """
+        if self.executor is not None:
+            return self.executor.submit(function, *args)
+
+        future = Future()
+        try:
+            future.set_result(function(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def shutdown(self, cancel_futures=False):
+        if self.executor is not None:
+            if cancel_futures:
+                self.executor.shutdown(wait=False)
+                for process in list(getattr(self.executor, '_processes', {}).values()):
+                    process.terminate()
+            else:
+                self.executor.shutdown(wait=True)
+            self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown(exc_type is not None)
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ QGIS plugin 'Graphium'
+/***************************************************************************
+ *
+ * Copyright 2020 Simon Gröchenig @ Salzburg Research
+ * eMail     graphium@salzburgresearch.at
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ *
+ ***************************************************************************/
+"""
+
+import os
+import json
+import time
+import hashlib
+from urllib.parse import urljoin
+
+
+class ResumableUpload:
+    """
+    Uploads a file in chunks of fixed size. The protocol follows common resumable upload APIs:
+     - POST to the upload URL with query item 'uploadType=resumable' and header 'X-Upload-Content-Length' starts an
+       upload session; the URL of the session (absolute or relative to the upload URL) is returned in the 'Location'
+       header
+     - every chunk is sent as PUT to the session URL with a 'Content-Range' header; the server acknowledges the
+       received bytes with status 308 and a 'Range' header and answers the last chunk with 200 / 201
+     - PUT with 'Content-Range: bytes */<size>' and an empty body requests the number of received bytes
+    Failed chunks are retried with exponential backoff. The session is persisted in a state file in the state
+    directory, therefore an interrupted upload continues with the first missing byte.
+
+    This module must not import qgis; requests are sent by a function with the signature
+    send(method, url, data, headers) which returns a dict with 'status' (None if no HTTP response has been received),
+    'headers' (lower case names), 'content' (bytes) and 'error' (message of network errors).
+    """
+
+    def __init__(self, send, state_directory, feedback=None, chunk_size=8 * 1024 * 1024, max_retries=5,
+                 backoff_sec=1, max_backoff_sec=60):
+        """
+        :param send: function sending a single request (see class documentation)
+        :param state_directory: directory of the upload state files (e.g. in the QGIS profile)
+        """
+        self.send = send
+        self.state_directory = state_directory
+        self.feedback = feedback
+        self.chunk_size = max(1, int(chunk_size))
+        self.max_retries = max(0, int(max_retries))
+        self.backoff_sec = backoff_sec
+        self.max_backoff_sec = max_backoff_sec
+
+    def upload(self, url, file_path):
+        """
+        Uploads or continues to upload a file
+        :param url: upload URL including query items
+        :return: response of the last chunk, error message in json format or None if the server does not support
+                 resumable uploads
+        """
+        size = os.path.getsize(file_path)
+        state_file = self.state_file(url, file_path)
+
+        state = self.read_state(state_file, url, file_path, size)
+        offset = 0
+        if state is not None:
+            kind, value = self.query_offset(state['session_url'], size)
+            if kind == 'offset':
+                offset = value
+                self.report_info('Continue upload at byte ' + str(offset) + ' of ' + str(size))
+            elif kind == 'done':
+                self.remove_state(state_file)
+                return value
+            else:
+                # the session has expired or cannot be queried
+                state = None
+
+        if state is None:
+            kind, value = self.start_session(url, size)
+            if kind == 'unsupported':
+                return None
+            elif kind == 'error':
+                return value
+            state = {'url': url, 'file': os.path.abspath(file_path), 'session_url': value, 'size': size,
+                     'mtime': os.path.getmtime(file_path)}
+            self.write_state(state_file, state)
+
+        with open(file_path, 'rb') as f:
+            while True:
+                if self.is_canceled():
+                    return {"error": {"msg": "Upload canceled"}}
+
+                f.seek(offset)
+                chunk = f.read(self.chunk_size)
+                kind, value = self.send_chunk_with_retry(state['session_url'], offset, chunk, size)
+                if kind == 'offset':
+                    if value <= offset:
+                        # no progress (e.g. all bytes have been received but the server did not finish the upload)
+                        return {"error": {"msg": "Server did not accept data at byte " + str(offset)}}
+                    offset = value
+                    if self.feedback is not None and size > 0:
+                        self.feedback.setProgress(100 * offset / size)
+                elif kind == 'done':
+                    self.remove_state(state_file)
+                    return value
+                elif kind == 'expired':
+                    self.remove_state(state_file)
+                    return {"error": {"msg": "Upload session has expired"}}
+                else:
+                    return value
+
+    def start_session(self, url, size):
+        self.report_info('POST ' + url)
+        response = self.send('POST', url + ('&' if '?' in url else '?') + 'uploadType=resumable', b'', {
+            'X-Upload-Content-Length': str(size),
+            'Content-Type': 'application/json'
+        })
+
+        if response['status'] is None:
+            return 'error', {"error": {"msg": response['error']}}
+        elif response['status'] in (401, 403):
+            return 'error', {"error": {"msg": str(response['status']) + ' AuthenticationRequiredError'}}
+        elif response['status'] in (200, 201) and response['headers'].get('location'):
+            # the session URL may be relative to the upload URL
+            return 'session', urljoin(url, response['headers']['location'])
+        return 'unsupported', None
+
+    def send_chunk_with_retry(self, session_url, offset, chunk, size):
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                backoff = min(self.backoff_sec * 2 ** (attempt - 1), self.max_backoff_sec)
+                self.report_info('Retry chunk at byte ' + str(offset) + ' in ' + str(backoff) + ' s (attempt ' +
+                                 str(attempt) + ' of ' + str(self.max_retries) + ')')
+                if not self.wait(backoff):
+                    return 'error', {"error": {"msg": "Upload canceled"}}
+                # the chunk could have been received although the response got lost
+                kind, value = self.query_offset(session_url, size)
+                if kind == 'offset' and value != offset:
+                    return kind, value
+                elif kind in ('done', 'expired', 'error'):
+                    return kind, value
+
+            kind, value = self.send_chunk(session_url, offset, chunk, size)
+            if kind != 'retry':
+                return kind, value
+
+        return 'error', {"error": {"msg": "Upload of chunk at byte " + str(offset) + " failed after " +
+                                          str(self.max_retries) + " retries"}}
+
+    def send_chunk(self, session_url, offset, chunk, size):
+        if len(chunk) > 0:
+            content_range = 'bytes ' + str(offset) + '-' + str(offset + len(chunk) - 1) + '/' + str(size)
+        else:
+            content_range = 'bytes */' + str(size)
+        response = self.send('PUT', session_url, chunk, {
+            'Content-Range': content_range,
+            'Content-Type': 'application/octet-stream'
+        })
+        return self.evaluate_response(response)
+
+    def query_offset(self, session_url, size):
+        response = self.send('PUT', session_url, b'', {
+            'Content-Range': 'bytes */' + str(size)
+        })
+        return self.evaluate_response(response)
+
+    @classmethod
+    def evaluate_response(cls, response):
+        """
+        :return: tuple (kind, value) with kind 'offset' (value: number of received bytes), 'done' (value: parsed
+                 response), 'retry', 'expired' or 'error' (value: error message in json format)
+        """
+        status = response['status']
+        if status is None or status == 429 or status >= 500:
+            return 'retry', None
+        elif status == 308:
+            return 'offset', cls.parse_range(response['headers'].get('range'))
+        elif status in (200, 201):
+            content = response['content'].decode('utf-8')
+            try:
+                return 'done', json.loads(content) if len(content) > 0 else {}
+            except json.JSONDecodeError as e:
+                return 'error', {"error": {"msg": "JSON Decode Error from position " + str(e.pos)}}
+        elif status in (404, 410):
+            return 'expired', None
+        return 'error', {"error": {"msg": str(status) + ' ' + response['content'].decode('utf-8', 'replace')}}
+
+    @staticmethod
+    def parse_range(range_header):
+        """
+        :param range_header: e.g. 'bytes=0-1048575'
+        :return: number of received bytes
+        """
+        if not range_header or '-' not in range_header:
+            return 0
+        try:
+            return int(range_header.split('-')[-1]) + 1
+        except ValueError:
+            return 0
+
+    def wait(self, seconds):
+        end = time.time() + seconds
+        while time.time() < end:
+            if self.is_canceled():
+                return False
+            time.sleep(min(0.1, max(0, end - time.time())))
+        return True
+
+    def is_canceled(self):
+        return self.feedback is not None and self.feedback.isCanceled()
+
+    def report_info(self, message):
+        if self.feedback is not None:
+            self.feedback.pushInfo(message)
+
+    def state_file(self, url, file_path):
+        """
+        :return: path of the state file of an upload of the file to the URL
+        """
+        key = hashlib.sha256((os.path.abspath(file_path) + '\n' + url).encode('utf-8')).hexdigest()
+        return os.path.join(self.state_directory, key + '.json')
+
+    @staticmethod
+    def read_state(state_file, url, file_path, size):
+        try:
+            with open(state_file, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # the state is only valid for the same file and target
+        if not isinstance(state, dict) or state.get('url') != url or \
+                state.get('file') != os.path.abspath(file_path) or state.get('size') != size or \
+                state.get('mtime') != os.path.getmtime(file_path) or 'session_url' not in state:
+            return None
+        return state
+
+    def write_state(self, state_file, state):
+        try:
+            os.makedirs(self.state_directory, exist_ok=True)
+            with open(state_file, 'w', encoding='utf-8') as f:
+                json.dump(state, f)
+        except OSError:
+            self.report_info('Cannot save upload state; an interrupted upload cannot be continued')
+
+    @staticmethod
+    def remove_state(state_file):
+        if os.path.isfile(state_file):
+            os.remove(state_file)
@@ -0,0 +1,466 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ QGIS plugin 'Graphium'
+/***************************************************************************
+ *
+ * Copyright 2020 Simon Gröchenig @ Salzburg Research
+ * eMail     graphium@salzburgresearch.at
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ *
+ ***************************************************************************/
+"""
+
+import math
+import time
+import heapq
+from array import array
+# plugin
+from ..graph_data.graph_topology import haversine
+from ..graph_management.model.access import Access
+
+# Local routing on a GraphTopology. This module must not import qgis, because routes are calculated in worker
+# processes.
+
+
+class RoutingEngine:
+    """
+    Calculates routes on the topology of a graph version with Dijkstra or A* (if a heuristic is available). Routing
+    modes and criteria are the same as the ones of the Graphium routing API:
+     - modes CAR, BIKE, PEDESTRIAN and PEDESTRIAN_BARRIERFREE select the access type of the segments
+     - criteria LENGTH, MIN_DURATION (maximum speed) and CURRENT_DURATION (calculated speed, e.g. derived from
+       traffic data; falls back to the maximum speed)
+    Start and end coordinates are snapped to the nearest accessible segment; the route starts and ends at the snapped
+    positions.
+    """
+
+    MODES = ('CAR', 'BIKE', 'PEDESTRIAN', 'PEDESTRIAN_BARRIERFREE')
+    CRITERIA = ('LENGTH', 'MIN_DURATION', 'CURRENT_DURATION')
+
+    # access type and speed in km/h per routing mode; the speed of cars is the speed of the segment
+    MODE_ACCESS = {'CAR': Access.PRIVATE_CAR, 'BIKE': Access.BIKE, 'PEDESTRIAN': Access.PEDESTRIAN,
+                   'PEDESTRIAN_BARRIERFREE': Access.PEDESTRIAN}
+    MODE_SPEED = {'BIKE': 15.0, 'PEDESTRIAN': 5.0, 'PEDESTRIAN_BARRIERFREE': 4.0}
+    DEFAULT_CAR_SPEED = 50.0
+
+    def __init__(self, topology):
+        self.topology = topology
+        self.costs = {}
+        self.max_speeds = {}
+
+    def is_accessible(self, segment, forward, mode):
+        mask = 1 << self.MODE_ACCESS[mode].value
+        return bool((self.topology.access_tow if forward else self.topology.access_bkw)[segment] & mask)
+
+    def speed(self, segment, forward, mode, criteria):
+        """
+        :return: speed in km/h of a segment in the given direction
+        """
+        topology = self.topology
+        max_speed = (topology.max_speeds_tow if forward else topology.max_speeds_bkw)[segment]
+        if mode != 'CAR':
+            return min(self.MODE_SPEED[mode], max_speed) if max_speed > 0 else self.MODE_SPEED[mode]
+        if criteria == 'CURRENT_DURATION':
+            calc_speed = (topology.calc_speeds_tow if forward else topology.calc_speeds_bkw)[segment]
+            if calc_speed > 0:
+                return calc_speed
+        return max_speed if max_speed > 0 else self.DEFAULT_CAR_SPEED
+
+    def segment_cost(self, segment, forward, mode, criteria):
+        """
+        :return: cost to traverse the whole segment (meters or seconds); infinity if the segment is not accessible
+        """
+        if not self.is_accessible(segment, forward, mode):
+            return math.inf
+        if criteria == 'LENGTH':
+            return self.topology.lengths[segment]
+        return self.topology.lengths[segment] * 3.6 / self.speed(segment, forward, mode, criteria)
+
+    def edge_costs(self, mode, criteria):
+        """
+        :return: array of costs per directed edge; calculated once per routing mode and criteria
+        """
+        key = (mode, criteria)
+        if key not in self.costs:
+            topology = self.topology
+            costs = array('d', [math.inf]) * topology.edge_count
+            max_speed = 0.0
+            for e in range(topology.edge_count):
+                segment = topology.edge_segments[e]
+                forward = topology.edge_forward[e] == 1
+                costs[e] = self.segment_cost(segment, forward, mode, criteria)
+                if costs[e] < math.inf and criteria != 'LENGTH':
+                    max_speed = max(max_speed, self.speed(segment, forward, mode, criteria))
+            self.costs[key] = costs
+            self.max_speeds[key] = max_speed
+        return self.costs[key]
+
+    def edge_durations(self, mode, criteria):
+        """
+        :return: array of travel times in seconds per directed edge; the maximum speed is used for criteria LENGTH
+        """
+        key = ('duration', mode, criteria)
+        if key not in self.costs:
+            if criteria == 'LENGTH':
+                self.costs[key] = self.edge_durations(mode, 'MIN_DURATION')
+            else:
+                self.costs[key] = self.edge_costs(mode, criteria)
+        return self.costs[key]
+
+    def position_values(self, segment, fraction, mode, criteria, leave=True, direction=None):
+        """
+        Costs, lengths and durations between a position on a segment and the nodes of the segment
+        :param leave: True if the nodes are reached from the position, False if the position is reached from the nodes
+        :param direction: optional direction of travel on the segment; both directions if None
+        :return: dictionary of node and tuple (cost, length, duration, direction of the segment)
+        """
+        topology = self.topology
+        duration_criteria = 'MIN_DURATION' if criteria == 'LENGTH' else criteria
+        values = {}
+        if leave:
+            parts = [(True, topology.end_nodes[segment], 1 - fraction),
+                     (False, topology.start_nodes[segment], fraction)]
+        else:
+            parts = [(True, topology.start_nodes[segment], fraction),
+                     (False, topology.end_nodes[segment], 1 - fraction)]
+        for forward, node, part in parts:
+            if direction is not None and forward != direction:
+                continue
+            cost = part * self.segment_cost(segment, forward, mode, criteria)
+            if cost < values.get(node, (math.inf,))[0]:
+                values[node] = (cost, part * topology.lengths[segment],
+                                part * self.segment_cost(segment, forward, mode, duration_criteria), forward)
+        return {node: value for node, value in values.items() if value[0] < math.inf}
+
+    def tree(self, sources, mode, criteria, target_nodes=None, max_cost=math.inf):
+        """
+        One-to-all Dijkstra which keeps length and duration of the best path per node
+        :param sources: dictionary of source node and tuple (cost, length, duration)
+        :param target_nodes: optional set of nodes; the search stops as soon as all of them are settled
+        :param max_cost: nodes with higher costs are not visited
+        :return: dictionary of settled node and tuple (cost, length, duration)
+        """
+        topology = self.topology
+        edge_offsets = topology.edge_offsets
+        edge_targets = topology.edge_targets
+        edge_segments = topology.edge_segments
+        lengths = topology.lengths
+        costs = self.edge_costs(mode, criteria)
+        durations = self.edge_durations(mode, criteria)
+
+        values = {node: value[:3] for node, value in sources.items()}
+        heap = [(value[0], node) for node, value in values.items()]
+        heapq.heapify(heap)
+        settled = {}
+        remaining = len(target_nodes) if target_nodes is not None else -1
+        while heap:
+            cost, node = heapq.heappop(heap)
+            if node in settled:
+                continue
+            settled[node] = values[node]
+            if target_nodes is not None and node in target_nodes:
+                remaining -= 1
+                if remaining == 0:
+                    break
+            _, length, duration = values[node]
+            for e in range(edge_offsets[node], edge_offsets[node + 1]):
+                next_cost = cost + costs[e]
+                if next_cost > max_cost:
+                    continue
+                next_node = edge_targets[e]
+                if next_node not in settled and next_cost < values.get(next_node, (math.inf,))[0]:
+                    values[next_node] = (next_cost, length + lengths[edge_segments[e]], duration + durations[e])
+                    heapq.heappush(heap, (next_cost, next_node))
+        return settled
+
+    def one_to_many(self, source, targets, mode, criteria):
+        """
+        Calculates the best paths from one position to several positions with one search
+        :param source: tuple of segment index and fraction of length along the segment
+        :param targets: list of tuples of segment index and fraction of length (or None for unknown positions)
+        :return: list of tuples (cost, length, duration) per target; None if a target cannot be reached
+        """
+        sources = self.position_values(source[0], source[1], mode, criteria, True)
+        target_values = [self.position_values(target[0], target[1], mode, criteria, False)
+                         if target is not None else {} for target in targets]
+        target_nodes = set()
+        for values in target_values:
+            target_nodes.update(values.keys())
+        settled = self.tree(sources, mode, criteria, target_nodes) if sources else {}
+
+        results = []
+        for target, values in zip(targets, target_values):
+            best = None
+            for node, (cost, length, duration, _) in values.items():
+                if node in settled and (best is None or settled[node][0] + cost < best[0]):
+                    best = (settled[node][0] + cost, settled[node][1] + length, settled[node][2] + duration)
+            # both positions on the same segment
+            if target is not None and target[0] == source[0]:
+                forward = target[1] >= source[1]
+                part = abs(target[1] - source[1])
+                cost = part * self.segment_cost(source[0], forward, mode, criteria)
+                if cost < math.inf and (best is None or cost < best[0]):
+                    best = (cost, part * self.topology.lengths[source[0]],
+                            part * self.segment_cost(source[0], forward, mode,
+                                                     'MIN_DURATION' if criteria == 'LENGTH' else criteria))
+            results.append(best)
+        return results
+
+    def heuristic(self, mode, criteria, target_nodes):
+        """
+        :return: admissible A* heuristic (straight line distance to the nearest target node)
+        """
+        topology = self.topology
+        targets = [(topology.node_x[n], topology.node_y[n]) for n in target_nodes]
+        if criteria == 'LENGTH':
+            factor = 0.99
+        elif self.max_speeds.get((mode, criteria), 0) > 0:
+            factor = 0.99 * 3.6 / self.max_speeds[(mode, criteria)]
+        else:
+            return None
+
+        def estimate(node):
+            x, y = topology.node_x[node], topology.node_y[node]
+            return factor * min([haversine(x, y, tx, ty) for tx, ty in targets])
+        return estimate
+
+    def search(self, sources, costs, targets=None, max_cost=math.inf, heuristic=None):
+        """
+        Dijkstra (or A* if a heuristic is given) from one or more source nodes
+        :param sources: dictionary of source node and initial cost
+        :param costs: array of costs per directed edge
+        :param targets: optional dictionary of target node and additional cost; the search stops as soon as the best
+                        target is known
+        :param max_cost: nodes with higher costs are not visited
+        :return: tuple of costs (dictionary node -> cost), predecessor edges (dictionary node -> edge or -1 for sources),
+                 best target node and its total cost
+        """
+        edge_offsets = self.topology.edge_offsets
+        edge_targets = self.topology.edge_targets
+        distances = dict(sources)
+        predecessors = {node: -1 for node in sources}
+        heap = [(cost + (heuristic(node) if heuristic else 0), cost, node) for node, cost in sources.items()]
+        heapq.heapify(heap)
+        settled = set()
+        best_node, best_cost = None, math.inf
+
+        while heap:
+            estimate, cost, node = heapq.heappop(heap)
+            if estimate >= best_cost:
+                break
+            if node in settled:
+                continue
+            settled.add(node)
+            if targets is not None and node in targets and cost + targets[node] < best_cost:
+                best_node, best_cost = node, cost + targets[node]
+            for e in range(edge_offsets[node], edge_offsets[node + 1]):
+                next_cost = cost + costs[e]
+                if next_cost > max_cost:
+                    continue
+                next_node = edge_targets[e]
+                if next_cost < distances.get(next_node, math.inf):
+                    distances[next_node] = next_cost
+                    predecessors[next_node] = e
+                    heapq.heappush(heap, (next_cost + (heuristic(next_node) if heuristic else 0), next_cost,
+                                          next_node))
+        return distances, predecessors, best_node, best_cost
+
+    def path_edges(self, predecessors, node):
+        """
+        :return: list of directed edges from a source node to the given node
+        """
+        topology = self.topology
+        edges = []
+        e = predecessors[node]
+        while e != -1:
+            edges.append(e)
+            segment = topology.edge_segments[e]
+            node = topology.start_nodes[segment] if topology.edge_forward[e] == 1 else topology.end_nodes[segment]
+            e = predecessors[node]
+        edges.reverse()
+        return edges, node
+
+    def find_path(self, sources, targets, mode, criteria):
+        """
+        Finds the best path from one of the source nodes to one of the target nodes
+        :param sources: dictionary of source node and initial cost
+        :param targets: dictionary of target node and additional cost
+        :return: tuple of total cost, list of directed edges, source node and target node; the target node is None if
+                 there is no path
+        """
+        costs = self.edge_costs(mode, criteria)
+        heuristic = self.heuristic(mode, criteria, targets.keys())
+        distances, predecessors, best_node, best_cost = self.search(sources, costs, targets, heuristic=heuristic)
+        if best_node is None:
+            return math.inf, None, None, None
+        edges, source_node = self.path_edges(predecessors, best_node)
+        return best_cost, edges, source_node, best_node
+
+    def snap(self, x, y, mode):
+        return self.topology.nearest_segment(
+            x, y, lambda s: self.is_accessible(s, True, mode) or self.is_accessible(s, False, mode))
+
+    def route(self, start_x, start_y, end_x, end_y, mode='CAR', criteria='MIN_DURATION'):
+        """
+        Calculates the route between two WGS84 coordinates
+        :return: response in the format of the Graphium routing API ({'route': {...}}) or an error
+        """
+        start_time = time.time()
+        start = self.snap(start_x, start_y, mode)
+        end = self.snap(end_x, end_y, mode)
+        if start is None or end is None:
+            return {"error": {"msg": "No accessible segment found for routing mode " + mode}}
+        return self.route_between(start[0], start[1], end[0], end[1], mode, criteria, start_time)
+
+    def route_between(self, start_segment, start_fraction, end_segment, end_fraction, mode='CAR',
+                      criteria='MIN_DURATION', start_time=None):
+        """
+        Calculates the route between two positions on segments (fraction of the segment length)
+        """
+        if start_time is None:
+            start_time = time.time()
+        pieces = self.route_pieces(start_segment, start_fraction, end_segment, end_fraction, mode, criteria)
+        if pieces is None:
+            topology = self.topology
+            return {'route': {'length': 0, 'duration': 0, 'runtimeInMs': int((time.time() - start_time) * 1000),
+                              'graphName': topology.graph_name, 'graphVersion': topology.graph_version,
+                              'geometry': None, 'segments': []}}
+        return self.create_route(pieces, mode, criteria, start_time)
+
+    def route_pieces(self, start_segment, start_fraction, end_segment, end_fraction, mode, criteria,
+                     start_forward=None, end_forward=None):
+        """
+        Finds the best path between two positions on segments (fraction of the segment length)
+        :param start_forward: optional direction of travel on the start segment
+        :param end_forward: optional direction of travel on the end segment
+        :return: list of pieces of the path (segment, direction, start and end fraction in direction of the segment);
+                 None if there is no path
+        """
+        topology = self.topology
+
+        # the route leaves the start segment at one of its nodes and enters the end segment at one of its nodes
+        sources, source_forward = {}, {}
+        for forward, node, fraction in [(True, topology.end_nodes[start_segment], 1 - start_fraction),
+                                        (False, topology.start_nodes[start_segment], start_fraction)]:
+            if start_forward is not None and forward != start_forward:
+                continue
+            cost = fraction * self.segment_cost(start_segment, forward, mode, criteria)
+            if cost < sources.get(node, math.inf):
+                sources[node] = cost
+                source_forward[node] = forward
+        targets, target_forward = {}, {}
+        for forward, node, fraction in [(True, topology.start_nodes[end_segment], end_fraction),
+                                        (False, topology.end_nodes[end_segment], 1 - end_fraction)]:
+            if end_forward is not None and forward != end_forward:
+                continue
+            cost = fraction * self.segment_cost(end_segment, forward, mode, criteria)
+            if cost < targets.get(node, math.inf):
+                targets[node] = cost
+                target_forward[node] = forward
+
+        # both positions on the same segment
+        direct_cost, direct_forward = math.inf, True
+        if start_segment == end_segment:
+            if end_fraction >= start_fraction and start_forward is not False and end_forward is not False:
+                direct_cost = (end_fraction - start_fraction) * self.segment_cost(start_segment, True, mode, criteria)
+            if start_fraction >= end_fraction and start_forward is not True and end_forward is not True:
+                cost = (start_fraction - end_fraction) * self.segment_cost(start_segment, False, mode, criteria)
+                if cost < direct_cost:
+                    direct_cost, direct_forward = cost, False
+
+        sources = {node: cost for node, cost in sources.items() if cost < math.inf}
+        targets = {node: cost for node, cost in targets.items() if cost < math.inf}
+        best_cost, edges, source_node, best_node = math.inf, None, None, None
+        if sources and targets:
+            best_cost, edges, source_node, best_node = self.find_path(sources, targets, mode, criteria)
+
+        # pieces of the route: segment, direction, start and end fraction in direction of the segment
+        if direct_cost <= best_cost and direct_cost < math.inf:
+            pieces = [(start_segment, direct_forward, start_fraction, end_fraction)]
+        elif best_node is not None:
+            forward = source_forward[source_node]
+            pieces = [(start_segment, forward, start_fraction, 1.0 if forward else 0.0)]
+            for e in edges:
+                forward = topology.edge_forward[e] == 1
+                pieces.append((topology.edge_segments[e], forward, 0.0 if forward else 1.0, 1.0 if forward else 0.0))
+            forward = target_forward[best_node]
+            pieces.append((end_segment, forward, 0.0 if forward else 1.0, end_fraction))
+        else:
+            return None
+        return pieces
+
+    def create_route(self, pieces, mode, criteria, start_time):
+        topology = self.topology
+        length = 0.0
+        duration = 0.0
+        coordinates = []
+        segments = []
+        for segment, forward, from_fraction, to_fraction in pieces:
+            fraction = abs(to_fraction - from_fraction)
+            length += fraction * topology.lengths[segment]
+            duration += fraction * topology.lengths[segment] * 3.6 / \
+                self.speed(segment, forward, mode, 'MIN_DURATION' if criteria == 'LENGTH' else criteria)
+            part = self.cut_line(topology.segment_coordinates(segment), min(from_fraction, to_fraction),
+                                 max(from_fraction, to_fraction))
+            if not forward:
+                part.reverse()
+            coordinates.extend(part[1:] if coordinates and coordinates[-1] == part[0] else part)
+            # pieces of zero length at the start or end are not part of the route
+            if fraction > 0 or len(pieces) == 1:
+                if not segments or segments[-1]['id'] != topology.segment_ids[segment]:
+                    segments.append({'id': topology.segment_ids[segment], 'linkDirectionForward': forward})
+        if len(coordinates) == 1:
+            coordinates.append(coordinates[0])
+
+        return {'route': {
+            'length': round(length, 2),
+            'duration': int(round(duration)),
+            'runtimeInMs': int((time.time() - start_time) * 1000),
+            'graphName': topology.graph_name,
+            'graphVersion': topology.graph_version,
+            'geometry': 'LINESTRING (' + ', '.join([str(x) + ' ' + str(y) for x, y in coordinates]) + ')',
+            'segments': segments
+        }}
+
+    @staticmethod
+    def cut_line(coordinates, from_fraction, to_fraction):
+        """
+        :return: part of a line between two fractions of its length
+        """
+        if from_fraction <= 0 and to_fraction >= 1:
+            return list(coordinates)
+        lengths = [0.0]
+        for i in range(len(coordinates) - 1):
+            lengths.append(lengths[-1] + haversine(coordinates[i][0], coordinates[i][1], coordinates[i + 1][0],
+                                                   coordinates[i + 1][1]))
+        total = lengths[-1]
+        if total == 0:
+            return [coordinates[0], coordinates[0]]
+
+        def interpolate(distance):
+            for i in range(len(coordinates) - 1):
+                if lengths[i + 1] >= distance:
+                    part = lengths[i + 1] - lengths[i]
+                    t = (distance - lengths[i]) / part if part > 0 else 0.0
+                    return (coordinates[i][0] + t * (coordinates[i + 1][0] - coordinates[i][0]),
+                            coordinates[i][1] + t * (coordinates[i + 1][1] - coordinates[i][1]))
+            return coordinates[-1]
+
+        from_distance, to_distance = from_fraction * total, to_fraction * total
+        part = [interpolate(from_distance)]
+        part.extend([coordinates[i] for i in range(1, len(coordinates) - 1)
+                     if from_distance < lengths[i] < to_distance])
+        part.append(interpolate(to_distance))
+        return part
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ QGIS plugin 'Graphium'
+/***************************************************************************
+ *
+ * Copyright 2020 Simon Gröchenig @ Salzburg Research
+ * eMail     graphium@salzburgresearch.at
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ *
+ ***************************************************************************/
+"""
+
+import math
+# plugin
+from .travel_matrix import engine_of
+
+# Service areas (isochrones) on local graph files. This module must not import qgis, because service areas are
+# calculated in worker processes.
+
+
+def reachable_pieces(graph_file, mode, criteria, position, max_cost):
+    """
+    Calculates the segments which are reachable from a position within a maximum cost with a bounded one-to-all search
+    :param position: tuple of segment index and fraction of length along the segment
+    :param max_cost: maximum cost (meters for criteria LENGTH, otherwise seconds)
+    :return: list of reachable pieces (segment index, direction, fraction of length where the piece starts, cost at
+             the start of the piece, cost of the whole segment in this direction); the pieces are cut at max_cost
+    """
+    engine = engine_of(graph_file)
+    topology = engine.topology
+    costs = engine.edge_costs(mode, criteria)
+    segment, fraction = position
+
+    sources = engine.position_values(segment, fraction, mode, criteria, True)
+    settled = engine.tree(sources, mode, criteria, max_cost=max_cost)
+
+    # best piece per segment and direction
+    pieces = {}
+
+    def add_piece(piece_segment, forward, start_fraction, start_cost, segment_cost):
+        key = (piece_segment, forward)
+        if start_cost <= max_cost and (key not in pieces or start_cost < pieces[key][3]):
+            pieces[key] = (piece_segment, forward, start_fraction, start_cost, segment_cost)
+
+    for forward in (True, False):
+        segment_cost = engine.segment_cost(segment, forward, mode, criteria)
+        if segment_cost < math.inf:
+            add_piece(segment, forward, fraction, 0.0, segment_cost)
+    for node, (cost, _, _) in settled.items():
+        for e in topology.edges(node):
+            if costs[e] < math.inf:
+                forward = topology.edge_forward[e] == 1
+                add_piece(topology.edge_segments[e], forward, 0.0 if forward else 1.0, cost, costs[e])
+
+    # a direction which is completely reachable covers the other direction of the segment
+    def covers_segment(piece):
+        return piece[2] == (0.0 if piece[1] else 1.0) and \
+            piece_end_fraction(piece, max_cost) == (1.0 if piece[1] else 0.0)
+
+    result = []
+    for (piece_segment, forward), piece in pieces.items():
+        other = pieces.get((piece_segment, not forward))
+        if other is not None and covers_segment(other) and \
+                (not covers_segment(piece) or other[3] < piece[3] or (other[3] == piece[3] and other[1])):
+            continue
+        result.append(piece)
+    return result
+
+
+def piece_end_fraction(piece, cost_limit):
+    """
+    :return: fraction of length along the segment where a piece ends if it is cut at cost_limit
+    """
+    segment, forward, start_fraction, start_cost, segment_cost = piece
+    if segment_cost <= 0:
+        reach = 1.0
+    else:
+        reach = max(0.0, (cost_limit - start_cost) / segment_cost)
+    return min(1.0, start_fraction + reach) if forward else max(0.0, start_fraction - reach)
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ QGIS plugin 'Graphium'
+/***************************************************************************
+ *
+ * Copyright 2020 Simon Gröchenig @ Salzburg Research
+ * eMail     graphium@salzburgresearch.at
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ *
+ ***************************************************************************/
+"""
+
+import math
+# plugin
+from .routing_engine import RoutingEngine
+from ..graph_data.graph_topology import GraphTopologyCache
+
+# Travel matrices on local graph files. This module must not import qgis, because the rows of a matrix are calculated
+# in worker processes.
+
+# routing engines of the current process per graph file; edge costs are calculated once per process
+engines = {}
+
+
+def engine_of(graph_file):
+    topology = GraphTopologyCache.get(graph_file)
+    engine = engines.get(graph_file)
+    if engine is None or engine.topology is not topology:
+        engine = RoutingEngine(topology)
+        engines[graph_file] = engine
+    return engine
+
+
+def snap_points(graph_file, points, mode, max_distance=math.inf):
+    """
+    Snaps WGS84 coordinates to the nearest segment accessible by the routing mode
+    :param points: list of tuples (x, y); None for unknown coordinates
+    :return: list of tuples (segment index, fraction of length, distance); None if no segment has been found
+    """
+    engine = engine_of(graph_file)
+    index = engine.topology.spatial_index()
+
+    def accessible(s):
+        return engine.is_accessible(s, True, mode) or engine.is_accessible(s, False, mode)
+
+    positions = []
+    for point in points:
+        nearest = index.nearest(point[0], point[1], 1, accessible, max_distance) if point is not None else []
+        positions.append(nearest[0] if nearest else None)
+    return positions
+
+
+def matrix_rows(graph_file, mode, criteria, origins, destinations):
+    """
+    Calculates rows of a travel matrix with one search per origin
+    :param origins: list of positions (segment index, fraction of length); None for unknown positions
+    :param destinations: list of positions (segment index, fraction of length); None for unknown positions
+    :return: list of rows; a row is a list of tuples (length, duration) or None if the destination is not reachable
+    """
+    engine = engine_of(graph_file)
+    rows = []
+    for origin in origins:
+        if origin is None:
+            rows.append([None] * len(destinations))
+            continue
+        rows.append([(value[1], value[2]) if value is not None else None
+                     for value in engine.one_to_many(origin, destinations, mode, criteria)])
+    return rows